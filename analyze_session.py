@@ -4,147 +4,152 @@ Analyze a dive session and display detailed results
 """
 
 import sys
-import sqlite3
 from pathlib import Path
+import numpy as np
 
 # Add src to path
+sys.path.insert(0, str(Path(__file__).parent))
 sys.path.insert(0, str(Path(__file__).parent / 'src' / 'analysis'))
 
+from src.core.db import get_conn
 from dive_parser import DiveParser
 from velocity_analyzer import VelocityAnalyzer
 from phase_detector import PhaseDetector
 
+# Analyzers are stateless between dives, so build them once per process
+_velocity_analyzer = VelocityAnalyzer()
+_phase_detector = PhaseDetector()
+
 
 def print_dive_summary(dive):
     """Print detailed dive summary"""
-    print(f"\n{'='*70}")
-    print(f"🤿 DIVE #{dive.dive_number} - {dive.max_depth:.1f}m × {dive.duration:.0f}s")
-    print(f"{'='*70}")
+    lines = []
+    
+    lines.append(f"\n{'='*70}")
+    lines.append(f"🤿 DIVE #{dive.dive_number} - {dive.max_depth:.1f}m × {dive.duration:.0f}s")
+    lines.append(f"{'='*70}")
     
     # Basic metrics
-    print(f"\n📊 Metrics:")
-    print(f"  Max Depth: {dive.max_depth:.1f}m")
-    print(f"  Avg Depth: {dive.avg_depth:.1f}m")
-    print(f"  Duration: {dive.duration:.0f}s")
-    print(f"  Bottom Time: {dive.bottom_time:.0f}s")
-    print(f"  Surface Interval: {dive.surface_interval/60:.1f} min")
+    lines.append(f"\n📊 Metrics:")
+    lines.append(f"  Max Depth: {dive.max_depth:.1f}m")
+    lines.append(f"  Avg Depth: {dive.avg_depth:.1f}m")
+    lines.append(f"  Duration: {dive.duration:.0f}s")
+    lines.append(f"  Bottom Time: {dive.bottom_time:.0f}s")
+    lines.append(f"  Surface Interval: {dive.surface_interval/60:.1f} min")
     
     # Velocities
-    print(f"\n🏊 Velocities:")
+    lines.append(f"\n🏊 Velocities:")
     if dive.descent_rate:
-        print(f"  Descent: {dive.descent_rate:.2f} m/s (max: {dive.max_descent_rate:.2f} m/s)")
+        lines.append(f"  Descent: {dive.descent_rate:.2f} m/s (max: {dive.max_descent_rate:.2f} m/s)")
     if dive.ascent_rate:
-        print(f"  Ascent: {dive.ascent_rate:.2f} m/s (max: {dive.max_ascent_rate:.2f} m/s)")
+        lines.append(f"  Ascent: {dive.ascent_rate:.2f} m/s (max: {dive.max_ascent_rate:.2f} m/s)")
     
     if hasattr(dive, 'velocity_cv'):
-        print(f"  Velocity Variation: {dive.velocity_cv:.3f}")
+        lines.append(f"  Velocity Variation: {dive.velocity_cv:.3f}")
         if dive.velocity_cv > 0.3:
-            print(f"    → HIGH variation (FIM indicator)")
+            lines.append(f"    → HIGH variation (FIM indicator)")
         elif dive.velocity_cv < 0.15:
-            print(f"    → LOW variation (CNF indicator)")
+            lines.append(f"    → LOW variation (CNF indicator)")
     
     # Heart Rate
-    print(f"\n💓 Heart Rate:")
+    lines.append(f"\n💓 Heart Rate:")
     if dive.avg_hr:
-        print(f"  Average: {dive.avg_hr:.0f} bpm")
-        print(f"  Max: {dive.max_hr:.0f} bpm")
+        lines.append(f"  Average: {dive.avg_hr:.0f} bpm")
+        lines.append(f"  Max: {dive.max_hr:.0f} bpm")
         if dive.min_hr:
-            print(f"  Min: {dive.min_hr:.0f} bpm")
-            print(f"  Range: {dive.max_hr - dive.min_hr:.0f} bpm")
+            lines.append(f"  Min: {dive.min_hr:.0f} bpm")
+            lines.append(f"  Range: {dive.max_hr - dive.min_hr:.0f} bpm")
     
     # Phases
     if dive.phases:
-        print(f"\n⏱️  Phases:")
+        lines.append(f"\n⏱️  Phases:")
         
         for phase_name, phase_data in dive.phases.items():
-            print(f"\n  {phase_name.upper()}:")
-            print(f"    Duration: {phase_data.get('duration', 0):.1f}s")
-            print(f"    Depth: {phase_data.get('start_depth', 0):.1f}m → {phase_data.get('end_depth', 0):.1f}m")
+            lines.append(f"\n  {phase_name.upper()}:")
+            lines.append(f"    Duration: {phase_data.get('duration', 0):.1f}s")
+            lines.append(f"    Depth: {phase_data.get('start_depth', 0):.1f}m → {phase_data.get('end_depth', 0):.1f}m")
             
             if 'avg_velocity' in phase_data:
-                print(f"    Velocity: {phase_data['avg_velocity']:.2f} m/s (max: {phase_data.get('max_velocity', 0):.2f})")
+                lines.append(f"    Velocity: {phase_data['avg_velocity']:.2f} m/s (max: {phase_data.get('max_velocity', 0):.2f})")
             
             if 'avg_hr' in phase_data:
-                print(f"    HR: {phase_data['avg_hr']:.0f} bpm (range: {phase_data.get('min_hr', 0):.0f}-{phase_data.get('max_hr', 0):.0f})")
+                lines.append(f"    HR: {phase_data['avg_hr']:.0f} bpm (range: {phase_data.get('min_hr', 0):.0f}-{phase_data.get('max_hr', 0):.0f})")
                 
                 if 'hr_change' in phase_data:
                     change = phase_data['hr_change']
                     arrow = "↑" if change > 0 else "↓"
-                    print(f"    HR Change: {arrow} {abs(change):.0f} bpm")
+                    lines.append(f"    HR Change: {arrow} {abs(change):.0f} bpm")
     
     # Buoyancy analysis
-    va = VelocityAnalyzer()
-    buoyancy = va.get_buoyancy_indicators(dive)
+    buoyancy = _velocity_analyzer.get_buoyancy_indicators(dive)
     
     if buoyancy:
-        print(f"\n🎈 Buoyancy Analysis:")
+        lines.append(f"\n🎈 Buoyancy Analysis:")
         if 'avg_velocity_0_2m' in buoyancy:
-            print(f"  0-2m velocity: {buoyancy['avg_velocity_0_2m']:.2f} m/s")
+            lines.append(f"  0-2m velocity: {buoyancy['avg_velocity_0_2m']:.2f} m/s")
         if 'avg_velocity_2_5m' in buoyancy:
-            print(f"  2-5m velocity: {buoyancy['avg_velocity_2_5m']:.2f} m/s")
+            lines.append(f"  2-5m velocity: {buoyancy['avg_velocity_2_5m']:.2f} m/s")
         if 'acceleration' in buoyancy:
             accel = buoyancy['acceleration']
             if accel > 0.1:
-                print(f"  Acceleration: +{accel:.2f} m/s² → Positive buoyancy (Full lung?)")
+                lines.append(f"  Acceleration: +{accel:.2f} m/s² → Positive buoyancy (Full lung?)")
             else:
-                print(f"  Acceleration: {accel:.2f} m/s² → Neutral/negative buoyancy")
+                lines.append(f"  Acceleration: {accel:.2f} m/s² → Neutral/negative buoyancy")
     
     # Hints
-    pd = PhaseDetector()
-    hints = pd.detect_dive_type_hints(dive)
+    hints = _phase_detector.detect_dive_type_hints(dive)
     
     if hints:
-        print(f"\n🔍 Detection Hints:")
+        lines.append(f"\n🔍 Detection Hints:")
         for key, value in hints.items():
-            print(f"  {key}: {value}")
+            lines.append(f"  {key}: {value}")
+    
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def analyze_session_patterns(dives):
     """Analyze patterns across all dives in session"""
-    print(f"\n{'='*70}")
-    print(f"📈 SESSION ANALYSIS - {len(dives)} dives")
-    print(f"{'='*70}")
+    lines = []
+    
+    lines.append(f"\n{'='*70}")
+    lines.append(f"📈 SESSION ANALYSIS - {len(dives)} dives")
+    lines.append(f"{'='*70}")
     
     # HR analysis
-    avg_hrs = [d.avg_hr for d in dives if d.avg_hr]
+    hr_dives = [d for d in dives if d.avg_hr]
+    avg_hrs = np.fromiter((d.avg_hr for d in hr_dives), dtype=np.float64, count=len(hr_dives))
     
-    if avg_hrs:
-        import numpy as np
+    if avg_hrs.size:
+        session_avg = avg_hrs.mean()
         
-        print(f"\n💓 Heart Rate Patterns:")
-        print(f"  Session Avg: {np.mean(avg_hrs):.1f} bpm")
-        print(f"  Range: {min(avg_hrs):.0f} - {max(avg_hrs):.0f} bpm")
-        print(f"  Std Dev: {np.std(avg_hrs):.1f} bpm")
+        lines.append(f"\n💓 Heart Rate Patterns:")
+        lines.append(f"  Session Avg: {session_avg:.1f} bpm")
+        lines.append(f"  Range: {avg_hrs.min():.0f} - {avg_hrs.max():.0f} bpm")
+        lines.append(f"  Std Dev: {avg_hrs.std():.1f} bpm")
         
         # Look for FRC dives (significantly lower HR)
-        session_avg = np.mean(avg_hrs)
+        diffs = avg_hrs - session_avg
+        markers = np.where(diffs < -10, "  ← FRC/Exhale?",
+                           np.where(diffs > 10, "  ← High effort", ""))
         
-        print(f"\n  Dive-by-Dive HR:")
-        for dive in dives:
-            if dive.avg_hr:
-                diff = dive.avg_hr - session_avg
-                marker = ""
-                
-                if diff < -10:
-                    marker = "  ← FRC/Exhale?"
-                elif diff > 10:
-                    marker = "  ← High effort"
-                
-                print(f"    Dive {dive.dive_number}: {dive.avg_hr:.0f} bpm ({diff:+.0f}){marker}")
+        lines.append(f"\n  Dive-by-Dive HR:")
+        for dive, hr, diff, marker in zip(hr_dives, avg_hrs, diffs, markers):
+            lines.append(f"    Dive {dive.dive_number}: {hr:.0f} bpm ({diff:+.0f}){marker}")
     
     # Depth progression
-    print(f"\n📏 Depth Progression:")
+    lines.append(f"\n📏 Depth Progression:")
     for dive in dives:
-        print(f"  Dive {dive.dive_number}: {dive.max_depth:.1f}m")
+        lines.append(f"  Dive {dive.dive_number}: {dive.max_depth:.1f}m")
     
     # Velocity patterns
-    descent_rates = [d.descent_rate for d in dives if d.descent_rate]
+    descent_rates = np.fromiter((d.descent_rate for d in dives if d.descent_rate), dtype=np.float64)
+    
+    if descent_rates.size:
+        lines.append(f"\n🏊 Velocity Summary:")
+        lines.append(f"  Avg Descent Rate: {descent_rates.mean():.2f} m/s")
+        lines.append(f"  Range: {descent_rates.min():.2f} - {descent_rates.max():.2f} m/s")
     
-    if descent_rates:
-        import numpy as np
-        print(f"\n🏊 Velocity Summary:")
-        print(f"  Avg Descent Rate: {np.mean(descent_rates):.2f} m/s")
-        print(f"  Range: {min(descent_rates):.2f} - {max(descent_rates):.2f} m/s")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def main():
@@ -152,11 +157,8 @@ def main():
     
     # Get latest dive activity
     db_path = Path(__file__).parent / 'data' / 'freediving.db'
-    conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
-    cursor.execute("SELECT garmin_activity_id FROM activities WHERE activity_type = 'apnea_diving' ORDER BY id DESC LIMIT 1")
+    cursor = get_conn(db_path).execute("SELECT garmin_activity_id FROM activities WHERE activity_type = 'apnea_diving' ORDER BY id DESC LIMIT 1")
     activity_id = cursor.fetchone()[0]
-    conn.close()
     
     print(f"🤿 DIVE SESSION ANALYZER")
     print(f"Activity ID: {activity_id}\n")
@@ -3,19 +3,29 @@
 Check for new dive activities and send analysis to Discord
 """
 
-import sqlite3
-import json
 import sys
 from pathlib import Path
 from datetime import datetime
-import pandas as pd
+import numpy as np
 
 # Add parent directory
 sys.path.insert(0, str(Path(__file__).parent))
+from src.core.db import get_conn
+from src.core import jsonutil
 
 DB_PATH = Path(__file__).parent / 'data' / 'freediving.db'
 STATE_FILE = Path(__file__).parent / 'data' / 'last_checked_dive.txt'
 
+# Grading tables: a value scores the points of the highest bin edge it reaches
+_DEPTH_BINS = np.array([2.5, 3.5, 4.5])      # meters
+_DEPTH_POINTS = np.array([10, 20, 25, 30])
+_COUNT_BINS = np.array([3, 5, 8])            # dives per session
+_COUNT_POINTS = np.array([5, 15, 20, 25])
+_HR_BINS = np.array([70, 85])                # bpm, lower is better
+_HR_POINTS = np.array([25, 20, 10])
+_GRADE_BINS = np.array([60, 70, 80])
+_GRADES = np.array(["C 🟡", "B 👍", "B+ ✅", "A 🏆"])
+
 def get_last_checked_dive():
     """Get ID of last checked dive"""
     if STATE_FILE.exists():
@@ -31,7 +41,7 @@ def analyze_dive(dive_data):
     Quick dive analysis
     """
     try:
-        metadata = json.loads(dive_data['metadata']) if dive_data['metadata'] else {}
+        metadata = jsonutil.loads(dive_data['metadata']) if dive_data['metadata'] else {}
         
         max_depth = metadata.get('maxDepth', 0) / 100  # Convert cm to meters
         dive_count = metadata.get('diveCount', 0)
@@ -41,41 +51,12 @@ def analyze_dive(dive_data):
         location = metadata.get('locationName', 'Unknown')
         
         # Simple grading (pool diving: max 5m)
-        points = 0
-        
-        if max_depth >= 4.5:
-            points += 30
-        elif max_depth >= 3.5:
-            points += 25
-        elif max_depth >= 2.5:
-            points += 20
-        else:
-            points += 10
-        
-        if dive_count >= 8:
-            points += 25
-        elif dive_count >= 5:
-            points += 20
-        elif dive_count >= 3:
-            points += 15
-        else:
-            points += 5
-        
-        if avg_hr and avg_hr < 70:
-            points += 25
-        elif avg_hr and avg_hr < 85:
-            points += 20
-        else:
-            points += 10
-        
-        if points >= 80:
-            grade = "A 🏆"
-        elif points >= 70:
-            grade = "B+ ✅"
-        elif points >= 60:
-            grade = "B 👍"
-        else:
-            grade = "C 🟡"
+        points = int(
+            _DEPTH_POINTS[np.searchsorted(_DEPTH_BINS, max_depth, side='right')]
+            + _COUNT_POINTS[np.searchsorted(_COUNT_BINS, dive_count, side='right')]
+            + _HR_POINTS[np.searchsorted(_HR_BINS, avg_hr or np.inf, side='right')]
+        )
+        grade = str(_GRADES[np.searchsorted(_GRADE_BINS, points, side='right')])
         
         return {
             'location': location,
@@ -91,23 +72,20 @@ def analyze_dive(dive_data):
 
 def main():
     """Check for new dives"""
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = get_conn(DB_PATH)
     
-    # Get latest dive
-    df = pd.read_sql_query("""
-        SELECT * FROM activities 
+    # Get latest dive (only the columns the analysis reads)
+    latest_dive = conn.execute("""
+        SELECT id, start_time, avg_hr, metadata FROM activities 
         WHERE activity_type = 'apnea_diving'
         ORDER BY id DESC
         LIMIT 1
-    """, conn)
-    
-    conn.close()
+    """).fetchone()
     
-    if len(df) == 0:
+    if latest_dive is None:
         print("NO_NEW_DIVES")
         return
     
-    latest_dive = df.iloc[0]
     dive_id = latest_dive['id']
     last_checked = get_last_checked_dive()
     
@@ -124,7 +102,7 @@ def main():
         return
     
     # Format message
-    dive_time = pd.to_datetime(latest_dive['start_time'])
+    dive_time = datetime.fromisoformat(latest_dive['start_time'])
     
     message = f"""🤿 **NEW DIVE DETECTED!**
 
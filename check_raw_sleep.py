@@ -6,6 +6,7 @@ import json
 from dotenv import load_dotenv
 from garminconnect import Garmin
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
@@ -23,26 +24,36 @@ print("="*60)
 print("📊 Checking Garmin Connect for sleep data...")
 print("="*60)
 
-for i in range(3):
-    date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-    print(f"\n📅 {date}:")
-    
+def fetch_sleep(date):
+    """Fetch sleep data for one date, returning (data, error)"""
     try:
-        sleep_data = client.get_sleep_data(date)
-        if sleep_data:
-            print(f"  ✅ Sleep data available!")
-            print(f"  Keys: {list(sleep_data.keys())[:10]}")  # Show first 10 keys
-            
-            # Check for actual sleep metrics
-            if 'dailySleepDTO' in sleep_data:
-                sleep_dto = sleep_data['dailySleepDTO']
-                if sleep_dto:
-                    print(f"  Sleep Score: {sleep_dto.get('sleepScores', {}).get('overall', {}).get('value', 'N/A')}")
-                    print(f"  Duration: {sleep_dto.get('sleepTimeSeconds', 0)//60} min")
-        else:
-            print(f"  ❌ No sleep data")
+        return client.get_sleep_data(date), None
     except Exception as e:
-        print(f"  ⚠️  Error: {str(e)}")
+        return None, e
+
+
+# The three fetches are independent network round-trips, so run them together
+dates = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(3)]
+with ThreadPoolExecutor(max_workers=len(dates)) as executor:
+    results = list(executor.map(fetch_sleep, dates))
+
+for date, (sleep_data, error) in zip(dates, results):
+    print(f"\n📅 {date}:")
+    
+    if error is not None:
+        print(f"  ⚠️  Error: {str(error)}")
+    elif sleep_data:
+        print(f"  ✅ Sleep data available!")
+        print(f"  Keys: {list(sleep_data.keys())[:10]}")  # Show first 10 keys
+        
+        # Check for actual sleep metrics
+        if 'dailySleepDTO' in sleep_data:
+            sleep_dto = sleep_data['dailySleepDTO']
+            if sleep_dto:
+                print(f"  Sleep Score: {sleep_dto.get('sleepScores', {}).get('overall', {}).get('value', 'N/A')}")
+                print(f"  Duration: {sleep_dto.get('sleepTimeSeconds', 0)//60} min")
+    else:
+        print(f"  ❌ No sleep data")
 
 # Also check user sleep settings
 print("\n" + "="*60)
@@ -1,29 +1,36 @@
 #!/usr/bin/env python3
-import sqlite3
+import sys
+from itertools import groupby
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).parent))
+from src.core.db import get_conn
+
 DB_PATH = Path('data/freediving.db')
-conn = sqlite3.connect(DB_PATH)
+conn = get_conn(DB_PATH)
 cursor = conn.cursor()
 
-# Get all tables
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tables = cursor.fetchall()
+# Get all tables and their columns in one query
+cursor.execute("""
+    SELECT m.name AS table_name, p.name AS column_name, p.type AS column_type
+    FROM sqlite_master m
+    JOIN pragma_table_info(m.name) p
+    WHERE m.type = 'table'
+    ORDER BY m.rowid, p.cid
+""")
+columns = cursor.fetchall()
 
 print("📊 Database Schema\n" + "="*60)
-for table in tables:
-    table_name = table[0]
+for table_name, table_columns in groupby(columns, key=lambda c: c['table_name']):
+    table_columns = list(table_columns)
     print(f"\n🗂️  Table: {table_name}")
     print("-" * 60)
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    for col in columns:
-        print(f"  {col[1]:<20} {col[2]:<15}")
+    for col in table_columns:
+        print(f"  {col['column_name']:<20} {col['column_type']:<15}")
     
-    # Show sample row
-    cursor.execute(f"SELECT * FROM {table_name} LIMIT 1")
+    # Show sample row (first column only, that's all we print)
+    first_column = table_columns[0]['column_name']
+    cursor.execute(f'SELECT "{first_column}" FROM "{table_name}" LIMIT 1')
     sample = cursor.fetchone()
     if sample:
         print(f"\n  Sample data: {sample[0]}")
-
-conn.close()
@@ -1,56 +1,65 @@
 #!/usr/bin/env python3
 """Check sleep data history"""
 
-import sqlite3
+import sys
 from datetime import datetime
 from pathlib import Path
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent))
+from src.core.db import get_conn
 
 DB_PATH = Path('data/freediving.db')
-conn = sqlite3.connect(DB_PATH)
-conn.row_factory = sqlite3.Row
+conn = get_conn(DB_PATH)
 cursor = conn.cursor()
 
 print("\n" + "="*80)
 print("😴 SLEEP DATA HISTORY")
 print("="*80)
 
-# Get all health metrics with sleep data
-cursor.execute("""
+# Get all health metrics with sleep data; the window aggregates carry the
+# whole-table totals so they don't need a separate query
+metrics = pd.read_sql_query("""
     SELECT date, sleep_score, sleep_duration, sleep_deep, sleep_light, 
-           sleep_rem, sleep_awake, resting_hr, body_battery_charged
+           sleep_rem, sleep_awake, resting_hr, body_battery_charged,
+           COALESCE(sleep_score, 0) != 0 AS has_sleep,
+           COUNT(*) OVER () AS total_days,
+           SUM(sleep_score IS NOT NULL) OVER () AS total_with_sleep
     FROM health_metrics
     ORDER BY date DESC
     LIMIT 30
-""")
+""", conn)
+
+
+def fmt_col(values, fmt):
+    """Format a nullable integer column, 'N/A' where missing or zero"""
+    ints = values.fillna(0).astype(int)
+    return fmt(ints).where(ints != 0, 'N/A')
+
 
-metrics = cursor.fetchall()
+has_sleep = metrics['has_sleep'].astype(bool)
+
+table = pd.DataFrame({
+    'status': has_sleep.map({True: "✅", False: "❌"}),
+    'date': pd.to_datetime(metrics['date']).dt.strftime('%b %d').str.ljust(10),
+    'score': fmt_col(metrics['sleep_score'], lambda s: s.astype(str)).str.rjust(7),
+    'duration': fmt_col(metrics['sleep_duration'], lambda s: (s // 60).astype(str) + 'h ' + (s % 60).astype(str) + 'm').str.rjust(10),
+    'deep': fmt_col(metrics['sleep_deep'], lambda s: (s // 60).astype(str) + 'm').str.rjust(7),
+    'light': fmt_col(metrics['sleep_light'], lambda s: (s // 60).astype(str) + 'm').str.rjust(7),
+    'rem': fmt_col(metrics['sleep_rem'], lambda s: (s // 60).astype(str) + 'm').str.rjust(7),
+    'awake': fmt_col(metrics['sleep_awake'], lambda s: (s // 60).astype(str) + 'm').str.rjust(7),
+    'rhr': fmt_col(metrics['resting_hr'], lambda s: s.astype(str)).str.rjust(5),
+    'battery': fmt_col(metrics['body_battery_charged'], lambda s: s.astype(str) + '%').str.rjust(8),
+})
 
 print(f"\n{'Date':<12} {'Score':>7} {'Duration':>10} {'Deep':>7} {'Light':>7} {'REM':>7} {'Awake':>7} {'RHR':>5} {'Battery':>8}")
 print("-" * 80)
+if len(table):
+    print(table.apply(' '.join, axis=1).str.cat(sep='\n'))
 
-nights_with_sleep = 0
-nights_without_sleep = 0
-
-for m in metrics:
-    date = datetime.fromisoformat(m['date']).strftime('%b %d')
-    score = m['sleep_score'] if m['sleep_score'] else 'N/A'
-    duration = f"{m['sleep_duration']//60}h {m['sleep_duration']%60}m" if m['sleep_duration'] else 'N/A'
-    deep = f"{m['sleep_deep']//60}m" if m['sleep_deep'] else 'N/A'
-    light = f"{m['sleep_light']//60}m" if m['sleep_light'] else 'N/A'
-    rem = f"{m['sleep_rem']//60}m" if m['sleep_rem'] else 'N/A'
-    awake = f"{m['sleep_awake']//60}m" if m['sleep_awake'] else 'N/A'
-    rhr = m['resting_hr'] if m['resting_hr'] else 'N/A'
-    battery = f"{m['body_battery_charged']}%" if m['body_battery_charged'] else 'N/A'
-    
-    # Track nights with/without sleep
-    if m['sleep_score']:
-        nights_with_sleep += 1
-        status = "✅"
-    else:
-        nights_without_sleep += 1
-        status = "❌"
-    
-    print(f"{status} {date:<10} {str(score):>7} {str(duration):>10} {str(deep):>7} {str(light):>7} {str(rem):>7} {str(awake):>7} {str(rhr):>5} {str(battery):>8}")
+# Track nights with/without sleep
+nights_with_sleep = int(has_sleep.sum())
+nights_without_sleep = len(metrics) - nights_with_sleep
 
 print("\n" + "-" * 80)
 print(f"📊 Summary (last {len(metrics)} days):")
@@ -59,15 +68,11 @@ print(f"  ❌ Nights without sleep data: {nights_without_sleep}")
 print(f"  📈 Sleep tracking rate: {nights_with_sleep/len(metrics)*100:.1f}%")
 
 # Check if there's any sleep data at all
-cursor.execute("""
-    SELECT COUNT(*) as total, 
-           SUM(CASE WHEN sleep_score IS NOT NULL THEN 1 ELSE 0 END) as with_sleep
-    FROM health_metrics
-""")
-total_stats = cursor.fetchone()
+total_days = int(metrics['total_days'].iloc[0]) if len(metrics) else 0
+total_with_sleep = int(metrics['total_with_sleep'].iloc[0]) if len(metrics) else 0
 print(f"\n🗂️  Total database:")
-print(f"  Total days tracked: {total_stats['total']}")
-print(f"  Days with sleep data: {total_stats['with_sleep']}")
+print(f"  Total days tracked: {total_days}")
+print(f"  Days with sleep data: {total_with_sleep}")
 
 # Show best sleep nights
 print("\n🏆 BEST SLEEP NIGHTS:")
@@ -92,5 +97,3 @@ else:
     print("  No sleep data found")
 
 print("\n" + "="*80 + "\n")
-
-conn.close()
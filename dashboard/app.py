@@ -4,16 +4,18 @@ ApneaOS — Freediving Dashboard
 """
 
 import streamlit as st
-import sqlite3
 import pandas as pd
-import json
 import math
 import time as time_module
 from pathlib import Path
 import sys
-import subprocess
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.core import jsonutil
+from src.core.db import connect
+from src.core.css import minify_styles
 
 DB_PATH = Path(__file__).parent.parent / 'data' / 'freediving.db'
 
@@ -26,7 +28,7 @@ st.set_page_config(
 
 # ── Global CSS ──────────────────────────────────────────────────────────────
 # st.html() renders directly in the page (not iframe) in Streamlit ≥1.31
-st.html("""<script>
+GLOBAL_HTML = """<script>
 (function(){
   function apneaGo(href){
     var el=document.querySelector('.apnea');
@@ -272,29 +274,75 @@ footer, #MainMenu, .stDeployButton { display: none !important; }
   letter-spacing: 0.1em !important; text-transform: uppercase !important; font-size: 12px !important;
 }
 [data-testid="stButton"] > button:hover { filter: brightness(1.1) !important; }
-</style>""")
+</style>"""
+
+
+@st.cache_resource
+def global_html():
+    """GLOBAL_HTML with the stylesheet minified, built once per process"""
+    return minify_styles(GLOBAL_HTML)
+
+
+# Re-sent on every rerun (Streamlit removes elements a rerun doesn't emit)
+st.html(global_html())
 
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
+@st.cache_resource
 def get_db():
-    return sqlite3.connect(str(DB_PATH))
-
-@st.cache_data(ttl=60)
-def load_health():
+    # One connection per server process; autocommit since the dashboard only reads
+    return connect(DB_PATH, autocommit=True)
+
+@st.cache_resource
+def get_syncer():
+    # Reused across syncs so the Garmin client stays logged in and imports stay warm
+    from src.sync.garmin_sync import GarminSync
+    return GarminSync(), ThreadPoolExecutor(max_workers=1)
+
+def run_sync(timeout):
+    """Sync today's data in-process; raises FuturesTimeout after timeout seconds"""
+    syncer, executor = get_syncer()
+    executor.submit(syncer.sync_date, date.today()).result(timeout=timeout)
+
+def db_mtime():
+    """DB (and WAL) mtime — cache key so syncs from other processes show up"""
+    paths = (DB_PATH, DB_PATH.with_name(DB_PATH.name + '-wal'))
+    return max((p.stat().st_mtime for p in paths if p.exists()), default=0.0)
+
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def load_health(mtime, limit=30):
     try:
-        conn = get_db(); df = pd.read_sql_query("SELECT * FROM health_metrics ORDER BY date DESC", conn); conn.close(); return df
+        df = pd.read_sql_query(
+            "SELECT date, hrv_avg, sleep_score, body_battery_charged, stress_avg, resting_hr "
+            "FROM health_metrics ORDER BY date DESC LIMIT ?", get_db(), params=(limit,))
     except Exception: return pd.DataFrame()
+    # INTEGER columns fit float32 exactly (NaN when missing); hrv_avg is REAL and stays float64
+    return df.astype(dict.fromkeys(['sleep_score', 'body_battery_charged', 'stress_avg', 'resting_hr'], 'float32'))
 
-@st.cache_data(ttl=60)
-def load_dives():
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def load_dives(mtime):
     try:
-        conn = get_db(); df = pd.read_sql_query("SELECT * FROM activities WHERE activity_type='apnea_diving' ORDER BY start_time DESC", conn); conn.close(); return df
+        df = pd.read_sql_query(
+            "SELECT id, start_time, duration, avg_hr, max_hr, metadata "
+            "FROM activities WHERE activity_type='apnea_diving' ORDER BY start_time DESC", get_db(),
+            parse_dates=['start_time'])
     except Exception: return pd.DataFrame()
+    # Parse metadata once and lift the fields the screens aggregate over into columns
+    df['metadata']    = df['metadata'].map(parse_meta)
+    df['depth_m']     = df['metadata'].map(lambda m: m.get('maxDepth', 0)) / 100
+    df['dive_count']  = df['metadata'].map(lambda m: m.get('diveCount', 0))
+    df['bottom_time'] = df['metadata'].map(lambda m: m.get('bottomTime', 0))
+    return df
+
+def parse_meta(raw):
+    if not isinstance(raw, str) or not raw: return {}
+    try: return jsonutil.loads(raw)
+    except ValueError: return {}
 
 def meta(row):
-    try: return json.loads(row['metadata']) if pd.notna(row['metadata']) else {}
-    except: return {}
+    # metadata is parsed once in load_dives
+    return row['metadata']
 
 def safe_f(v): return float(v) if (v is not None and pd.notna(v) and v != '') else None
 
@@ -372,7 +420,7 @@ def dive_card_html(row, is_pb=False):
     dur_s   = float(row.get('duration', 0) or 0)
     dur_m   = int(dur_s // 60); dur_ss = int(dur_s % 60)
     loc     = m.get('locationName', 'Unknown').upper()
-    dt      = pd.to_datetime(row['start_time'])
+    dt      = row['start_time']
     date_s  = dt.strftime('%b %d, %H:%M').upper()
     bt      = m.get('bottomTime', 0)
     avg_d   = m.get('avgDepth', 0) / 100
@@ -424,8 +472,8 @@ def get_page():
 # ── Screens ──────────────────────────────────────────────────────────────────
 
 def screen_dashboard():
-    health_df = load_health()
-    dives_df  = load_dives()
+    health_df = load_health(db_mtime())
+    dives_df  = load_dives(db_mtime())
 
     score = 72
     hrv = sleep = bb = rhr = None
@@ -449,9 +497,9 @@ def screen_dashboard():
     # Dive cards (top 3)
     dive_html = ""
     if not dives_df.empty:
-        pb_depth = max((meta(r).get('maxDepth',0)/100 for _,r in dives_df.iterrows()), default=0)
-        for _, row in dives_df.head(3).iterrows():
-            d = meta(row).get('maxDepth',0)/100
+        pb_depth = dives_df['depth_m'].max()
+        for row in dives_df.head(3).to_dict('records'):
+            d = row['depth_m']
             dive_html += dive_card_html(row, is_pb=(d > 0 and abs(d - pb_depth) < 0.05))
     else:
         dive_html = '<div style="padding:24px;color:#6d7685;font-size:14px">No dive data yet. Sync your Garmin watch.</div>'
@@ -480,7 +528,7 @@ def screen_dashboard():
 
 
 def screen_log():
-    dives_df = load_dives()
+    dives_df = load_dives(db_mtime())
     filt = st.query_params.get("log_filter", "ALL")
     periods = [("ALL","All Time"), ("1M","This Month"), ("3M","Last 3 Months"), ("DEEP","5m+ Dives")]
 
@@ -492,28 +540,29 @@ def screen_log():
     cards_html = ""
     if not dives_df.empty:
         dives_df = dives_df.copy()
-        dives_df['_dt'] = pd.to_datetime(dives_df['start_time'])
+        dives_df['_dt'] = dives_df['start_time']
         now = pd.Timestamp.now()
         if filt == "1M":
             dives_df = dives_df[dives_df['_dt'].dt.month == now.month]
         elif filt == "3M":
             dives_df = dives_df[dives_df['_dt'] >= now - pd.Timedelta(days=90)]
         elif filt == "DEEP":
-            dives_df = dives_df[dives_df.apply(lambda r: meta(r).get('maxDepth',0)/100 >= 4.0, axis=1)]
+            dives_df = dives_df[dives_df['depth_m'] >= 4.0]
 
         if dives_df.empty:
             cards_html = '<div style="padding:48px 24px;text-align:center;color:#6d7685">No sessions match this filter.</div>'
         else:
-            pb_depth = max((meta(r).get('maxDepth',0)/100 for _,r in dives_df.iterrows()), default=0)
+            pb_depth = dives_df['depth_m'].max()
             dives_df['_month'] = dives_df['_dt'].dt.strftime('%B %Y')
+            month_counts = dives_df['_month'].value_counts()
             cur_month = None
-            for _, row in dives_df.iterrows():
+            for row in dives_df.to_dict('records'):
                 month = row['_month']
                 if month != cur_month:
-                    cnt = len(dives_df[dives_df['_month'] == month])
+                    cnt = month_counts[month]
                     cards_html += f'<div class="mh"><span class="mh-t">{month}</span><span class="mh-c">{cnt} SESSION{"S" if cnt!=1 else ""}</span></div>'
                     cur_month = month
-                d = meta(row).get('maxDepth',0)/100
+                d = row['depth_m']
                 cards_html += dive_card_html(row, is_pb=(d > 0 and abs(d - pb_depth) < 0.05))
     else:
         cards_html = '<div style="padding:48px 24px;text-align:center;color:#6d7685">No dive sessions yet.</div>'
@@ -536,11 +585,11 @@ def build_protocols(dives_df):
     # Derive training targets from actual data
     avg_bt = 60.0; max_bt = 90.0; pb_m = 3.0
     if not dives_df.empty:
-        bts = [meta(r).get('bottomTime', 0) for _, r in dives_df.head(10).iterrows() if meta(r).get('bottomTime',0) > 0]
-        depths = [meta(r).get('maxDepth',0)/100 for _, r in dives_df.iterrows()]
-        if bts:   avg_bt = sum(bts)/len(bts)
-        if bts:   max_bt = max(bts)
-        if depths: pb_m = max(depths)
+        bts = dives_df['bottom_time'].head(10)
+        bts = bts[bts > 0]
+        if len(bts): avg_bt = bts.mean()
+        if len(bts): max_bt = bts.max()
+        pb_m = dives_df['depth_m'].max()
 
     # CO2 table: 8 sets, target hold ≈ 80% avg bottom time, rest decreasing
     co2_hold = max(60, round(avg_bt * 0.8 / 15) * 15)
@@ -589,7 +638,7 @@ def build_protocols(dives_df):
 
 
 def screen_protocol():
-    dives_df = load_dives()
+    dives_df = load_dives(db_mtime())
     protos   = build_protocols(dives_df)
     sel      = st.query_params.get("proto", None)
 
@@ -724,13 +773,11 @@ def screen_active():
 
 
 def screen_profile():
-    dives_df = load_dives()
+    dives_df = load_dives(db_mtime())
     total_dives = 0; pb_depth = 0.0
     if not dives_df.empty:
-        for _, row in dives_df.iterrows():
-            m = meta(row); total_dives += m.get('diveCount',0)
-            d = m.get('maxDepth',0)/100
-            if d > pb_depth: pb_depth = d
+        total_dives = int(dives_df['dive_count'].sum())
+        pb_depth = max(pb_depth, dives_df['depth_m'].max())
 
     html = f"""<div class="apnea">
 {topbar_html("PROFILE")}
@@ -764,14 +811,12 @@ def screen_profile():
     with col:
         if st.button("🔄  SYNC GARMIN DATA", use_container_width=True):
             with st.spinner("Syncing..."):
-                venv_py = str(Path(__file__).parent.parent / 'venv' / 'bin' / 'python')
-                script  = str(Path(__file__).parent.parent / 'src' / 'sync' / 'garmin_sync.py')
                 try:
-                    res = subprocess.run([venv_py, script, '--today'], capture_output=True, text=True, timeout=30)
-                    if res.returncode == 0:
-                        load_health.clear(); load_dives.clear(); st.success("Synced!"); st.rerun()
-                    else: st.error(f"Sync failed: {res.stderr[:200]}")
-                except Exception as e: st.error(str(e))
+                    run_sync(timeout=30)
+                except FuturesTimeout: st.error("Sync timed out")
+                except Exception as e: st.error(f"Sync failed: {str(e)[:200]}")
+                else:
+                    load_health.clear(); load_dives.clear(); st.success("Synced!"); st.rerun()
 
 
 # ── Screenshot helper (debug) ─────────────────────────────────────────────────
@@ -801,17 +846,14 @@ if st.query_params.get("action") == "sync":
     if "action" in st.query_params:
         del st.query_params["action"]
     with st.spinner("Syncing Garmin data..."):
-        venv_py = str(Path(__file__).parent.parent / 'venv' / 'bin' / 'python')
-        script  = str(Path(__file__).parent.parent / 'src' / 'sync' / 'garmin_sync.py')
         try:
-            res = subprocess.run([venv_py, script, '--today'], capture_output=True, text=True, timeout=60)
-            load_health.clear(); load_dives.clear()
-            if res.returncode == 0:
-                st.toast("Garmin sync complete!", icon="✅")
-            else:
-                st.toast(f"Sync failed: {res.stderr[:120]}", icon="⚠️")
+            run_sync(timeout=60)
+            st.toast("Garmin sync complete!", icon="✅")
+        except FuturesTimeout:
+            st.toast("Sync timed out", icon="⚠️")
         except Exception as e:
-            st.toast(str(e), icon="⚠️")
+            st.toast(f"Sync failed: {str(e)[:120]}", icon="⚠️")
+        load_health.clear(); load_dives.clear()
     st.rerun()
 
 # ── Router ────────────────────────────────────────────────────────────────────
@@ -4,17 +4,19 @@ Garmin Freediving Coach - Dashboard (Mobile-Optimized)
 """
 
 import streamlit as st
-import sqlite3
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
+import numpy as np
 from datetime import date, timedelta, datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from pathlib import Path
-import json
 import sys
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.core.lttb import lttb
+from src.core import jsonutil
+from src.core.db import connect
+from src.core.css import minify_styles
 
 # Mobile-friendly page config
 st.set_page_config(
@@ -28,7 +30,7 @@ st.set_page_config(
 )
 
 # Custom CSS for mobile responsiveness
-st.markdown("""
+CSS = """
 <style>
     /* Mobile optimizations */
     @media (max-width: 768px) {
@@ -76,47 +78,255 @@ st.markdown("""
         margin: 0.5rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_resource
+def page_css():
+    """CSS minified once per process; still emitted on every rerun"""
+    return minify_styles(CSS)
+
+
+st.markdown(page_css(), unsafe_allow_html=True)
 
 # Database connection
 DB_PATH = Path(__file__).parent.parent / 'data' / 'freediving.db'
 
+@st.cache_resource
 def get_db_connection():
-    """Get SQLite database connection"""
-    return sqlite3.connect(str(DB_PATH))
+    """Get the shared SQLite connection (opened once per server process)"""
+    conn = connect(DB_PATH, autocommit=True)
+    # Dashboard-owned table for stored dive analyses (created once, not per insert)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS dive_analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            activity_id INTEGER REFERENCES activities(id),
+            analysis_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            overall_grade TEXT,
+            insights JSON,
+            recommendations JSON,
+            stats JSON,
+            safety_notes JSON
+        );
+        -- Per-dive lookups from load_activities
+        CREATE INDEX IF NOT EXISTS idx_dive_analysis_activity ON dive_analysis(activity_id);
+    """)
+    return conn
+
+@st.cache_resource
+def get_syncer():
+    """Long-lived GarminSync (keeps its logged-in client) and the thread it runs on"""
+    from src.sync.garmin_sync import GarminSync
+    return GarminSync(), ThreadPoolExecutor(max_workers=1)
+
+def run_sync(timeout):
+    """Sync today's data in this process; raises FuturesTimeout after timeout seconds"""
+    syncer, executor = get_syncer()
+    executor.submit(syncer.sync_date, date.today()).result(timeout=timeout)
 
-def load_health_metrics():
-    """Load all health metrics"""
+def db_mtime():
+    """Last-modified time of the database (including its WAL file)
+
+    Passed to the cached loaders so a sync from any process invalidates them.
+    """
+    paths = (DB_PATH, DB_PATH.with_name(DB_PATH.name + '-wal'))
+    return max((p.stat().st_mtime for p in paths if p.exists()), default=0.0)
+
+# INTEGER health columns: float32 holds them exactly (NaN when missing) in
+# half the memory of the float64 read_sql_query produces. hrv_avg is REAL
+# and stays float64 so chart hover values don't pick up rounding noise.
+HEALTH_INT_COLUMNS = ['sleep_score', 'sleep_duration', 'body_battery_charged', 'stress_avg', 'resting_hr']
+
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def load_health_metrics(mtime, limit=30):
+    """Load the most recent health metrics (newest first)"""
     conn = get_db_connection()
     df = pd.read_sql_query("""
-        SELECT * FROM health_metrics 
+        SELECT date, hrv_avg, sleep_score, sleep_duration,
+               body_battery_charged, stress_avg, resting_hr, synced_at
+        FROM health_metrics 
         ORDER BY date DESC
-    """, conn)
-    conn.close()
+        LIMIT ?
+    """, conn, params=(limit,))
+    df = df.astype(dict.fromkeys(HEALTH_INT_COLUMNS, 'float32'))
+    df['readiness'] = readiness_series(df)
     return df
 
-def load_activities():
-    """Load all activities"""
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def load_activities(mtime, limit=None):
+    """Load apnea activities (newest first) with their stored analysis; limit=None loads all"""
     conn = get_db_connection()
     df = pd.read_sql_query("""
-        SELECT * FROM activities 
-        ORDER BY start_time DESC
-    """, conn)
-    conn.close()
-    return df
+        SELECT a.id, a.activity_type, a.start_time, a.duration, a.avg_hr, a.max_hr, a.metadata,
+               da.overall_grade, da.insights, da.recommendations, da.stats, da.safety_notes
+        FROM activities a
+        LEFT JOIN dive_analysis da
+            ON da.id = (SELECT MAX(id) FROM dive_analysis WHERE activity_id = a.id)
+        WHERE a.activity_type = 'apnea_diving'
+        ORDER BY a.start_time DESC
+        LIMIT ?
+    """, conn, params=(-1 if limit is None else limit,), parse_dates=['start_time'])
+    # Stored analysis as a dict (None for dives not analyzed yet)
+    analysis_cols = ['overall_grade', 'insights', 'recommendations', 'stats', 'safety_notes']
+    df['analysis'] = [
+        None if pd.isna(grade) else {
+            'overall_grade': grade,
+            'insights': jsonutil.loads(insights),
+            'recommendations': jsonutil.loads(recommendations),
+            'stats': jsonutil.loads(stats),
+            'safety_notes': jsonutil.loads(safety_notes),
+        }
+        for grade, insights, recommendations, stats, safety_notes
+        in zip(*(df[col] for col in analysis_cols))
+    ]
+    df = df.drop(columns=analysis_cols)
+    # Parse metadata once here (cached) instead of on every render, and
+    # expand the fields the pages use into m_* columns
+    df['metadata'] = df['metadata'].map(parse_metadata)
+    fields = pd.json_normalize(df['metadata'].tolist(), max_level=0)
+    fields = fields.reindex(columns=list(METADATA_FIELDS)).fillna(METADATA_FIELDS)
+    fields['diveCount'] = fields['diveCount'].astype(int)
+    fields.index = df.index
+    return df.join(fields.add_prefix('m_'))
+
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def load_recent_dive_cards(mtime, limit=3):
+    """Overview dive cards: only the grade and top 3 insights are pulled out of the JSON"""
+    conn = get_db_connection()
+    df = pd.read_sql_query("""
+        SELECT a.id, a.start_time,
+               CASE WHEN json_valid(a.metadata) THEN json_extract(a.metadata, '$.maxDepth') END AS max_depth,
+               CASE WHEN json_valid(a.metadata) THEN json_extract(a.metadata, '$.diveCount') END AS dive_count,
+               da.overall_grade,
+               json_extract(da.insights, '$[0]') AS insight_0,
+               json_extract(da.insights, '$[1]') AS insight_1,
+               json_extract(da.insights, '$[2]') AS insight_2
+        FROM activities a
+        LEFT JOIN dive_analysis da
+            ON da.id = (SELECT MAX(id) FROM dive_analysis WHERE activity_id = a.id)
+        WHERE a.activity_type = 'apnea_diving'
+        ORDER BY a.start_time DESC
+        LIMIT ?
+    """, conn, params=(limit,), parse_dates=['start_time'])
+    df[['max_depth', 'dive_count']] = df[['max_depth', 'dive_count']].fillna(0)
+    insight_cols = ['insight_0', 'insight_1', 'insight_2']
+    df['insights'] = [
+        [jsonutil.loads(i) for i in row if isinstance(i, str)]
+        for row in df[insight_cols].itertuples(index=False)
+    ]
+    return df.drop(columns=insight_cols)
+
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def fetch_recent_health(mtime, n=7):
+    """Most recent n health rows as NumPy arrays (newest first)
+
+    For the few rows the Overview needs this skips read_sql_query's
+    DataFrame construction. Missing values are NaN.
+    """
+    cursor = get_db_connection().execute("""
+        SELECT date, hrv_avg, sleep_score, sleep_duration,
+               body_battery_charged, stress_avg, resting_hr
+        FROM health_metrics
+        ORDER BY date DESC
+        LIMIT ?
+    """, (n,))
+    rows = cursor.fetchall()
+    
+    columns = {}
+    for i, (name, *_) in enumerate(cursor.description):
+        if name == 'date':
+            columns[name] = np.array([row[i] for row in rows], dtype=object)
+        else:
+            columns[name] = np.fromiter(
+                (np.nan if row[i] is None else row[i] for row in rows),
+                dtype=np.float64, count=len(rows)
+            )
+    return columns
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def load_health_summary(mtime):
+    """Last sync time plus averages/counts over the 7 most recent days, in one query"""
+    cursor = get_db_connection().execute("""
+        SELECT (SELECT MAX(synced_at) FROM health_metrics) AS last_sync,
+               AVG(hrv_avg) AS hrv_avg, COUNT(hrv_avg) AS hrv_count,
+               AVG(resting_hr) AS resting_hr, COUNT(resting_hr) AS resting_hr_count
+        FROM (SELECT hrv_avg, resting_hr FROM health_metrics ORDER BY date DESC LIMIT 7)
+    """)
+    names = [col[0] for col in cursor.description]
+    return dict(zip(names, cursor.fetchone()))
+
+# Activity metadata fields expanded by load_activities, with their defaults
+METADATA_FIELDS = {
+    'maxDepth': 0,
+    'avgDepth': 0,
+    'diveCount': 0,
+    'bottomTime': 0,
+    'minTemperature': 0,
+    'surfaceInterval': 0,
+    'locationName': 'Unknown',
+}
+
+def parse_metadata(raw):
+    """Parse an activity's metadata JSON; missing or invalid metadata gives {}"""
+    if not isinstance(raw, str) or not raw:
+        return {}
+    try:
+        return jsonutil.loads(raw)
+    except ValueError:
+        return {}
+
+# Grading tables: a value falls in the tier of the highest bin edge it reaches
+_DEPTH_BINS = np.array([2.5, 3.5, 4.5])  # meters
+_DEPTH_TIERS = [
+    ("🟡", "Depth: {:.1f}m. Shallow training - focus on equalization.", 10),
+    ("✅", "Moderate depth: {:.1f}m. Building comfort.", 20),
+    ("🎯", "Strong depth: {:.1f}m. Good depth utilization.", 25),
+    ("🏆", "Maximum depth reached: {:.1f}m! Using full pool depth.", 30),
+]
+_COUNT_BINS = np.array([3, 5, 8])  # dives per session
+_COUNT_TIERS = [
+    ("⚠️", "Low volume: {} dives. Consider more repetitions.", 5),
+    ("✓", "{} dives - adequate for skill maintenance.", 15),
+    ("👍", "Good volume: {} dives. Balanced session.", 20),
+    ("💪", "High volume: {} dives! Great training stimulus.", 25),
+]
+_HR_BINS = np.array([70, 85])  # bpm, lower is better
+_HR_TIERS = [
+    ("❤️", "Excellent HR control: {} bpm average. Very relaxed!", 25),
+    ("✅", "Good HR: {} bpm. Decent relaxation level.", 20),
+    ("🟡", "Elevated HR: {} bpm. Work on relaxation techniques.", 10),
+]
+_BOTTOM_BINS = np.array([10, 15])  # seconds per dive
+_BOTTOM_TIERS = [
+    None,
+    ("✓", "Decent bottom time: {:.1f}s average", 15),
+    ("⏱️", "Strong bottom time: {:.1f}s average per dive", 20),
+]
+_GRADE_BINS = np.array([60, 70, 80, 90])  # points
+_GRADE_TIERS = [
+    ("C 🟡", "Build volume gradually. Quality over depth at this stage"),
+    ("B 👍", "Good foundation. Increase dive count for better conditioning"),
+    ("B+ ✅", "Solid session. Focus on heart rate control for next level"),
+    ("A 🎯", "Excellent work! Maintain this consistency for steady progress"),
+    ("A+ 🏆", "Outstanding session! Consider progressive depth increases (+2-3m)"),
+]
+
+def _tier(bins, tiers, value):
+    """Look up the tier for value in a grading table"""
+    return tiers[np.searchsorted(bins, value, side='right')]
 
 def analyze_dive(dive_data):
     """
     Comprehensive dive analysis with AI insights
     
     Args:
-        dive_data: Row from activities DataFrame
+        dive_data: Row from load_activities (itertuples namedtuple or Series)
         
     Returns:
         dict: Analysis results with insights and recommendations
     """
     analysis = {
-        'timestamp': dive_data['start_time'],
+        'timestamp': dive_data.start_time,
         'overall_grade': '',
         'insights': [],
         'recommendations': [],
@@ -125,18 +335,16 @@ def analyze_dive(dive_data):
     }
     
     try:
-        metadata = json.loads(dive_data['metadata']) if pd.notna(dive_data['metadata']) else {}
-        
         # Extract key metrics (Garmin returns depth in centimeters)
-        max_depth = metadata.get('maxDepth', 0) / 100  # Convert cm to meters
-        avg_depth = metadata.get('avgDepth', 0) / 100  # Convert cm to meters
-        dive_count = metadata.get('diveCount', 0)
-        bottom_time = metadata.get('bottomTime', 0)
-        duration = dive_data['duration'] / 60 if pd.notna(dive_data['duration']) else 0
-        avg_hr = dive_data['avg_hr']
-        max_hr = dive_data['max_hr']
-        water_temp = metadata.get('minTemperature', 0)
-        surface_interval = metadata.get('surfaceInterval', 0) / 1000  # Convert to seconds
+        max_depth = dive_data.m_maxDepth / 100  # Convert cm to meters
+        avg_depth = dive_data.m_avgDepth / 100  # Convert cm to meters
+        dive_count = dive_data.m_diveCount
+        bottom_time = dive_data.m_bottomTime
+        duration = dive_data.duration / 60 if pd.notna(dive_data.duration) else 0
+        avg_hr = dive_data.avg_hr
+        max_hr = dive_data.max_hr
+        water_temp = dive_data.m_minTemperature
+        surface_interval = dive_data.m_surfaceInterval / 1000  # Convert to seconds
         
         analysis['stats'] = {
             'max_depth': max_depth,
@@ -155,57 +363,34 @@ def analyze_dive(dive_data):
         
         # 1. Depth Analysis (pool diving: max 5m)
         if max_depth > 0:
-            if max_depth >= 4.5:
-                analysis['insights'].append(("🏆", f"Maximum depth reached: {max_depth:.1f}m! Using full pool depth."))
-                points += 30
-            elif max_depth >= 3.5:
-                analysis['insights'].append(("🎯", f"Strong depth: {max_depth:.1f}m. Good depth utilization."))
-                points += 25
-            elif max_depth >= 2.5:
-                analysis['insights'].append(("✅", f"Moderate depth: {max_depth:.1f}m. Building comfort."))
-                points += 20
-            else:
-                analysis['insights'].append(("🟡", f"Depth: {max_depth:.1f}m. Shallow training - focus on equalization."))
-                points += 10
+            icon, template, tier_points = _tier(_DEPTH_BINS, _DEPTH_TIERS, max_depth)
+            analysis['insights'].append((icon, template.format(max_depth)))
+            points += tier_points
         
         # 2. Volume Analysis (dive count)
         if dive_count > 0:
-            if dive_count >= 8:
-                analysis['insights'].append(("💪", f"High volume: {dive_count} dives! Great training stimulus."))
-                points += 25
-            elif dive_count >= 5:
-                analysis['insights'].append(("👍", f"Good volume: {dive_count} dives. Balanced session."))
-                points += 20
-            elif dive_count >= 3:
-                analysis['insights'].append(("✓", f"{dive_count} dives - adequate for skill maintenance."))
-                points += 15
-            else:
-                analysis['insights'].append(("⚠️", f"Low volume: {dive_count} dives. Consider more repetitions."))
-                points += 5
+            icon, template, tier_points = _tier(_COUNT_BINS, _COUNT_TIERS, dive_count)
+            analysis['insights'].append((icon, template.format(dive_count)))
+            points += tier_points
         
         # 3. Heart Rate Efficiency
         if avg_hr and max_hr:
             hr_range = max_hr - avg_hr
-            if avg_hr < 70:
-                analysis['insights'].append(("❤️", f"Excellent HR control: {avg_hr} bpm average. Very relaxed!"))
-                points += 25
-            elif avg_hr < 85:
-                analysis['insights'].append(("✅", f"Good HR: {avg_hr} bpm. Decent relaxation level."))
-                points += 20
-            else:
-                analysis['insights'].append(("🟡", f"Elevated HR: {avg_hr} bpm. Work on relaxation techniques."))
-                points += 10
+            tier = _tier(_HR_BINS, _HR_TIERS, avg_hr)
+            icon, template, tier_points = tier
+            analysis['insights'].append((icon, template.format(avg_hr)))
+            points += tier_points
+            if tier is _HR_TIERS[-1]:
                 analysis['recommendations'].append("Practice box breathing (4-4-4-4) to lower resting HR during dives")
         
         # 4. Bottom Time
         if bottom_time > 0:
             avg_bottom_per_dive = bottom_time / dive_count if dive_count > 0 else 0
-            if avg_bottom_per_dive >= 15:
-                analysis['insights'].append(("⏱️", f"Strong bottom time: {avg_bottom_per_dive:.1f}s average per dive"))
-                points += 20
-            elif avg_bottom_per_dive >= 10:
-                analysis['insights'].append(("✓", f"Decent bottom time: {avg_bottom_per_dive:.1f}s average"))
-                points += 15
+            tier = _tier(_BOTTOM_BINS, _BOTTOM_TIERS, avg_bottom_per_dive)
+            if tier:
+                icon, template, tier_points = tier
+                analysis['insights'].append((icon, template.format(avg_bottom_per_dive)))
+                points += tier_points
         
         # 5. Safety Check - Surface Intervals
         if surface_interval > 0:
@@ -228,21 +413,8 @@ def analyze_dive(dive_data):
                 analysis['insights'].append(("☀️", f"Warm water: {water_temp}°C. Comfortable conditions."))
         
         # Overall Grade
-        if points >= 90:
-            analysis['overall_grade'] = "A+ 🏆"
-            analysis['recommendations'].append("Outstanding session! Consider progressive depth increases (+2-3m)")
-        elif points >= 80:
-            analysis['overall_grade'] = "A 🎯"
-            analysis['recommendations'].append("Excellent work! Maintain this consistency for steady progress")
-        elif points >= 70:
-            analysis['overall_grade'] = "B+ ✅"
-            analysis['recommendations'].append("Solid session. Focus on heart rate control for next level")
-        elif points >= 60:
-            analysis['overall_grade'] = "B 👍"
-            analysis['recommendations'].append("Good foundation. Increase dive count for better conditioning")
-        else:
-            analysis['overall_grade'] = "C 🟡"
-            analysis['recommendations'].append("Build volume gradually. Quality over depth at this stage")
+        analysis['overall_grade'], grade_rec = _tier(_GRADE_BINS, _GRADE_TIERS, points)
+        analysis['recommendations'].append(grade_rec)
         
         # Training Recommendations
         if dive_count < 5:
@@ -261,64 +433,45 @@ def analyze_dive(dive_data):
     
     return analysis
 
-def store_dive_analysis(dive_id, analysis):
-    """Store dive analysis in database"""
+def store_dive_analyses(analyses):
+    """Store (dive_id, analysis) pairs in database, in one transaction"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if dive_analysis table exists, create if not
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS dive_analysis (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            activity_id INTEGER REFERENCES activities(id),
-            analysis_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-            overall_grade TEXT,
-            insights JSON,
-            recommendations JSON,
-            stats JSON,
-            safety_notes JSON
+    rows = [
+        (
+            int(dive_id),
+            analysis['overall_grade'],
+            jsonutil.dumps(analysis['insights']),
+            jsonutil.dumps(analysis['recommendations']),
+            jsonutil.dumps(analysis['stats']),
+            jsonutil.dumps(analysis['safety_notes'])
         )
-    """)
+        for dive_id, analysis in analyses
+    ]
     
-    # Insert analysis
-    cursor.execute("""
-        INSERT INTO dive_analysis 
-        (activity_id, overall_grade, insights, recommendations, stats, safety_notes)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
-        dive_id,
-        analysis['overall_grade'],
-        json.dumps(analysis['insights']),
-        json.dumps(analysis['recommendations']),
-        json.dumps(analysis['stats']),
-        json.dumps(analysis['safety_notes'])
-    ))
-    
-    conn.commit()
-    conn.close()
+    # The connection is in autocommit mode; group the inserts into one commit
+    conn.execute("BEGIN")
+    try:
+        conn.executemany("""
+            INSERT INTO dive_analysis 
+            (activity_id, overall_grade, insights, recommendations, stats, safety_notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
-def get_last_analyzed_dive():
-    """Get ID of last analyzed dive"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if table exists
-    cursor.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name='dive_analysis'
-    """)
-    
-    if not cursor.fetchone():
-        conn.close()
-        return None
-    
-    cursor.execute("""
-        SELECT MAX(activity_id) FROM dive_analysis
-    """)
-    result = cursor.fetchone()
-    conn.close()
-    
-    return result[0] if result else None
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def analyze_dive_by_id(mtime, dive_id):
+    """analyze_dive for one apnea activity, cached per dive and data version"""
+    dives = load_activities(mtime)
+    return analyze_dive(dives[dives['id'] == dive_id].iloc[0])
+
+def get_dive_analysis(dive):
+    """Stored analysis for a load_activities row, analyzing it if there is none yet"""
+    if dive.analysis is not None:
+        return dive.analysis
+    return analyze_dive_by_id(db_mtime(), int(dive.id))
 
 def calculate_readiness(row):
     """Calculate readiness score from health metrics"""
@@ -351,47 +504,230 @@ def calculate_readiness(row):
     
     return score, factors
 
-# Sidebar - Compact for mobile
-with st.sidebar:
-    st.title("🤿 Coach")
-    
+def readiness_series(df):
+    """Vectorized calculate_readiness score for every row of a health frame
+
+    Same weights as calculate_readiness; missing components contribute 0.
+    Use calculate_readiness when the per-factor breakdown is needed.
+    """
+    hrv = (df['hrv_avg'] / 80 * 100).clip(upper=100).fillna(0)
+    sleep = df['sleep_score'].fillna(0)
+    bb = df['body_battery_charged'].fillna(0)
+    stress = (100 - df['stress_avg']).clip(lower=0).fillna(0)
+    return hrv * 0.4 + sleep * 0.3 + bb * 0.2 + stress * 0.1
+
+def _hrv_vs_week(today, summary):
+    """Today's HRV relative to the 7-day average (needs 3+ readings)"""
+    if today['hrv'] > 0 and summary['hrv_count'] >= 3:
+        return today['hrv'] / summary['hrv_avg']
+    return None
+
+# Overview insights: (applies(today, summary), message(today, summary)), in display order
+INSIGHT_RULES = [
+    # HRV insight
+    (lambda t, s: (_hrv_vs_week(t, s) or 0) > 1.1,
+     lambda t, s: f"🟢 HRV +{((_hrv_vs_week(t, s) - 1) * 100):.0f}% above avg - excellent!"),
+    (lambda t, s: (_hrv_vs_week(t, s) or 1) < 0.9,
+     lambda t, s: f"🟡 HRV -{((1 - _hrv_vs_week(t, s)) * 100):.0f}% below avg - consider rest"),
+    # Sleep insight
+    (lambda t, s: t['sleep_hrs'] >= 8,
+     lambda t, s: f"🟢 {t['sleep_hrs']:.1f}h sleep - optimal!"),
+    (lambda t, s: 0 < t['sleep_hrs'] < 7,
+     lambda t, s: f"🔴 {t['sleep_hrs']:.1f}h sleep - affects breath-hold by ~20%"),
+]
+
+# Widget-driven sections run as fragments: interacting with them reruns only
+# the fragment, not the whole page (data loads, insights, other charts)
+@st.fragment
+def sync_panel():
+    """Sidebar sync button and last sync time"""
     # Sync button
     if st.button("🔄 Sync", use_container_width=True):
         with st.spinner("Syncing..."):
-            import subprocess
-            
-            venv_python = str(Path(__file__).parent.parent / 'venv' / 'bin' / 'python')
-            sync_script = str(Path(__file__).parent.parent / 'src' / 'sync' / 'garmin_sync.py')
-            
             try:
-                result = subprocess.run(
-                    [venv_python, sync_script, '--today'],
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                )
-                
-                if result.returncode == 0:
-                    st.success("✅ Synced!")
-                    st.rerun()
-                else:
-                    st.error(f"❌ Failed")
-            except:
+                run_sync(timeout=30)
+            except FuturesTimeout:
                 st.error("⏱️ Timeout")
-    
+            except Exception:
+                st.error(f"❌ Failed")
+            else:
+                load_health_metrics.clear()
+                load_health_summary.clear()
+                load_activities.clear()
+                st.success("✅ Synced!")
+                st.rerun()
+
     # Last sync time
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT MAX(synced_at) FROM health_metrics")
-        last_sync = cursor.fetchone()[0]
-        conn.close()
+        last_sync = load_health_summary(db_mtime())['last_sync']
         
         if last_sync:
             sync_time = datetime.fromisoformat(last_sync)
             st.caption(f"🕐 {sync_time.strftime('%b %d, %I:%M %p')}")
     except:
         pass
+
+@st.fragment
+def render_dive_table(apnea_activities):
+    """Dive Log table with the analysis of the selected session"""
+    # One table for all sessions; details render only for the selected row
+    display_df = pd.DataFrame({
+        'Date': apnea_activities['start_time'].dt.strftime('%b %d, %Y %I:%M %p'),
+        'Location': apnea_activities['m_locationName'],
+        'Max Depth (m)': apnea_activities['m_maxDepth'] / 100,
+        'Dives': apnea_activities['m_diveCount'],
+        'Duration (min)': apnea_activities['duration'] / 60,
+        'Avg HR': apnea_activities['avg_hr'],
+    })
+        
+    selection = st.dataframe(
+        display_df,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'Max Depth (m)': st.column_config.NumberColumn(format="%.1f"),
+            'Duration (min)': st.column_config.NumberColumn(format="%.0f"),
+        },
+        on_select="rerun",
+        selection_mode="single-row",
+    )
+        
+    selected_rows = selection.selection.rows
+    if selected_rows:
+        dive = apnea_activities.iloc[selected_rows[0]]
+        
+        try:
+            st.subheader(f"📅 {display_df['Date'].iloc[selected_rows[0]]} - {display_df['Location'].iloc[selected_rows[0]]}")
+            
+            # Generate analysis
+            analysis = get_dive_analysis(dive)
+            
+            # Grade banner
+            st.markdown(f"<div class='dive-card'><h2>Grade: {analysis['overall_grade']}</h2></div>", 
+                       unsafe_allow_html=True)
+            
+            # Stats grid - mobile friendly
+            cols = st.columns(2)
+            stats = analysis['stats']
+            
+            with cols[0]:
+                st.metric("Max Depth", f"{stats['max_depth']:.1f}m")
+                st.metric("Dives", f"{stats['dive_count']}")
+                st.metric("Avg HR", f"{stats['avg_hr']} bpm")
+            
+            with cols[1]:
+                st.metric("Duration", f"{stats['duration_min']:.0f} min")
+                st.metric("Water Temp", f"{stats['water_temp']:.0f}°C")
+                st.metric("Bottom Time", f"{stats['bottom_time']:.0f}s")
+            
+            # Safety Notes
+            if analysis['safety_notes']:
+                st.warning("### ⚠️ Safety Notes")
+                for note in analysis['safety_notes']:
+                    st.markdown(note)
+            
+            # Insights
+            st.markdown("### 📊 Performance Insights")
+            for icon, insight in analysis['insights']:
+                st.markdown(f"<div class='analysis-card'>{icon} {insight}</div>", 
+                           unsafe_allow_html=True)
+            
+            # Recommendations
+            if analysis['recommendations']:
+                st.markdown("### 💡 Recommendations")
+                for rec in analysis['recommendations']:
+                    st.markdown(f"- {rec}")
+            
+            with st.expander("Raw metadata", expanded=False):
+                st.json(dive.metadata)
+            
+        except Exception as e:
+            st.error(f"Error loading dive: {str(e)}")
+    else:
+        st.caption("Select a session to see its analysis")
+
+@st.cache_data(ttl=300, max_entries=8, show_spinner=False)
+def build_health_figures(mtime, days_back):
+    """Build the Health page figures once per data version and period"""
+    # Only the Health page plots, so plotly is imported here rather than at
+    # startup for every page
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    
+    # Streamlit serializes figures through plotly.io.to_json; the orjson engine
+    # writes NumPy trace arrays directly instead of converting them to lists
+    if jsonutil.orjson is not None:
+        pio.json.config.default_engine = 'orjson'
+    
+    recent_health = load_health_metrics(mtime).head(days_back).sort_values('date')
+    
+    hrv_x, hrv_y = lttb(recent_health['date'], recent_health['hrv_avg'])
+    
+    fig_hrv = go.Figure()
+    fig_hrv.add_trace(go.Scattergl(
+        x=hrv_x,
+        y=hrv_y,
+        mode='lines+markers',
+        name='HRV',
+        line=dict(color='#FF6B6B', width=2),
+        marker=dict(size=4)
+    ))
+    
+    fig_hrv.update_layout(
+        xaxis_title="",
+        yaxis_title="HRV (ms)",
+        height=250,
+        margin=dict(l=20, r=20, t=20, b=20),
+        hovermode='x unified',
+        transition={'duration': 0},  # redraw without animation
+        uirevision='static'  # keep zoom/pan across reruns
+    )
+    
+    sleep_x, sleep_y = lttb(recent_health['date'], recent_health['sleep_score'])
+    
+    fig_sleep = go.Figure()
+    fig_sleep.add_trace(go.Bar(
+        x=sleep_x,
+        y=sleep_y,
+        name='Score',
+        marker_color='#4ECDC4'
+    ))
+    
+    fig_sleep.update_layout(
+        xaxis_title="",
+        yaxis_title="Score",
+        yaxis_range=[0, 100],
+        height=250,
+        margin=dict(l=20, r=20, t=20, b=20),
+        hovermode='x unified',
+        transition={'duration': 0},
+        uirevision='static'
+    )
+    
+    return fig_hrv, fig_sleep
+
+@st.fragment
+def render_health_charts(mtime):
+    """Health page charts for the selected period"""
+    # Compact date selector
+    days_back = st.selectbox("Period", [7, 14, 30], index=0)
+    
+    fig_hrv, fig_sleep = build_health_figures(mtime, days_back)
+    
+    # HRV Trend - Mobile optimized
+    st.subheader("HRV Trend")
+    st.plotly_chart(fig_hrv, use_container_width=True)
+    st.caption("💡 Higher = better recovery")
+    
+    # Sleep Quality
+    st.subheader("Sleep Quality")
+    st.plotly_chart(fig_sleep, use_container_width=True)
+
+# Sidebar - Compact for mobile
+with st.sidebar:
+    st.title("🤿 Coach")
+    
+    sync_panel()
     
     st.divider()
     
@@ -403,18 +739,19 @@ with st.sidebar:
         "📈 Training"
     ], label_visibility="collapsed")
 
-# Load data
-health_df = load_health_metrics()
-activities_df = load_activities()
-
-# Main content
+# Main content (each page loads only the data it renders)
 if page == "📊 Overview":
     st.title("📊 Dashboard")
+    recent_health = fetch_recent_health(db_mtime(), n=1)
+    recent_dives = load_recent_dive_cards(db_mtime(), limit=3)
     
     # Today's readiness - Mobile optimized
-    if len(health_df) > 0:
-        latest = health_df.iloc[0]
-        readiness_score, factors = calculate_readiness(latest)
+    if len(recent_health['date']) > 0:
+        latest = {name: values[0] for name, values in recent_health.items()}
+        readiness_score, _ = calculate_readiness(latest)
+        
+        # 7-day averages (and sample counts) shared by all insights
+        summary = load_health_summary(db_mtime())
         
         # Compact metrics for mobile
         cols = st.columns(2)
@@ -441,24 +778,9 @@ if page == "📊 Overview":
         # AI Insights - Compact
         st.subheader("💡 Today's Insights")
         
-        insights = []
-        
-        # HRV insight
-        if hrv_val > 0:
-            recent_hrv = health_df.head(7)['hrv_avg'].dropna()
-            if len(recent_hrv) >= 3:
-                avg_hrv = recent_hrv.mean()
-                if hrv_val > avg_hrv * 1.1:
-                    insights.append(f"🟢 HRV +{((hrv_val/avg_hrv - 1) * 100):.0f}% above avg - excellent!")
-                elif hrv_val < avg_hrv * 0.9:
-                    insights.append(f"🟡 HRV -{((1 - hrv_val/avg_hrv) * 100):.0f}% below avg - consider rest")
-        
-        # Sleep insight
-        if sleep_hrs > 0:
-            if sleep_hrs >= 8:
-                insights.append(f"🟢 {sleep_hrs:.1f}h sleep - optimal!")
-            elif sleep_hrs < 7:
-                insights.append(f"🔴 {sleep_hrs:.1f}h sleep - affects breath-hold by ~20%")
+        today = {'hrv': hrv_val, 'sleep_hrs': sleep_hrs}
+        insights = [message(today, summary) for applies, message in INSIGHT_RULES
+                    if applies(today, summary)]
         
         # Display insights
         for insight in insights:
@@ -469,23 +791,25 @@ if page == "📊 Overview":
         # Recent dives
         st.subheader("Recent Dives")
         
-        apnea_activities = activities_df[activities_df['activity_type'] == 'apnea_diving'].head(3)
-        
-        if len(apnea_activities) > 0:
-            for _, dive in apnea_activities.iterrows():
+        if len(recent_dives) > 0:
+            for dive in recent_dives.itertuples(index=False):
                 try:
-                    metadata = json.loads(dive['metadata']) if pd.notna(dive['metadata']) else {}
-                    max_depth = metadata.get('maxDepth', 0)
-                    dive_count = metadata.get('diveCount', 0)
+                    max_depth = dive.max_depth
+                    dive_count = int(dive.dive_count)
                     
-                    dive_date = pd.to_datetime(dive['start_time']).strftime('%b %d')
+                    dive_date = dive.start_time.strftime('%b %d')
                     
                     with st.expander(f"🤿 {dive_date} - {max_depth:.0f}m × {dive_count}", expanded=False):
-                        analysis = analyze_dive(dive)
+                        if pd.notna(dive.overall_grade):
+                            grade, insights = dive.overall_grade, dive.insights
+                        else:
+                            # Not analyzed yet (the Dive Log stores analyses); grade it here
+                            analysis = analyze_dive_by_id(db_mtime(), int(dive.id))
+                            grade, insights = analysis['overall_grade'], analysis['insights']
                         
-                        st.markdown(f"### Grade: {analysis['overall_grade']}")
+                        st.markdown(f"### Grade: {grade}")
                         
-                        for icon, insight in analysis['insights'][:3]:  # Top 3 insights
+                        for icon, insight in insights[:3]:  # Top 3 insights
                             st.markdown(f"{icon} {insight}")
                 except:
                     pass
@@ -494,141 +818,42 @@ if page == "📊 Overview":
 
 elif page == "🤿 Dive Log":
     st.title("🤿 Dive Log")
-    
-    apnea_activities = activities_df[activities_df['activity_type'] == 'apnea_diving']
+    # load_activities already filters to apnea_diving in SQL
+    apnea_activities = load_activities(db_mtime())
     
     if len(apnea_activities) > 0:
         st.caption(f"📊 Total sessions: {len(apnea_activities)}")
         
         # Check for new dives and analyze
-        last_analyzed = get_last_analyzed_dive()
+        new_dives = apnea_activities[apnea_activities['analysis'].isna()]
         
-        for idx, dive in apnea_activities.iterrows():
-            dive_id = dive['id']
+        if len(new_dives) > 0:
+            st.info("🔍 Analyzing new dives...")
+            analyses = [(dive.id, get_dive_analysis(dive)) for dive in new_dives.itertuples(index=False)]
+            store_dive_analyses(analyses)
             
-            # Auto-analyze new dives
-            if last_analyzed is None or dive_id > last_analyzed:
-                st.info("🔍 Analyzing new dive...")
-                analysis = analyze_dive(dive)
-                store_dive_analysis(dive_id, analysis)
-                
-                # Notify user
-                st.balloons()
+            # Notify user
+            st.balloons()
+            for _, analysis in analyses:
                 st.success(f"✅ New dive analyzed! Grade: {analysis['overall_grade']}")
-            
-            try:
-                metadata = json.loads(dive['metadata']) if pd.notna(dive['metadata']) else {}
-                max_depth = metadata.get('maxDepth', 0)
-                dive_count = metadata.get('diveCount', 0)
-                location = metadata.get('locationName', 'Unknown')
-                
-                dive_date = pd.to_datetime(dive['start_time']).strftime('%b %d, %Y %I:%M %p')
-                
-                with st.expander(f"📅 {dive_date} - {location}", expanded=False):
-                    # Generate analysis
-                    analysis = analyze_dive(dive)
-                    
-                    # Grade banner
-                    st.markdown(f"<div class='dive-card'><h2>Grade: {analysis['overall_grade']}</h2></div>", 
-                               unsafe_allow_html=True)
-                    
-                    # Stats grid - mobile friendly
-                    cols = st.columns(2)
-                    stats = analysis['stats']
-                    
-                    with cols[0]:
-                        st.metric("Max Depth", f"{stats['max_depth']:.1f}m")
-                        st.metric("Dives", f"{stats['dive_count']}")
-                        st.metric("Avg HR", f"{stats['avg_hr']} bpm")
-                    
-                    with cols[1]:
-                        st.metric("Duration", f"{stats['duration_min']:.0f} min")
-                        st.metric("Water Temp", f"{stats['water_temp']:.0f}°C")
-                        st.metric("Bottom Time", f"{stats['bottom_time']:.0f}s")
-                    
-                    # Safety Notes
-                    if analysis['safety_notes']:
-                        st.warning("### ⚠️ Safety Notes")
-                        for note in analysis['safety_notes']:
-                            st.markdown(note)
-                    
-                    # Insights
-                    st.markdown("### 📊 Performance Insights")
-                    for icon, insight in analysis['insights']:
-                        st.markdown(f"<div class='analysis-card'>{icon} {insight}</div>", 
-                                   unsafe_allow_html=True)
-                    
-                    # Recommendations
-                    if analysis['recommendations']:
-                        st.markdown("### 💡 Recommendations")
-                        for rec in analysis['recommendations']:
-                            st.markdown(f"- {rec}")
-                    
-            except Exception as e:
-                st.error(f"Error loading dive: {str(e)}")
+        
+        render_dive_table(apnea_activities)
     else:
         st.info("No dive sessions found. Sync your watch!")
 
 elif page == "💓 Health":
     st.title("💓 Health Metrics")
+    mtime = db_mtime()
     
-    if len(health_df) > 0:
-        # Compact date selector
-        days_back = st.selectbox("Period", [7, 14, 30], index=0)
-        
-        recent_health = health_df.head(days_back).sort_values('date')
-        
-        # HRV Trend - Mobile optimized
-        st.subheader("HRV Trend")
-        
-        fig_hrv = go.Figure()
-        fig_hrv.add_trace(go.Scatter(
-            x=recent_health['date'],
-            y=recent_health['hrv_avg'],
-            mode='lines+markers',
-            name='HRV',
-            line=dict(color='#FF6B6B', width=2),
-            marker=dict(size=4)
-        ))
-        
-        fig_hrv.update_layout(
-            xaxis_title="",
-            yaxis_title="HRV (ms)",
-            height=250,
-            margin=dict(l=20, r=20, t=20, b=20),
-            hovermode='x unified'
-        )
-        
-        st.plotly_chart(fig_hrv, use_container_width=True)
-        st.caption("💡 Higher = better recovery")
-        
-        # Sleep Quality
-        st.subheader("Sleep Quality")
-        
-        fig_sleep = go.Figure()
-        fig_sleep.add_trace(go.Bar(
-            x=recent_health['date'],
-            y=recent_health['sleep_score'],
-            name='Score',
-            marker_color='#4ECDC4'
-        ))
-        
-        fig_sleep.update_layout(
-            xaxis_title="",
-            yaxis_title="Score",
-            yaxis_range=[0, 100],
-            height=250,
-            margin=dict(l=20, r=20, t=20, b=20),
-            hovermode='x unified'
-        )
-        
-        st.plotly_chart(fig_sleep, use_container_width=True)
+    if len(fetch_recent_health(mtime, n=1)['date']) > 0:
+        render_health_charts(mtime)
 
 elif page == "📈 Training":
     st.title("📈 Training Plan")
+    recent_health = fetch_recent_health(db_mtime(), n=1)
     
-    if len(health_df) > 0:
-        latest = health_df.iloc[0]
+    if len(recent_health['date']) > 0:
+        latest = {name: values[0] for name, values in recent_health.items()}
         readiness_score, _ = calculate_readiness(latest)
         
         # Training recommendation based on readiness
@@ -7,17 +7,27 @@ to train the AI classification system.
 """
 
 import streamlit as st
-import sqlite3
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
 from datetime import datetime, date
 from pathlib import Path
 import sys
-import json
+import threading
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from src.core.baseline_manager import BaselineManager
+from src.core.db import connect
+from src.core import jsonutil
+from src.core.lttb import lttb
+from src.core.css import minify_styles
+
+# Streamlit serializes figures through plotly.io.to_json; the orjson engine
+# writes NumPy trace arrays directly instead of converting them to lists
+if jsonutil.orjson is not None:
+    pio.json.config.default_engine = 'orjson'
 
 # Page config
 st.set_page_config(
@@ -27,7 +37,7 @@ st.set_page_config(
 )
 
 # Mobile CSS
-st.markdown("""
+CSS = """
 <style>
     @media (max-width: 768px) {
         .block-container {
@@ -53,15 +63,35 @@ st.markdown("""
         border-left: 4px solid #ffc107;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_resource
+def page_css():
+    """CSS minified once per process; still emitted on every rerun"""
+    return minify_styles(CSS)
+
+
+st.markdown(page_css(), unsafe_allow_html=True)
 
 # Database path
 DB_PATH = Path(__file__).parent.parent.parent / "garmin_coach.db"
 
-def get_unlabeled_dives(limit=20):
-    """Get dives that need labeling"""
-    conn = sqlite3.connect(DB_PATH)
-    query = """
+@st.cache_resource
+def get_db_connection():
+    """Get the shared SQLite connection (opened once per server process)"""
+    return connect(DB_PATH, autocommit=True)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_unlabeled_dives(limit=20, show_labeled=False):
+    """Get dives that need labeling (cached; cleared when labels are saved)
+
+    Labeled dives are filtered out in SQL unless show_labeled, so LIMIT
+    counts only the dives that will be shown.
+    """
+    conn = get_db_connection()
+    where = "" if show_labeled else "WHERE manual_discipline IS NULL AND manual_lung_volume IS NULL"
+    query = f"""
         SELECT 
             id, activity_id, dive_number, start_time,
             max_depth, total_duration, bottom_duration,
@@ -71,65 +101,136 @@ def get_unlabeled_dives(limit=20):
             ai_lung_volume, ai_lung_confidence,
             manual_discipline, manual_lung_volume, manual_notes
         FROM dive_sessions_enhanced
+        {where}
         ORDER BY 
             CASE WHEN manual_discipline IS NULL AND manual_lung_volume IS NULL THEN 0 ELSE 1 END,
             start_time DESC
         LIMIT ?
     """
-    df = pd.read_sql_query(query, conn, params=(limit,))
-    conn.close()
-    return df
+    # Plain dicts: the page walks the rows one by one, so a DataFrame (and
+    # iterrows) only adds overhead. Missing values stay None.
+    dives = [dict(row) for row in conn.execute(query, (limit,))]
+    # Card timestamps are formatted here, once per cache fill, not per render
+    for dive in dives:
+        dive['start_time_display'] = (
+            datetime.fromisoformat(dive['start_time']).strftime("%b %d, %Y %H:%M")
+            if dive['start_time'] else ""
+        )
+    return dives
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_calibration_progress(_manager):
+    """Calibration progress (cached like the dive list; cleared when labels or baselines change)"""
+    return _manager.get_calibration_progress()
 
 def label_dive(dive_id, discipline=None, lung_volume=None, notes=""):
-    """Save manual labels for a dive"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""
+    """Save manual labels for a dive
+
+    Returns the stored (manual_discipline, manual_lung_volume) row, or None
+    when no dive has that id. The write commits on its own (autocommit).
+    """
+    conn = get_db_connection()
+    # fetchall runs the statement to completion so the autocommit lands now
+    rows = conn.execute("""
         UPDATE dive_sessions_enhanced
         SET manual_discipline = ?,
             manual_lung_volume = ?,
             manual_notes = ?,
             labeled_at = ?
         WHERE id = ?
-    """, (discipline, lung_volume, notes, datetime.now().isoformat(), dive_id))
-    conn.commit()
-    conn.close()
+        RETURNING manual_discipline, manual_lung_volume
+    """, (discipline, lung_volume, notes, datetime.now().isoformat(), dive_id)).fetchall()
+    return rows[0] if rows else None
+
+# Saves within this many seconds of each other share one baseline recompute
+BASELINE_DEBOUNCE_S = 5.0
+
+@st.cache_resource
+def get_baseline_timer():
+    """Pending debounced baseline recompute (one per server process)"""
+    return {'timer': None, 'lock': threading.Lock()}
+
+def recompute_baselines():
+    """Recompute baselines on a connection of their own
 
+    Runs on the timer thread or the script thread. The page's cached
+    connection is shared by every session and thread, so the recompute's
+    write transaction could not stay isolated on it.
+    """
+    manager = BaselineManager(str(DB_PATH))
+    try:
+        return manager.update_user_baselines()
+    finally:
+        manager.close()
+        load_calibration_progress.clear()
+
+def _flush_baselines():
+    """Debounced recompute (timer thread)"""
+    recompute_baselines()
+
+def schedule_baseline_update():
+    """Recompute baselines BASELINE_DEBOUNCE_S after the last label save
+
+    Recomputing scans every labeled dive, so it runs off the script thread
+    and a burst of saves is coalesced into a single recompute.
+    """
+    state = get_baseline_timer()
+    with state['lock']:
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        state['timer'] = threading.Timer(BASELINE_DEBOUNCE_S, _flush_baselines)
+        state['timer'].daemon = True
+        state['timer'].start()
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
 def get_dive_profile_data(dive_id):
     """Get time-series data for visualization"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.execute("""
         SELECT depth_profile, velocity_profile, hr_profile
         FROM dive_sessions_enhanced
         WHERE id = ?
     """, (dive_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if row:
         return {
-            'depth': json.loads(row[0]) if row[0] else None,
-            'velocity': json.loads(row[1]) if row[1] else None,
-            'hr': json.loads(row[2]) if row[2] else None
+            'depth': _profile_array(row[0]),
+            'velocity': _profile_array(row[1]),
+            'hr': _profile_array(row[2])
         }
     return None
 
-def plot_dive_profile(dive_id):
-    """Plot dive depth, velocity, and HR"""
+def _profile_array(raw):
+    """JSON profile column as a float64 array (None when missing or empty)
+
+    Arrays rather than lists: the cached value is copied on every read and
+    the traces are computed on them without per-sample Python loops.
+    """
+    values = jsonutil.loads(raw) if raw else None
+    return np.asarray(values, dtype=np.float64) if values else None
+
+@st.cache_data(ttl=300, max_entries=32, show_spinner=False)
+def build_profile_figures(dive_id):
+    """Depth figure and velocity/HR figure (None when neither exists), built once per dive
+
+    Returns None when the dive has no depth profile.
+    """
     data = get_dive_profile_data(dive_id)
     
-    if not data or not data['depth']:
-        st.info("No profile data available for this dive")
-        return
+    if not data or data['depth'] is None:
+        return None
     
-    depth = data['depth']
-    time_axis = list(range(len(depth)))
+    # Profiles are 1 Hz samples, so the sample index is the time in seconds;
+    # long sessions are downsampled to a bounded number of points
+    depth_t, depth = lttb(np.arange(len(data['depth'])), data['depth'])
     
     fig = go.Figure()
     
     # Depth (inverted Y-axis)
-    fig.add_trace(go.Scatter(
-        x=time_axis,
-        y=[-d for d in depth],
+    fig.add_trace(go.Scattergl(
+        x=depth_t,
+        y=-depth,
         name="Depth (m)",
         line=dict(color='#1f77b4', width=3),
         fill='tonexty',
@@ -142,27 +243,30 @@ def plot_dive_profile(dive_id):
         yaxis_title="Depth (m)",
         height=300,
         margin=dict(l=20, r=20, t=40, b=20),
-        hovermode='x unified'
+        hovermode='x unified',
+        transition={'duration': 0},  # redraw without animation
+        uirevision='static'  # keep zoom/pan across reruns
     )
     
-    st.plotly_chart(fig, use_container_width=True)
-    
     # Velocity & HR (if available)
-    if data['velocity'] or data['hr']:
+    fig2 = None
+    if data['velocity'] is not None or data['hr'] is not None:
         fig2 = go.Figure()
         
-        if data['velocity']:
-            fig2.add_trace(go.Scatter(
-                x=time_axis[:len(data['velocity'])],
-                y=data['velocity'],
+        if data['velocity'] is not None:
+            velocity_t, velocity = lttb(np.arange(len(data['velocity'])), data['velocity'])
+            fig2.add_trace(go.Scattergl(
+                x=velocity_t,
+                y=velocity,
                 name="Velocity (m/s)",
                 line=dict(color='#ff7f0e')
             ))
         
-        if data['hr']:
-            fig2.add_trace(go.Scatter(
-                x=time_axis[:len(data['hr'])],
-                y=data['hr'],
+        if data['hr'] is not None:
+            hr_t, hr = lttb(np.arange(len(data['hr'])), data['hr'])
+            fig2.add_trace(go.Scattergl(
+                x=hr_t,
+                y=hr,
                 name="HR (bpm)",
                 line=dict(color='#d62728'),
                 yaxis='y2'
@@ -179,18 +283,140 @@ def plot_dive_profile(dive_id):
             ),
             height=250,
             margin=dict(l=20, r=20, t=40, b=20),
-            hovermode='x unified'
+            hovermode='x unified',
+            transition={'duration': 0},
+            uirevision='static'
         )
+    
+    return fig, fig2
+
+def plot_dive_profile(dive_id):
+    """Plot dive depth, velocity, and HR"""
+    figures = build_profile_figures(dive_id)
+    
+    if figures is None:
+        st.info("No profile data available for this dive")
+        return
+    
+    fig, fig2 = figures
+    # Stable keys keep the same chart element across reruns
+    st.plotly_chart(fig, use_container_width=True, key=f"profile_plot_{dive_id}")
+    if fig2 is not None:
+        st.plotly_chart(fig2, use_container_width=True, key=f"profile_rates_{dive_id}")
+
+@st.fragment
+def render_dive_card(dive, is_labeled):
+    """One dive card; its buttons and inputs rerun only this card"""
+    card_class = "labeled" if is_labeled else "unlabeled"
+    
+    with st.container():
+        st.markdown(f'<div class="dive-card {card_class}">', unsafe_allow_html=True)
+        
+        # Header
+        col1, col2, col3 = st.columns([3, 1, 1])
+        with col1:
+            st.markdown(f"**Dive #{dive['dive_number']}** · {dive['start_time_display']}")
+        with col2:
+            if is_labeled:
+                st.markdown("✅ **Labeled**")
+            else:
+                st.markdown("⏳ **Unlabeled**")
+        
+        # Metrics
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Max Depth", f"{dive['max_depth']:.1f}m" if dive['max_depth'] is not None else "N/A")
+        with col2:
+            st.metric("Time", f"{dive['total_duration']:.0f}s" if dive['total_duration'] is not None else "N/A")
+        with col3:
+            st.metric("Avg HR", f"{dive['avg_hr']:.0f}" if dive['avg_hr'] is not None else "N/A")
+        with col4:
+            st.metric("Descent", f"{dive['avg_descent_rate']:.2f}m/s" if dive['avg_descent_rate'] is not None else "N/A")
+        
+        # AI suggestion
+        if dive['ai_discipline'] is not None or dive['ai_lung_volume'] is not None:
+            ai_disc = dive['ai_discipline'] or '?'
+            ai_disc_conf = dive['ai_discipline_confidence'] or 0
+            ai_lung = dive['ai_lung_volume'] or '?'
+            ai_lung_conf = dive['ai_lung_confidence'] or 0
+            
+            st.markdown(f"""
+            **🤖 AI Suggestion:**  
+            Discipline: {ai_disc.upper()} ({ai_disc_conf:.0f}% confidence) · 
+            Lung: {ai_lung.title()} ({ai_lung_conf:.0f}% confidence)
+            """)
+        
+        # Show current labels
+        if is_labeled:
+            current_disc = dive['manual_discipline'] or dive['ai_discipline'] or 'Not set'
+            current_lung = dive['manual_lung_volume'] or dive['ai_lung_volume'] or 'Not set'
+            st.markdown(f"**Current:** {current_disc.upper()} · {current_lung.title()}")
+            
+            if dive['manual_notes']:
+                st.markdown(f"*Notes: {dive['manual_notes']}*")
+        
+        # Labeling form
+        with st.expander("🏷️ Label this dive" if not is_labeled else "✏️ Edit labels"):
+            # Show dive profile
+            if st.button(f"📊 Show Profile", key=f"profile_{dive['id']}"):
+                plot_dive_profile(dive['id'])
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                discipline = st.selectbox(
+                    "Discipline",
+                    options=['', 'FIM', 'CWT', 'CNF', 'STATIC'],
+                    index=0,
+                    key=f"disc_{dive['id']}"
+                )
+            
+            with col2:
+                lung_volume = st.selectbox(
+                    "Lung Volume",
+                    options=['', 'full', 'frc', 'exhale'],
+                    index=0,
+                    key=f"lung_{dive['id']}"
+                )
+            
+            notes = st.text_input(
+                "Notes (optional)",
+                value=dive['manual_notes'] or "",
+                key=f"notes_{dive['id']}"
+            )
+            
+            if st.button(f"💾 Save Labels", key=f"save_{dive['id']}", type="primary"):
+                if discipline or lung_volume:
+                    saved = label_dive(
+                        dive['id'],
+                        discipline=discipline if discipline else None,
+                        lung_volume=lung_volume if lung_volume else None,
+                        notes=notes
+                    )
+                    get_unlabeled_dives.clear()
+                    if saved is None:
+                        st.error("This dive no longer exists")
+                        st.stop()
+                    st.success("✅ Labels saved!")
+                    
+                    # Recalculate baselines (debounced, in the background)
+                    schedule_baseline_update()
+                    
+                    st.rerun()
+                else:
+                    st.warning("Select at least discipline or lung volume")
         
-        st.plotly_chart(fig2, use_container_width=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown("")  # Spacing
+
 
 # Header
 st.title("🏷️ Label Dives")
 st.markdown("Build your personal baseline by labeling dives")
 
-# Get baseline manager
-manager = BaselineManager(str(DB_PATH))
-progress = manager.get_calibration_progress()
+# Baseline manager for this rerun's reads (on the page's cached connection)
+manager = BaselineManager(str(DB_PATH), conn=get_db_connection())
+progress = load_calibration_progress(manager)
 
 # Calibration progress
 st.markdown("### 📊 Calibration Progress")
@@ -239,132 +465,28 @@ with col2:
     dives_to_show = st.slider("Dives to show", 5, 50, 20)
 
 # Get dives
-dives = get_unlabeled_dives(limit=dives_to_show)
+dives = get_unlabeled_dives(limit=dives_to_show, show_labeled=show_labeled)
 
-if dives.empty:
-    st.warning("No dives found. Sync from Garmin first!")
+if not dives:
+    if show_labeled:
+        st.warning("No dives found. Sync from Garmin first!")
+    else:
+        st.info("No unlabeled dives. Tick \"Show already labeled\" to edit existing labels.")
 else:
     st.markdown(f"**{len(dives)} dives** (newest first)")
     
     # Process each dive
-    for idx, dive in dives.iterrows():
-        is_labeled = pd.notna(dive['manual_discipline']) or pd.notna(dive['manual_lung_volume'])
-        
-        # Skip labeled dives if filter is off
-        if is_labeled and not show_labeled:
-            continue
-        
-        # Dive card
-        card_class = "labeled" if is_labeled else "unlabeled"
-        
-        with st.container():
-            st.markdown(f'<div class="dive-card {card_class}">', unsafe_allow_html=True)
-            
-            # Header
-            col1, col2, col3 = st.columns([3, 1, 1])
-            with col1:
-                dive_time = datetime.fromisoformat(dive['start_time']).strftime("%b %d, %Y %H:%M")
-                st.markdown(f"**Dive #{dive['dive_number']}** · {dive_time}")
-            with col2:
-                if is_labeled:
-                    st.markdown("✅ **Labeled**")
-                else:
-                    st.markdown("⏳ **Unlabeled**")
-            
-            # Metrics
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Max Depth", f"{dive['max_depth']:.1f}m")
-            with col2:
-                st.metric("Time", f"{dive['total_duration']:.0f}s")
-            with col3:
-                st.metric("Avg HR", f"{dive['avg_hr']:.0f}" if pd.notna(dive['avg_hr']) else "N/A")
-            with col4:
-                st.metric("Descent", f"{dive['avg_descent_rate']:.2f}m/s" if pd.notna(dive['avg_descent_rate']) else "N/A")
-            
-            # AI suggestion
-            if pd.notna(dive['ai_discipline']) or pd.notna(dive['ai_lung_volume']):
-                ai_disc = dive['ai_discipline'] or '?'
-                ai_disc_conf = dive['ai_discipline_confidence'] or 0
-                ai_lung = dive['ai_lung_volume'] or '?'
-                ai_lung_conf = dive['ai_lung_confidence'] or 0
-                
-                st.markdown(f"""
-                **🤖 AI Suggestion:**  
-                Discipline: {ai_disc.upper()} ({ai_disc_conf:.0f}% confidence) · 
-                Lung: {ai_lung.title()} ({ai_lung_conf:.0f}% confidence)
-                """)
-            
-            # Show current labels
-            if is_labeled:
-                current_disc = dive['manual_discipline'] or dive['ai_discipline'] or 'Not set'
-                current_lung = dive['manual_lung_volume'] or dive['ai_lung_volume'] or 'Not set'
-                st.markdown(f"**Current:** {current_disc.upper()} · {current_lung.title()}")
-                
-                if dive['manual_notes']:
-                    st.markdown(f"*Notes: {dive['manual_notes']}*")
-            
-            # Labeling form
-            with st.expander("🏷️ Label this dive" if not is_labeled else "✏️ Edit labels"):
-                # Show dive profile
-                if st.button(f"📊 Show Profile", key=f"profile_{dive['id']}"):
-                    plot_dive_profile(dive['id'])
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    discipline = st.selectbox(
-                        "Discipline",
-                        options=['', 'FIM', 'CWT', 'CNF', 'STATIC'],
-                        index=0,
-                        key=f"disc_{dive['id']}"
-                    )
-                
-                with col2:
-                    lung_volume = st.selectbox(
-                        "Lung Volume",
-                        options=['', 'full', 'frc', 'exhale'],
-                        index=0,
-                        key=f"lung_{dive['id']}"
-                    )
-                
-                notes = st.text_input(
-                    "Notes (optional)",
-                    value=dive['manual_notes'] if pd.notna(dive['manual_notes']) else "",
-                    key=f"notes_{dive['id']}"
-                )
-                
-                if st.button(f"💾 Save Labels", key=f"save_{dive['id']}", type="primary"):
-                    if discipline or lung_volume:
-                        label_dive(
-                            dive['id'],
-                            discipline=discipline if discipline else None,
-                            lung_volume=lung_volume if lung_volume else None,
-                            notes=notes
-                        )
-                        st.success("✅ Labels saved!")
-                        
-                        # Recalculate baselines
-                        success, message = manager.update_user_baselines()
-                        if success:
-                            st.info(f"🧠 {message}")
-                        
-                        st.rerun()
-                    else:
-                        st.warning("Select at least discipline or lung volume")
-            
-            st.markdown('</div>', unsafe_allow_html=True)
-            st.markdown("")  # Spacing
+    for dive in dives:
+        is_labeled = dive['manual_discipline'] is not None or dive['manual_lung_volume'] is not None
+        render_dive_card(dive, is_labeled)
 
 # Update baselines button
 st.markdown("---")
 if st.button("🔄 Recalculate Baselines", type="secondary"):
     with st.spinner("Calculating baselines..."):
-        success, message = manager.update_user_baselines()
+        success, message = recompute_baselines()
         if success:
             st.success(message)
             st.rerun()
         else:
             st.error(message)
-
-manager.close()
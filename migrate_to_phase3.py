@@ -20,6 +20,11 @@ sys.path.insert(0, str(Path(__file__).parent / 'src'))
 from core.baseline_manager import BaselineManager
 
 
+# Stored in PRAGMA user_version once the Phase 3 schema has been applied.
+# Bump it when schema_phase3.sql changes so existing databases re-apply it.
+SCHEMA_VERSION = 5
+
+
 def migrate_database(db_path: str):
     """Run Phase 3 migration"""
     
@@ -28,26 +33,33 @@ def migrate_database(db_path: str):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
-    # Read and execute Phase 3 schema
-    schema_path = Path(__file__).parent / 'src' / 'core' / 'schema_phase3.sql'
-    
-    if not schema_path.exists():
-        print(f"❌ Schema file not found: {schema_path}")
-        return False
-    
-    with open(schema_path) as f:
-        schema_sql = f.read()
+    # Read and execute Phase 3 schema (skipped when already applied)
+    cursor.execute("PRAGMA user_version")
+    schema_version = cursor.fetchone()[0]
     
-    print("📋 Creating Phase 3 tables...")
-    
-    try:
-        # Execute schema (creates tables if not exists)
-        cursor.executescript(schema_sql)
-        conn.commit()
-        print("✅ Tables created successfully")
-    except sqlite3.Error as e:
-        print(f"❌ Error creating tables: {e}")
-        return False
+    if schema_version >= SCHEMA_VERSION:
+        print(f"ℹ️  Phase 3 schema already applied (version {schema_version})")
+    else:
+        schema_path = Path(__file__).parent / 'src' / 'core' / 'schema_phase3.sql'
+        
+        if not schema_path.exists():
+            print(f"❌ Schema file not found: {schema_path}")
+            return False
+        
+        with open(schema_path) as f:
+            schema_sql = f.read()
+        
+        print("📋 Creating Phase 3 tables...")
+        
+        try:
+            # Execute schema (creates tables if not exists)
+            cursor.executescript(schema_sql)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+            print("✅ Tables created successfully")
+        except sqlite3.Error as e:
+            print(f"❌ Error creating tables: {e}")
+            return False
     
     # Check if we need to migrate existing dive_sessions
     cursor.execute("SELECT COUNT(*) FROM dive_sessions")
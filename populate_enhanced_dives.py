@@ -11,16 +11,126 @@ This script:
 
 import sqlite3
 import sys
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+import numpy as np
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 sys.path.insert(0, str(Path(__file__).parent / 'src' / 'analysis'))
 
 from src.analysis.dive_parser import DiveParser
-from src.analysis.discipline_detector import analyze_and_classify_dive
+from src.analysis.discipline_detector import analyze_and_classify_dives
+from src.core import jsonutil
+
+
+# Built once; dive rows are bound to it in batches with executemany
+INSERT_SQL = """
+    INSERT INTO dive_sessions_enhanced (
+        user_id, activity_id, dive_number,
+        start_time, end_time,
+        max_depth, avg_depth,
+        total_duration, descent_duration, bottom_duration, ascent_duration,
+        avg_descent_rate, max_descent_rate,
+        avg_ascent_rate, max_ascent_rate,
+        velocity_variation,
+        avg_hr, max_hr, min_hr,
+        hr_at_surface, hr_at_depth, hr_differential,
+        ai_discipline, ai_discipline_confidence, ai_discipline_evidence,
+        ai_lung_volume, ai_lung_confidence, ai_lung_evidence,
+        depth_profile, velocity_profile, hr_profile,
+        grade, grade_factors
+    ) VALUES (
+        ?, ?, ?,
+        ?, ?,
+        ?, ?,
+        ?, ?, ?, ?,
+        ?, ?,
+        ?, ?,
+        ?,
+        ?, ?, ?,
+        ?, ?, ?,
+        ?, ?, ?,
+        ?, ?, ?,
+        ?, ?, ?,
+        ?, ?
+    )
+"""
+
+
+# Rows buffered before they are written, so the parameter list stays bounded
+INSERT_BATCH_SIZE = 500
+
+# Activities fetched from Garmin Connect concurrently
+FETCH_WORKERS = 4
+
+
+def insert_rows(conn: sqlite3.Connection, rows: list):
+    """Write a batch of dive_row() tuples in one transaction"""
+    with conn:
+        conn.executemany(INSERT_SQL, rows)
+
+
+def _phase(dive, name: str) -> dict:
+    """One PhaseDetector phase of the dive ({} when missing)"""
+    return (dive.phases or {}).get(name) or {}
+
+
+def dive_row(dive, classification: dict, user_id: int, activity_id: int,
+             session_avg_hr: float) -> tuple:
+    """Parameters for INSERT_SQL for one parsed, analyzed and classified dive"""
+    # Garmin's lap start, e.g. "2026-02-24T04:37:44.0"
+    start = datetime.fromisoformat(dive.start_time[:19]) if dive.start_time else None
+    depths = dive.time_series['depth']
+    hrs = dive.time_series['hr']
+    valid_hrs = hrs[~np.isnan(hrs)]
+    descent, bottom, ascent = _phase(dive, 'descent'), _phase(dive, 'bottom'), _phase(dive, 'ascent')
+    discipline, lung = classification['discipline'], classification['lung_volume']
+    
+    return (
+        user_id, activity_id, dive.dive_number,
+        start.isoformat() if start else None,
+        (start + timedelta(seconds=dive.duration)).isoformat() if start else None,
+        dive.max_depth, dive.avg_depth,
+        dive.duration, descent.get('duration'), bottom.get('duration'), ascent.get('duration'),
+        dive.descent_rate, getattr(dive, 'max_descent_rate', None),
+        dive.ascent_rate, getattr(dive, 'max_ascent_rate', None),
+        getattr(dive, 'velocity_cv', None),
+        dive.avg_hr, dive.max_hr, dive.min_hr,
+        float(valid_hrs[0]) if len(valid_hrs) else None,
+        bottom.get('avg_hr'),
+        dive.avg_hr - session_avg_hr if dive.avg_hr is not None else None,
+        discipline['value'], discipline['confidence'], jsonutil.dumps(discipline['evidence']),
+        lung['value'], lung['confidence'], jsonutil.dumps(lung['evidence']),
+        jsonutil.dumps(depths) if len(depths) else None,
+        jsonutil.dumps(dive.velocity_profile) if len(dive.velocity_profile) else None,
+        jsonutil.dumps(dive.hr_profile) if len(dive.hr_profile) else None,
+        None, None  # grade, grade_factors: no grader yet
+    )
+
+
+def process_activity(parser: DiveParser, activity_id: int, garmin_id: int, user_id: int) -> list:
+    """Parse, analyze and classify one activity's dives, returning their INSERT_SQL rows"""
+    print(f"\n🏊 Processing activity {activity_id} (Garmin: {garmin_id})...")
+    
+    # The lung volume detector compares each dive with the session's HR,
+    # so the whole session is parsed (and analyzed) before classifying
+    dives = parser.parse_session(garmin_id, analyze=True)['dives']
+    avg_hrs = [dive.avg_hr for dive in dives if dive.avg_hr]
+    session_avg_hr = float(np.mean(avg_hrs)) if avg_hrs else 0.0
+    
+    rows = []
+    for dive, classification in zip(dives, analyze_and_classify_dives(dives, session_avg_hr)):
+        rows.append(dive_row(dive, classification, user_id, activity_id, session_avg_hr))
+        
+        # Print summary
+        disc = classification['discipline']
+        lung = classification['lung_volume']
+        print(f"    Dive #{dive.dive_number}: {disc['value']} ({disc['confidence']:.0f}%), "
+              f"{lung['value']} ({lung['confidence']:.0f}%)")
+    
+    return rows
 
 
 def populate_dives(db_path: str, user_id: int = 1):
@@ -32,7 +142,7 @@ def populate_dives(db_path: str, user_id: int = 1):
     
     # Get activities
     cursor.execute("""
-        SELECT * FROM activities
+        SELECT id, garmin_activity_id FROM activities
         WHERE activity_type IN ('apnea_diving', 'freediving', 'lap_swimming')
         ORDER BY start_time
     """)
@@ -46,105 +156,46 @@ def populate_dives(db_path: str, user_id: int = 1):
     print(f"📊 Found {len(activities)} activities")
     
     total_dives = 0
+    rows = []
     
-    for activity in activities:
-        activity_id = activity['id']
-        garmin_id = activity['garmin_activity_id']
-        
-        print(f"\n🏊 Processing activity {activity_id} (Garmin: {garmin_id})...")
+    # One parser and Garmin login shared by the workers (logged in here, up
+    # front; the client serializes its token refreshes)
+    parser = DiveParser()
+    parser.login()
+    
+    # Each activity costs two Garmin Connect round trips, so several are
+    # fetched at once; rows are written here, on the single connection
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        futures = {
+            pool.submit(process_activity, parser, activity['id'],
+                        activity['garmin_activity_id'], user_id): activity
+            for activity in activities
+        }
         
-        # Parse dives
-        try:
-            parser = DiveParser(db_path)
-            dives = parser.parse_activity(garmin_id)
+        for future in as_completed(futures):
+            activity_id = futures[future]['id']
             
-            if not dives:
-                print(f"  ⚠️  No dives found")
+            try:
+                activity_rows = future.result()
+            except Exception as e:
+                print(f"  ❌ Error in activity {activity_id}: {e}")
+                import traceback
+                traceback.print_exc()
                 continue
             
-            print(f"  ✅ Found {len(dives)} dives")
+            if not activity_rows:
+                print(f"  ⚠️  No dives found in activity {activity_id}")
+                continue
             
-            # Process each dive
-            for dive in dives:
-                dive_num = dive.dive_number
-                
-                # Run AI classification
-                classification = analyze_and_classify_dive(dive)
-                
-                # Insert into enhanced table
-                cursor.execute("""
-                    INSERT INTO dive_sessions_enhanced (
-                        user_id, activity_id, dive_number,
-                        start_time, end_time,
-                        max_depth, avg_depth,
-                        total_duration, descent_duration, bottom_duration, ascent_duration,
-                        avg_descent_rate, max_descent_rate,
-                        avg_ascent_rate, max_ascent_rate,
-                        velocity_variation,
-                        avg_hr, max_hr, min_hr,
-                        hr_at_surface, hr_at_depth, hr_differential,
-                        ai_discipline, ai_discipline_confidence, ai_discipline_evidence,
-                        ai_lung_volume, ai_lung_confidence, ai_lung_evidence,
-                        depth_profile, velocity_profile, hr_profile,
-                        grade, grade_factors
-                    ) VALUES (
-                        ?, ?, ?,
-                        ?, ?,
-                        ?, ?,
-                        ?, ?, ?, ?,
-                        ?, ?,
-                        ?, ?,
-                        ?,
-                        ?, ?, ?,
-                        ?, ?, ?,
-                        ?, ?, ?,
-                        ?, ?, ?,
-                        ?, ?, ?,
-                        ?, ?
-                    )
-                """, (
-                    user_id, activity_id, dive_num,
-                    dive.start_time.isoformat() if dive.start_time else None,
-                    dive.end_time.isoformat() if dive.end_time else None,
-                    dive.max_depth, dive.avg_depth,
-                    dive.total_duration, dive.descent_duration, dive.bottom_duration, dive.ascent_duration,
-                    dive.descent.avg_velocity if dive.descent else None,
-                    dive.descent.max_velocity if dive.descent else None,
-                    dive.ascent.avg_velocity if dive.ascent else None,
-                    dive.ascent.max_velocity if dive.ascent else None,
-                    dive.descent.velocity_variation if dive.descent else None,
-                    dive.avg_hr, dive.max_hr, dive.min_hr,
-                    dive.hr_at_surface, dive.hr_at_depth, dive.hr_differential,
-                    classification['discipline']['type'],
-                    classification['discipline']['confidence'],
-                    json.dumps(classification['discipline'].get('evidence', {})),
-                    classification['lung_volume']['type'],
-                    classification['lung_volume']['confidence'],
-                    json.dumps(classification['lung_volume'].get('evidence', {})),
-                    json.dumps(dive.depth_profile) if dive.depth_profile else None,
-                    json.dumps(dive.descent.velocity_profile) if dive.descent and dive.descent.velocity_profile else None,
-                    json.dumps(dive.hr_profile) if dive.hr_profile else None,
-                    classification.get('grade'),
-                    json.dumps(classification.get('grade_factors', {}))
-                ))
-                
-                # Print summary
-                disc = classification['discipline']['type']
-                disc_conf = classification['discipline']['confidence']
-                lung = classification['lung_volume']['type']
-                lung_conf = classification['lung_volume']['confidence']
-                
-                print(f"    Dive #{dive_num}: {disc} ({disc_conf:.0f}%), {lung} ({lung_conf:.0f}%)")
-                
-                total_dives += 1
+            print(f"  ✅ Activity {activity_id}: processed {len(activity_rows)} dives")
             
-        except Exception as e:
-            print(f"  ❌ Error: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
+            rows.extend(activity_rows)
+            total_dives += len(activity_rows)
+            if len(rows) >= INSERT_BATCH_SIZE:
+                insert_rows(conn, rows)
+                rows.clear()
     
-    conn.commit()
+    insert_rows(conn, rows)
     conn.close()
     
     print(f"\n✅ Populated {total_dives} dives!")
@@ -1,22 +1,68 @@
 #!/usr/bin/env python3
 """Quick readiness report from synced data"""
 
-import sqlite3
 import os
-from datetime import datetime, timedelta
+import sys
+from bisect import bisect_right
 from pathlib import Path
 
 # Load environment
 from dotenv import load_dotenv
 load_dotenv()
 
+sys.path.insert(0, str(Path(__file__).parent))
+from src.core.db import get_conn
+
 DB_PATH = Path(os.getenv('DATABASE_PATH', 'data/freediving.db'))
 
+# SQL for a "%b" month abbreviation (SQLite's strftime has no %b), so the
+# report's dates are formatted by the query instead of parsed row by row
+MONTH_ABBR_SQL = "substr('JanFebMarAprMayJunJulAugSepOctNovDec', strftime('%m', {0}) * 3 - 2, 3)"
+
+# Report queries, kept constant (values bound as parameters) so repeated
+# reports on the shared connection reuse SQLite's compiled statements
+Q_ACTIVITIES = f"""
+    SELECT {MONTH_ABBR_SQL.format('start_time')} || strftime(' %d, %H:%M', start_time) AS start_label,
+           activity_type, duration, calories, avg_hr, max_hr,
+           json_extract(metadata, '$.activityName') as name
+    FROM activities
+    WHERE activity_type = ?
+    ORDER BY start_time DESC
+    LIMIT ?
+"""
+
+# The 3-day averages ride along on every row (window aggregates), so the
+# detail table and the readiness score come from one query
+Q_METRICS = f"""
+    SELECT {MONTH_ABBR_SQL.format('date')} || strftime(' %d', date) AS date_label,
+           resting_hr, hrv_status, body_battery_charged,
+           sleep_score, stress_avg,
+           AVG(CASE WHEN date >= date('now', :avg_window) THEN body_battery_charged END) OVER () AS avg_battery,
+           AVG(CASE WHEN date >= date('now', :avg_window) THEN sleep_score END) OVER () AS avg_sleep,
+           AVG(CASE WHEN date >= date('now', :avg_window) THEN stress_avg END) OVER () AS avg_stress,
+           AVG(CASE WHEN date >= date('now', :avg_window) THEN resting_hr END) OVER () AS avg_rhr
+    FROM health_metrics
+    WHERE date >= date('now', :window)
+    ORDER BY date DESC
+"""
+
+# Lower bounds of the readiness bands; a score on a boundary belongs to the
+# band above it (READINESS_BANDS has one more entry than this)
+READINESS_THRESHOLDS = (50, 65, 80)
+READINESS_BANDS = (
+    ("🔴 LOW - Focus on recovery, consider rest day",
+     ("Rest day recommended", "Gentle stretching", "Focus on sleep quality tonight")),
+    ("🟡 MODERATE - Light training or technique work",
+     ("Light technique work", "Relaxation drills", "Breathing exercises")),
+    ("💚 GOOD - Ready for training, moderate intensity",
+     ("Standard training session", "CO2/O2 tables", "Moderate depth work")),
+    ("✅ OPTIMAL - Great for depth work or max attempts",
+     ("Push depth limits today", "Try max static/dynamic attempts", "Focus on challenging yourself")),
+)
+
 def get_readiness_report():
     """Generate a readiness report from last 7 days"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cursor = get_conn(DB_PATH).cursor()
     
     print("\n" + "="*60)
     print("🌊 FREEDIVING READINESS REPORT")
@@ -25,65 +71,45 @@ def get_readiness_report():
     # Recent activities
     print("\n📊 RECENT DIVE SESSIONS")
     print("-" * 60)
-    cursor.execute("""
-        SELECT start_time, activity_type, duration, calories, avg_hr, max_hr,
-               json_extract(metadata, '$.activityName') as name
-        FROM activities
-        WHERE activity_type = 'apnea_diving'
-        ORDER BY start_time DESC
-        LIMIT 5
-    """)
-    
-    activities = cursor.fetchall()
-    if activities:
-        for act in activities:
-            date = datetime.fromisoformat(act['start_time']).strftime('%b %d, %H:%M')
-            duration = int(act['duration'] / 60) if act['duration'] else 0
-            hr = f"HR {act['avg_hr']}/{act['max_hr']}" if act['avg_hr'] else ""
-            name = act['name'] or 'Apnea Dive'
-            print(f"  {date}: {name} ({duration} min) {hr}")
-    else:
+    cursor.execute(Q_ACTIVITIES, ('apnea_diving', 5))
+    
+    # Rows are printed as the cursor yields them rather than collected first
+    act = None
+    for act in cursor:
+        date = act['start_label']
+        duration = int(act['duration'] / 60) if act['duration'] else 0
+        hr = f"HR {act['avg_hr']}/{act['max_hr']}" if act['avg_hr'] else ""
+        name = act['name'] or 'Apnea Dive'
+        print(f"  {date}: {name} ({duration} min) {hr}")
+    if act is None:
         print("  No recent dives found")
     
     # Health metrics
     print("\n💓 RECOVERY METRICS (Last 7 days)")
     print("-" * 60)
-    cursor.execute("""
-        SELECT date, resting_hr, hrv_status, body_battery_charged, 
-               sleep_score, stress_avg
-        FROM health_metrics
-        WHERE date >= date('now', '-7 days')
-        ORDER BY date DESC
-    """)
-    
-    metrics = cursor.fetchall()
-    if metrics:
-        print(f"{'Date':<12} {'RHR':>5} {'HRV':>12} {'Battery':>8} {'Sleep':>7} {'Stress':>7}")
-        print("-" * 60)
-        for m in metrics:
-            date = datetime.fromisoformat(m['date']).strftime('%b %d')
-            rhr = m['resting_hr'] or 'N/A'
-            hrv = m['hrv_status'] or 'N/A'
-            battery = f"{m['body_battery_charged']}%" if m['body_battery_charged'] else 'N/A'
-            sleep = m['sleep_score'] or 'N/A'
-            stress = m['stress_avg'] or 'N/A'
-            print(f"{date:<12} {str(rhr):>5} {str(hrv):>12} {str(battery):>8} {str(sleep):>7} {str(stress):>7}")
+    cursor.execute(Q_METRICS, {'window': '-7 days', 'avg_window': '-3 days'})
+    
+    # Streamed as well; the first row is kept for its 3-day averages
+    avg = None
+    for m in cursor:
+        if avg is None:
+            avg = m
+            print(f"{'Date':<12} {'RHR':>5} {'HRV':>12} {'Battery':>8} {'Sleep':>7} {'Stress':>7}")
+            print("-" * 60)
+        date = m['date_label']
+        rhr = m['resting_hr'] or 'N/A'
+        hrv = m['hrv_status'] or 'N/A'
+        battery = f"{m['body_battery_charged']}%" if m['body_battery_charged'] else 'N/A'
+        sleep = m['sleep_score'] or 'N/A'
+        stress = m['stress_avg'] or 'N/A'
+        print(f"{date:<12} {str(rhr):>5} {str(hrv):>12} {str(battery):>8} {str(sleep):>7} {str(stress):>7}")
     
     # Readiness score calculation
     print("\n🎯 TRAINING READINESS")
     print("-" * 60)
     
-    cursor.execute("""
-        SELECT 
-            AVG(body_battery_charged) as avg_battery,
-            AVG(sleep_score) as avg_sleep,
-            AVG(stress_avg) as avg_stress,
-            AVG(resting_hr) as avg_rhr
-        FROM health_metrics
-        WHERE date >= date('now', '-3 days')
-    """)
-    
-    avg = cursor.fetchone()
+    if avg is None:
+        avg = dict.fromkeys(['avg_battery', 'avg_sleep', 'avg_stress', 'avg_rhr'])
     
     battery = avg['avg_battery'] or 0
     sleep = avg['avg_sleep'] or 0
@@ -100,39 +126,17 @@ def get_readiness_report():
     print()
     print(f"  📊 Readiness Score: {readiness:.0f}/100")
     
-    if readiness >= 80:
-        print("  ✅ OPTIMAL - Great for depth work or max attempts")
-    elif readiness >= 65:
-        print("  💚 GOOD - Ready for training, moderate intensity")
-    elif readiness >= 50:
-        print("  🟡 MODERATE - Light training or technique work")
-    else:
-        print("  🔴 LOW - Focus on recovery, consider rest day")
+    status, recommendations = READINESS_BANDS[bisect_right(READINESS_THRESHOLDS, readiness)]
+    print(f"  {status}")
     
     # Recommendations
     print("\n📋 RECOMMENDATIONS")
     print("-" * 60)
     
-    if readiness >= 80:
-        print("  • Push depth limits today")
-        print("  • Try max static/dynamic attempts")
-        print("  • Focus on challenging yourself")
-    elif readiness >= 65:
-        print("  • Standard training session")
-        print("  • CO2/O2 tables")
-        print("  • Moderate depth work")
-    elif readiness >= 50:
-        print("  • Light technique work")
-        print("  • Relaxation drills")
-        print("  • Breathing exercises")
-    else:
-        print("  • Rest day recommended")
-        print("  • Gentle stretching")
-        print("  • Focus on sleep quality tonight")
+    for rec in recommendations:
+        print(f"  • {rec}")
     
     print("\n" + "="*60 + "\n")
-    
-    conn.close()
 
 if __name__ == '__main__':
     get_readiness_report()
@@ -1,25 +1,27 @@
 #!/usr/bin/env python3
 import sys
-import sqlite3
 from pathlib import Path
 import numpy as np
 
 sys.path.insert(0, str(Path(__file__).parent / 'src' / 'analysis'))
 
 from dive_parser import DiveParser
-from discipline_detector import analyze_and_classify_dive
+from discipline_detector import analyze_and_classify_dives
+
+sys.path.insert(0, str(Path(__file__).parent))
+from src.core.db import get_conn
 
 # Get activity
 db_path = Path('data/freediving.db')
-conn = sqlite3.connect(str(db_path))
-cursor = conn.cursor()
-cursor.execute("SELECT garmin_activity_id FROM activities WHERE activity_type = 'apnea_diving' ORDER BY id DESC LIMIT 1")
+cursor = get_conn(db_path).execute(
+    "SELECT garmin_activity_id FROM activities WHERE activity_type = ? ORDER BY id DESC LIMIT 1",
+    ('apnea_diving',)
+)
 activity_id = cursor.fetchone()[0]
-conn.close()
 
 # Parse
 parser = DiveParser()
-session = parser.parse_session(activity_id, analyze=True)
+session = parser.parse_session(activity_id, analyze=True, use_cache=True, verbose=False)
 dives = session['dives']
 
 # Classify
@@ -28,8 +30,7 @@ session_avg_hr = np.mean(avg_hrs)
 
 print(f"Session: {len(dives)} dives, Avg HR: {session_avg_hr:.1f} bpm\n")
 
-for dive in dives:
-    result = analyze_and_classify_dive(dive, session_avg_hr)
+for dive, result in zip(dives, analyze_and_classify_dives(dives, session_avg_hr)):
     disc = result['discipline']
     lung = result['lung_volume']
     
@@ -4,7 +4,68 @@ Discipline Detector - Classify dive discipline (FIM/CWT/CNF)
 """
 
 import numpy as np
-from typing import Dict, Tuple, Optional
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional
+
+
+# Labels scored by each detector; the detectors keep their scores in plain
+# lists indexed by these constants and only label them in the result
+DISCIPLINES = ('FIM', 'CWT', 'CNF')
+FIM, CWT, CNF = range(3)
+LUNG_VOLUMES = ('full', 'frc', 'exhale')
+FULL, FRC, EXHALE = range(3)
+
+
+def _baseline_targets(
+    entries: Dict[str, Dict],
+    field: str,
+    labels: Tuple[str, ...],
+    rel_tol: float,
+    key_fmt: str
+) -> Tuple[np.ndarray, List[str], np.ndarray, np.ndarray]:
+    """
+    Compile a user's per-label baseline values into match arrays
+    
+    Args:
+        entries: Baseline section, e.g. {'FIM': {'avg_descent_rate': 0.5}, ...}
+        field: Value compared against the dive
+        labels: Detector labels (score column order)
+        rel_tol: A dive matches when within rel_tol * value of the target
+        key_fmt: Evidence key for a match, formatted with the lowercased label
+        
+    Returns:
+        (score columns, evidence keys, target values, tolerances); entries
+        without the field or for other labels are left out
+    """
+    names = [name for name, data in entries.items()
+             if name in labels and data.get(field) is not None]
+    values = np.array([entries[name][field] for name in names], dtype=np.float64)
+    cols = np.array([labels.index(name) for name in names], dtype=np.intp)
+    return cols, [key_fmt.format(name.lower()) for name in names], values, values * rel_tol
+
+
+def _classify(labels: Tuple[str, ...], scores: List[float], evidence: Dict) -> Tuple[str, float, Dict]:
+    """Turn positional scores into (label, confidence, evidence)"""
+    # First label wins ties
+    best = max(range(len(scores)), key=scores.__getitem__)
+    max_score = scores[best]
+    
+    evidence['scores'] = dict(zip(labels, scores))
+    
+    # Require minimum score for confident classification
+    if max_score < 40:
+        return ('unknown', max_score, evidence)  # Low confidence
+    
+    # Normalize confidence to 0-100
+    total_possible = 100
+    return (labels[best], min(100, (max_score / total_possible) * 100), evidence)
+
+
+@lru_cache(maxsize=None)
+def _velocity_analyzer():
+    """Shared VelocityAnalyzer for dives whose buoyancy was not precomputed"""
+    from velocity_analyzer import VelocityAnalyzer
+    return VelocityAnalyzer()
 
 
 class DisciplineDetector:
@@ -18,6 +79,17 @@ class DisciplineDetector:
         self.cnf_cv_threshold = 0.20  # Very low variation
         self.cwt_speed_threshold = 0.6  # m/s - faster descent
         
+        # (baseline dict, compiled targets) for the last baseline seen
+        self._compiled_baseline = (None, None)
+    
+    def _rate_targets(self, baseline: Dict):
+        """Descent-rate targets for a baseline, compiled once per baseline dict"""
+        if self._compiled_baseline[0] is not baseline:
+            self._compiled_baseline = (baseline, _baseline_targets(
+                baseline.get('disciplines', {}), 'avg_descent_rate', DISCIPLINES,
+                0.2, '{}_rate_match'))
+        return self._compiled_baseline[1]
+        
     def detect(self, dive, user_baseline: Optional[Dict] = None) -> Tuple[str, float, Dict]:
         """
         Detect discipline with confidence score
@@ -33,24 +105,20 @@ class DisciplineDetector:
             return ('unknown', 0.0, {'reason': 'insufficient_data'})
         
         evidence = {}
-        scores = {
-            'FIM': 0.0,
-            'CWT': 0.0,
-            'CNF': 0.0
-        }
+        scores = [0.0, 0.0, 0.0]  # DISCIPLINES order
         
         # Signal 1: Velocity Variation (strongest signal)
         cv = dive.velocity_cv
         evidence['velocity_cv'] = cv
         
         if cv > self.fim_cv_threshold:
-            scores['FIM'] += 40
+            scores[FIM] += 40
             evidence['fim_cv_match'] = True
         elif cv < self.cnf_cv_threshold:
-            scores['CNF'] += 40
+            scores[CNF] += 40
             evidence['cnf_cv_match'] = True
         else:
-            scores['CWT'] += 30  # Medium variation = fins
+            scores[CWT] += 30  # Medium variation = fins
             evidence['cwt_cv_match'] = True
         
         # Signal 2: Descent Rate
@@ -58,30 +126,19 @@ class DisciplineDetector:
         evidence['descent_rate'] = descent_rate
         
         if descent_rate > self.cwt_speed_threshold:
-            scores['CWT'] += 30
+            scores[CWT] += 30
             evidence['high_speed'] = True
         elif descent_rate < 0.4:
-            scores['CNF'] += 25  # Slow = no fins
+            scores[CNF] += 25  # Slow = no fins
             evidence['slow_speed'] = True
         else:
-            scores['FIM'] += 20  # Medium speed
+            scores[FIM] += 20  # Medium speed
         
         # Signal 3: Rhythmic Pattern (FIM pulls)
-        if hasattr(dive, 'velocity_peaks') and len(dive.velocity_peaks) >= 3:
-            intervals = np.diff(dive.velocity_peaks)
-            
-            if len(intervals) > 0:
-                avg_interval = np.mean(intervals)
-                std_interval = np.std(intervals)
-                
-                # Consistent rhythm (2-4s pull interval)
-                if 2.0 <= avg_interval <= 4.5 and std_interval < 2.0:
-                    scores['FIM'] += 30
-                    evidence['fim_rhythm'] = {
-                        'pull_count': len(dive.velocity_peaks),
-                        'avg_interval': float(avg_interval),
-                        'std_interval': float(std_interval)
-                    }
+        rhythm = self._rhythm(dive)
+        if rhythm:
+            scores[FIM] += 30
+            evidence['fim_rhythm'] = rhythm
         
         # Signal 4: Max Descent Rate (CWT has spikes)
         if hasattr(dive, 'max_descent_rate'):
@@ -89,52 +146,153 @@ class DisciplineDetector:
             evidence['max_descent_rate'] = max_rate
             
             if max_rate > 1.0:
-                scores['CWT'] += 10  # Powerful fin kicks
+                scores[CWT] += 10  # Powerful fin kicks
         
         # Apply user baseline adjustments
         if user_baseline:
             scores = self._apply_baseline(scores, dive, user_baseline, evidence)
         
-        # Determine discipline and confidence
-        max_score = max(scores.values())
-        discipline = max(scores, key=scores.get)
+        return _classify(DISCIPLINES, scores, evidence)
+    
+    def detect_batch(self, dives, user_baseline: Optional[Dict] = None) -> List[Tuple[str, float, Dict]]:
+        """
+        Detect discipline for every dive of a session at once
         
-        # Normalize confidence to 0-100
-        total_possible = 100
-        confidence = min(100, (max_score / total_possible) * 100)
+        The threshold signals (velocity variation, descent rate, max descent
+        rate), the baseline rate matches and the final max/argmax are
+        computed for all dives with NumPy; only the pull-rhythm lookup and
+        the evidence dicts are built per dive. Results are the same as
+        calling detect() on each dive.
         
-        # Require minimum score for confident classification
-        if max_score < 40:
-            discipline = 'unknown'
-            confidence = max_score  # Low confidence
+        Args:
+            dives: Dive objects with velocity analysis
+            user_baseline: Optional user baseline data
+            
+        Returns:
+            List of (discipline, confidence, evidence_dict), in dive order
+        """
+        from dive_parser import Dive
+        
+        results = [('unknown', 0.0, {'reason': 'insufficient_data'}) for _ in dives]
+        if not dives:
+            return results
+        
+        summary = Dive.stack(dives)
+        usable = np.flatnonzero(~np.isnan(summary['velocity_cv'])
+                                & (np.nan_to_num(summary['descent_rate']) != 0))
+        if not len(usable):
+            return results
         
-        evidence['scores'] = scores
+        summary = summary[usable]
+        cv = summary['velocity_cv']
+        rate = summary['descent_rate']
+        max_rate = summary['max_descent_rate']
+        
+        # Signal 1: Velocity Variation
+        fim_cv = cv > self.fim_cv_threshold
+        cnf_cv = ~fim_cv & (cv < self.cnf_cv_threshold)
+        cwt_cv = ~fim_cv & ~cnf_cv
+        
+        # Signal 2: Descent Rate
+        high_speed = rate > self.cwt_speed_threshold
+        slow_speed = ~high_speed & (rate < 0.4)
+        medium_speed = ~high_speed & ~slow_speed
+        
+        # Signal 4: Max Descent Rate
+        fin_kicks = max_rate > 1.0  # NaN (not analyzed) compares False
+        
+        # One column per discipline, in DISCIPLINES order
+        scores = np.column_stack([
+            fim_cv * 40.0 + medium_speed * 20.0,
+            cwt_cv * 30.0 + high_speed * 30.0 + fin_kicks * 10.0,
+            cnf_cv * 40.0 + slow_speed * 25.0,
+        ])
+        
+        # Signal 3: Rhythmic Pattern (per dive; peak stats are precomputed)
+        rhythms = [self._rhythm(dives[i]) for i in usable.tolist()]
+        scores[:, FIM] += [30.0 if rhythm else 0.0 for rhythm in rhythms]
+        
+        # Baseline: descent rate within 20% of the user's typical rate, as
+        # one (dives x targets) comparison
+        match_keys, matches = [], None
+        if user_baseline:
+            cols, match_keys, targets, tols = self._rate_targets(user_baseline)
+            matches = np.abs(rate[:, None] - targets[None, :]) < tols[None, :]
+            scores[:, cols] += matches * 15.0
+        
+        # Classification in one argmax pass (first discipline wins ties, like
+        # max() over the score dict), with the max score gathered from it
+        best = scores.argmax(axis=1)
+        max_score = np.take_along_axis(scores, best[:, None], axis=1)[:, 0]
+        confident = max_score >= 40
+        confidence = np.where(confident, np.minimum(100, (max_score / 100) * 100), max_score)
+        labels = np.where(confident, np.array(DISCIPLINES)[best], 'unknown')
+        
+        for row, i in enumerate(usable.tolist()):
+            dive = dives[i]
+            
+            # Evidence in the same order detect() records it
+            evidence = {'velocity_cv': dive.velocity_cv}
+            if fim_cv[row]:
+                evidence['fim_cv_match'] = True
+            elif cnf_cv[row]:
+                evidence['cnf_cv_match'] = True
+            else:
+                evidence['cwt_cv_match'] = True
+            
+            evidence['descent_rate'] = dive.descent_rate
+            if high_speed[row]:
+                evidence['high_speed'] = True
+            elif slow_speed[row]:
+                evidence['slow_speed'] = True
+            
+            if rhythms[row]:
+                evidence['fim_rhythm'] = rhythms[row]
+            
+            if hasattr(dive, 'max_descent_rate'):
+                evidence['max_descent_rate'] = dive.max_descent_rate
+            
+            for key, matched in zip(match_keys, matches[row].tolist() if match_keys else ()):
+                if matched:
+                    evidence[key] = True
+            
+            evidence['scores'] = dict(zip(DISCIPLINES, scores[row].tolist()))
+            results[i] = (str(labels[row]), float(confidence[row]), evidence)
         
-        return (discipline, confidence, evidence)
+        return results
+    
+    def _rhythm(self, dive) -> Optional[Dict]:
+        """Pull-rhythm evidence when the velocity peaks show a steady FIM pull"""
+        # (peak_stats is set by VelocityAnalyzer; None below 3 peaks)
+        peak_stats = getattr(dive, 'peak_stats', None)
+        
+        # Consistent rhythm (2-4s pull interval)
+        if (peak_stats and 2.0 <= peak_stats['avg_interval'] <= 4.5
+                and peak_stats['std_interval'] < 2.0):
+            return {
+                'pull_count': peak_stats['count'],
+                'avg_interval': peak_stats['avg_interval'],
+                'std_interval': peak_stats['std_interval']
+            }
+        return None
     
     def _apply_baseline(
         self, 
-        scores: Dict, 
+        scores: List[float], 
         dive, 
         baseline: Dict, 
         evidence: Dict
-    ) -> Dict:
+    ) -> List[float]:
         """Apply user-specific baseline adjustments"""
         
-        # Compare to user's known patterns
-        if 'disciplines' in baseline:
-            user_disciplines = baseline['disciplines']
-            
-            # Check if descent rate matches user's typical FIM/CWT/CNF
-            for disc, disc_data in user_disciplines.items():
-                if 'avg_descent_rate' in disc_data:
-                    user_rate = disc_data['avg_descent_rate']
-                    rate_diff = abs(dive.descent_rate - user_rate)
-                    
-                    # Within 20% of user's typical rate
-                    if rate_diff < user_rate * 0.2:
-                        scores[disc] += 15
-                        evidence[f'{disc.lower()}_rate_match'] = True
+        # Check if descent rate is within 20% of the user's typical FIM/CWT/CNF
+        cols, keys, targets, tols = self._rate_targets(baseline)
+        matches = np.abs(dive.descent_rate - targets) < tols
+        
+        for col, key, matched in zip(cols.tolist(), keys, matches.tolist()):
+            if matched:
+                scores[col] += 15
+                evidence[key] = True
         
         return scores
 
@@ -150,6 +308,17 @@ class LungVolumeDetector:
         self.exhale_hr_diff_threshold = -18  # 18+ bpm below = exhale
         self.buoyancy_acceleration_threshold = 0.1  # m/s²
         
+        # (baseline dict, compiled targets) for the last baseline seen
+        self._compiled_baseline = (None, None)
+    
+    def _hr_targets(self, baseline: Dict):
+        """Per-lung-volume HR targets for a baseline, compiled once per baseline dict"""
+        if self._compiled_baseline[0] is not baseline:
+            self._compiled_baseline = (baseline, _baseline_targets(
+                baseline.get('lung_volumes', {}), 'avg_hr', LUNG_VOLUMES,
+                0.1, '{}_hr_match'))
+        return self._compiled_baseline[1]
+        
     def detect(
         self, 
         dive, 
@@ -171,11 +340,7 @@ class LungVolumeDetector:
             return ('unknown', 0.0, {'reason': 'no_hr_data'})
         
         evidence = {}
-        scores = {
-            'full': 0.0,
-            'frc': 0.0,
-            'exhale': 0.0
-        }
+        scores = [0.0, 0.0, 0.0]  # LUNG_VOLUMES order
         
         # Signal 1: HR Difference from Session Average (STRONGEST)
         hr_diff = dive.avg_hr - session_avg_hr
@@ -184,16 +349,16 @@ class LungVolumeDetector:
         evidence['session_avg_hr'] = session_avg_hr
         
         if hr_diff < self.exhale_hr_diff_threshold:
-            scores['exhale'] += 50
+            scores[EXHALE] += 50
             evidence['very_low_hr'] = True
         elif hr_diff < self.frc_hr_diff_threshold:
-            scores['frc'] += 50
+            scores[FRC] += 50
             evidence['low_hr'] = True
         elif hr_diff > 5:
-            scores['full'] += 40
+            scores[FULL] += 40
             evidence['high_hr'] = True
         else:
-            scores['full'] += 20  # Slight elevation = likely full
+            scores[FULL] += 20  # Slight elevation = likely full
         
         # Signal 2: HR Consistency (FRC/Exhale = very stable)
         if dive.max_hr and dive.min_hr:
@@ -201,60 +366,53 @@ class LungVolumeDetector:
             evidence['hr_range'] = hr_range
             
             if hr_range < 10:
-                scores['frc'] += 20
-                scores['exhale'] += 20
+                scores[FRC] += 20
+                scores[EXHALE] += 20
                 evidence['stable_hr'] = True
             elif hr_range > 20:
-                scores['full'] += 15
+                scores[FULL] += 15
                 evidence['variable_hr'] = True
         
         # Signal 3: Buoyancy Indicators
-        from velocity_analyzer import VelocityAnalyzer
-        va = VelocityAnalyzer()
-        buoyancy = va.get_buoyancy_indicators(dive)
+        # (set by VelocityAnalyzer.analyze; computed here only for dives that
+        # were not run through it)
+        buoyancy = getattr(dive, 'buoyancy', None)
+        if buoyancy is None:
+            buoyancy = _velocity_analyzer().get_buoyancy_indicators(dive)
         
         if buoyancy:
             evidence['buoyancy'] = buoyancy
             
-            if 'has_buoyancy_struggle' in buoyancy and buoyancy['has_buoyancy_struggle']:
-                scores['full'] += 25
+            if buoyancy.get('has_buoyancy_struggle'):
+                scores[FULL] += 25
                 evidence['positive_buoyancy'] = True
             
-            if 'acceleration' in buoyancy:
-                accel = buoyancy['acceleration']
-                
+            if (accel := buoyancy.get('acceleration')) is not None:
                 if accel < 0.05:  # Minimal acceleration
-                    scores['frc'] += 15
-                    scores['exhale'] += 10
+                    scores[FRC] += 15
+                    scores[EXHALE] += 10
                     evidence['neutral_buoyancy'] = True
                 
                 # Fast initial descent (negative buoyancy)
-                if 'avg_velocity_0_2m' in buoyancy:
-                    v_initial = buoyancy['avg_velocity_0_2m']
-                    
-                    if v_initial > 0.3:  # Fast start
-                        scores['exhale'] += 20
-                        evidence['fast_initial_descent'] = True
+                if buoyancy.get('avg_velocity_0_2m', 0) > 0.3:  # Fast start
+                    scores[EXHALE] += 20
+                    evidence['fast_initial_descent'] = True
         
         # Signal 4: Bottom Phase HR (if available)
-        if dive.phases and 'bottom' in dive.phases:
-            bottom_hr = dive.phases['bottom'].get('avg_hr')
+        bottom = dive.phases.get('bottom') if dive.phases else None
+        if bottom and (bottom_hr := bottom.get('avg_hr')):
+            evidence['bottom_hr'] = bottom_hr
             
-            if bottom_hr:
-                evidence['bottom_hr'] = bottom_hr
-                
-                # Very low HR at depth = FRC/Exhale
-                if bottom_hr < session_avg_hr * 0.85:
-                    scores['frc'] += 15
-                    scores['exhale'] += 10
-                
-                # Mammalian dive reflex strength
-                if dive.phases['bottom'].get('min_hr'):
-                    min_hr_bottom = dive.phases['bottom']['min_hr']
-                    
-                    if min_hr_bottom < session_avg_hr * 0.75:
-                        scores['exhale'] += 15
-                        evidence['strong_dive_reflex'] = True
+            # Very low HR at depth = FRC/Exhale
+            if bottom_hr < session_avg_hr * 0.85:
+                scores[FRC] += 15
+                scores[EXHALE] += 10
+            
+            # Mammalian dive reflex strength
+            min_hr_bottom = bottom.get('min_hr')
+            if min_hr_bottom and min_hr_bottom < session_avg_hr * 0.75:
+                scores[EXHALE] += 15
+                evidence['strong_dive_reflex'] = True
         
         # Signal 5: Dive Duration (more O2 in full lung)
         if dive.bottom_time:
@@ -267,45 +425,25 @@ class LungVolumeDetector:
         if user_baseline:
             scores = self._apply_baseline(scores, dive, user_baseline, evidence)
         
-        # Determine lung volume and confidence
-        max_score = max(scores.values())
-        lung_volume = max(scores, key=scores.get)
-        
-        # Normalize confidence
-        total_possible = 100
-        confidence = min(100, (max_score / total_possible) * 100)
-        
-        # Require minimum score
-        if max_score < 40:
-            lung_volume = 'unknown'
-            confidence = max_score
-        
-        evidence['scores'] = scores
-        
-        return (lung_volume, confidence, evidence)
+        return _classify(LUNG_VOLUMES, scores, evidence)
     
     def _apply_baseline(
         self,
-        scores: Dict,
+        scores: List[float],
         dive,
         baseline: Dict,
         evidence: Dict
-    ) -> Dict:
+    ) -> List[float]:
         """Apply user baseline adjustments"""
         
-        if 'lung_volumes' in baseline:
-            user_lungs = baseline['lung_volumes']
-            
-            # Compare to user's typical HR for each lung volume
-            for lung, lung_data in user_lungs.items():
-                if 'avg_hr' in lung_data:
-                    user_hr = lung_data['avg_hr']
-                    hr_diff = abs(dive.avg_hr - user_hr)
-                    
-                    # Within 10% of user's typical HR for this lung volume
-                    if hr_diff < user_hr * 0.1:
-                        scores[lung] += 20
-                        evidence[f'{lung}_hr_match'] = True
+        # Within 10% of user's typical HR for each lung volume
+        cols, keys, targets, tols = self._hr_targets(baseline)
+        matches = np.abs(dive.avg_hr - targets) < tols
+        
+        for col, key, matched in zip(cols.tolist(), keys, matches.tolist()):
+            if matched:
+                scores[col] += 20
+                evidence[key] = True
         
         return scores
 
@@ -344,3 +482,39 @@ def analyze_and_classify_dive(
             'evidence': lung_evidence
         }
     }
+
+
+def analyze_and_classify_dives(
+    dives,
+    session_avg_hr: float,
+    user_baseline: Optional[Dict] = None
+) -> List[Dict]:
+    """
+    Classify every dive of a session (batched discipline detection)
+    
+    Returns:
+        One analyze_and_classify_dive()-style dict per dive, in order
+    """
+    discipline_detector = DisciplineDetector()
+    lung_detector = LungVolumeDetector()
+    
+    disciplines = discipline_detector.detect_batch(dives, user_baseline)
+    
+    results = []
+    for dive, (discipline, disc_conf, disc_evidence) in zip(dives, disciplines):
+        lung_vol, lung_conf, lung_evidence = lung_detector.detect(
+            dive, session_avg_hr, user_baseline
+        )
+        results.append({
+            'discipline': {
+                'value': discipline,
+                'confidence': disc_conf,
+                'evidence': disc_evidence
+            },
+            'lung_volume': {
+                'value': lung_vol,
+                'confidence': lung_conf,
+                'evidence': lung_evidence
+            }
+        })
+    return results
@@ -4,23 +4,83 @@ Dive Parser - Extract individual dives from Garmin activity data
 """
 
 import os
+import pickle
+import random
+import sqlite3
 import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
 from dotenv import load_dotenv
-from garminconnect import Garmin
+from garminconnect import Garmin, GarminConnectConnectionError, GarminConnectTooManyRequestsError
 
 # Add parent to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.core.db import get_conn
+from src.core.garmin_tokens import save_tokens, serialize_refresh
 
 load_dotenv()
 
+# Sources whose code decides what a parsed session holds: a cached parse is
+# only reused while they (and the activity's row) are unchanged
+PARSE_CACHE_SOURCES = ('dive_parser.py', 'velocity_analyzer.py', 'phase_detector.py')
+
+# Time-series sample dtype: depth (cm resolution), whole-bpm HR and 1 Hz
+# offsets are exact or well within float32, at half the bytes of float64;
+# a float keeps NaN available for missing HR
+SERIES_DTYPE = np.float32
+
+# Concurrent activity downloads in parse_activities (kept low for Garmin's
+# rate limit), and retries per request with jittered exponential backoff
+FETCH_WORKERS = 4
+FETCH_RETRIES = 3
+FETCH_BACKOFF_S = 2.0
+
+
+# Per-dive summary columns for Dive.stack(); missing values are NaN
+DIVE_SUMMARY_DTYPE = np.dtype([
+    ('dive_number', 'i4'),
+    ('max_depth', 'f8'),
+    ('duration', 'f8'),
+    ('avg_hr', 'f8'),
+    ('max_hr', 'f8'),
+    ('descent_rate', 'f8'),
+    ('ascent_rate', 'f8'),
+    ('max_descent_rate', 'f8'),
+    ('velocity_cv', 'f8'),
+])
+
 
 class Dive:
     """Represents a single dive with all time-series data"""
     
-    def __init__(self, dive_number: int, lap_data: Dict, time_series: List[Dict]):
+    # Fixed attribute set (no per-instance __dict__). The analyzer outputs
+    # velocity_cv, velocity_peaks, peak_stats, max_descent_rate and
+    # max_ascent_rate stay unset until VelocityAnalyzer runs, so hasattr()
+    # still tells whether a dive was analyzed.
+    __slots__ = (
+        'dive_number', 'lap_data', 'time_series',
+        'start_time', 'max_depth', 'avg_depth', 'duration', 'bottom_time', 'surface_interval',
+        'avg_hr', 'max_hr', 'min_hr', 'water_temp',
+        'descent_rate', 'ascent_rate', 'max_descent_rate', 'max_ascent_rate',
+        'phases', 'velocity_profile', 'hr_profile', 'buoyancy',
+        'velocity_cv', 'velocity_peaks', 'peak_stats',
+    )
+    
+    def __init__(self, dive_number: int, lap_data: Dict, time_series: Dict[str, np.ndarray]):
+        """
+        Args:
+            dive_number: 1-based lap number
+            lap_data: Garmin lap summary
+            time_series: Equal-length 'time_offset' (s from dive start),
+                'depth' and 'hr' SERIES_DTYPE arrays; hr is NaN where missing
+        """
         self.dive_number = dive_number
         self.lap_data = lap_data
         self.time_series = time_series
@@ -47,7 +107,24 @@ class Dive:
         self.phases = None
         self.velocity_profile = []
         self.hr_profile = []
+        self.buoyancy = None  # VelocityAnalyzer.get_buoyancy_indicators()
         
+    @property
+    def sample_count(self) -> int:
+        """Number of time-series samples"""
+        return len(self.time_series['depth'])
+    
+    @staticmethod
+    def stack(dives: List['Dive']) -> np.ndarray:
+        """Summaries of several dives as one structured array (DIVE_SUMMARY_DTYPE)"""
+        fields = DIVE_SUMMARY_DTYPE.names
+        rows = [
+            tuple(np.nan if (value := getattr(dive, name, None)) is None else value
+                  for name in fields)
+            for dive in dives
+        ]
+        return np.array(rows, dtype=DIVE_SUMMARY_DTYPE)
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for storage"""
         return {
@@ -65,10 +142,22 @@ class Dive:
             'descent_rate': self.descent_rate,
             'ascent_rate': self.ascent_rate,
             'phases': self.phases,
-            'velocity_profile': self.velocity_profile,
-            'hr_profile': self.hr_profile,
+            'velocity_profile': np.asarray(self.velocity_profile).tolist(),
+            'hr_profile': np.asarray(self.hr_profile).tolist(),
         }
     
+    def to_state(self) -> Dict[str, Any]:
+        """Every set attribute as plain data (what the parse cache stores)"""
+        return {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+    
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'Dive':
+        """Rebuild a Dive from to_state()"""
+        dive = cls.__new__(cls)
+        for name, value in state.items():
+            setattr(dive, name, value)
+        return dive
+    
     def __repr__(self):
         return f"<Dive {self.dive_number}: {self.max_depth:.1f}m, {self.duration:.0f}s>"
 
@@ -86,140 +175,201 @@ class DiveParser:
         if not self.email or not self.password:
             raise ValueError("Garmin credentials required")
         
+        # Token cache shared with GarminSync; login() only falls back to the
+        # credentials (and refreshes the cache) when the tokens don't load
+        # (the parse cache lives in the same database)
+        self.db_path = os.getenv('DATABASE_PATH', 'data/freediving.db')
+        self.tokenstore = str(Path(self.db_path).parent / ".garth")
+        
         self.client = None
+        self._login_lock = threading.Lock()
     
     def login(self):
-        """Login to Garmin Connect"""
-        if self.client is not None:
-            return
-        
-        print("🔐 Logging in to Garmin Connect...")
-        self.client = Garmin(self.email, self.password)
-        self.client.login()
-        print(f"✅ Logged in")
+        """Login to Garmin Connect (once, even when called from several threads)"""
+        with self._login_lock:
+            if self.client is not None:
+                return
+            
+            print("🔐 Logging in to Garmin Connect...")
+            client = Garmin(self.email, self.password)
+            client.login(tokenstore=self.tokenstore)
+            save_tokens(client, self.tokenstore)
+            # Worker threads share the client (parse_activities, populate_enhanced_dives)
+            serialize_refresh(client)
+            self.client = client
+            print(f"✅ Logged in")
+    
+    def _fetch(self, method, activity_id: int):
+        """Call a Garmin client method, retrying rate-limit and connection errors"""
+        for attempt in range(FETCH_RETRIES):
+            try:
+                return method(activity_id)
+            except (GarminConnectTooManyRequestsError, GarminConnectConnectionError) as e:
+                if attempt == FETCH_RETRIES - 1:
+                    raise
+                delay = FETCH_BACKOFF_S * 2 ** attempt * random.uniform(0.5, 1.5)
+                print(f"⚠️  {e} - retrying activity {activity_id} in {delay:.1f}s")
+                time.sleep(delay)
     
-    def parse_activity(self, activity_id: int) -> List[Dive]:
+    def parse_activity(self, activity_id: int, verbose: bool = False) -> List[Dive]:
         """
         Parse a single activity and extract all dives
         
         Args:
             activity_id: Garmin activity ID
+            verbose: Print extraction details and a line per dive
             
         Returns:
             List of Dive objects
         """
+        return list(self.iter_activity(activity_id, verbose))
+    
+    def iter_activity(self, activity_id: int, verbose: bool = False) -> Iterator[Dive]:
+        """
+        Parse a single activity, yielding its dives one at a time
+        
+        Callers that process and store each dive can drop it before the
+        next one is built, instead of holding every profile at once.
+        
+        Args:
+            activity_id: Garmin activity ID
+            verbose: Print extraction details and a line per dive
+                (otherwise a single summary line per activity)
+            
+        Yields:
+            Dive objects in lap order
+        """
         self.login()
         
         print(f"📥 Fetching activity {activity_id}...")
         
-        # Get lap data (individual dive summaries)
-        splits = self.client.get_activity_splits(activity_id)
-        laps = splits.get('lapDTOs', [])
+        # Lap data (individual dive summaries) and detailed time-series data
+        # are independent requests, so they run concurrently
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            splits = pool.submit(self._fetch, self.client.get_activity_splits, activity_id)
+            details = pool.submit(self._fetch, self.client.get_activity_details, activity_id)
+            splits, details = splits.result(), details.result()
         
-        # Get detailed time-series data
-        details = self.client.get_activity_details(activity_id)
+        laps = splits.get('lapDTOs', [])
         metrics = details.get('activityDetailMetrics', [])
         descriptors = {desc['metricsIndex']: desc['key'] 
                       for desc in details.get('metricDescriptors', [])}
         
-        print(f"✅ Found {len(laps)} dives with {len(metrics)} data points")
-        
         # Parse ALL metrics first
         all_dive_metrics = self._extract_all_metrics(metrics, descriptors)
         
-        print(f"   Total metrics extracted: {len(all_dive_metrics)}")
+        print(f"✅ Found {len(laps)} dives with {len(metrics)} data points"
+              + (f"\n   Total metrics extracted: {len(all_dive_metrics['depth'])}" if verbose else ""))
         
-        # Split metrics by lap boundaries
+        # Split metrics by lap boundaries (offsets are sorted, so each
+        # dive's window is a contiguous slice)
+        offsets = all_dive_metrics['time_offset']
         cumulative_time = 0
-        dives = []
         
         for i, lap in enumerate(laps, 1):
             dive_duration = lap.get('duration', 0)
             dive_end_time = cumulative_time + dive_duration
             
             # Extract metrics for this dive's time window
-            dive_metrics = [
-                m for m in all_dive_metrics 
-                if cumulative_time <= m['time_offset'] < dive_end_time
-            ]
+            start, end = np.searchsorted(offsets, [cumulative_time, dive_end_time])
+            dive_metrics = {key: values[start:end] for key, values in all_dive_metrics.items()}
             
             # Adjust time offsets to be relative to dive start
-            for m in dive_metrics:
-                m['time_offset'] -= cumulative_time
+            dive_metrics['time_offset'] = dive_metrics['time_offset'] - cumulative_time
             
             dive = Dive(i, lap, dive_metrics)
-            dives.append(dive)
             
-            print(f"  Dive {i}: {dive.max_depth:.1f}m, {dive.duration:.0f}s, "
-                  f"{len(dive_metrics)} data points")
+            if verbose:
+                print(f"  Dive {i}: {dive.max_depth:.1f}m, {dive.duration:.0f}s, "
+                      f"{dive.sample_count} data points")
             
             cumulative_time = dive_end_time
-        
-        return dives
+            yield dive
     
     def _parse_timestamp(self, timestamp_str: str) -> datetime:
         """Parse Garmin timestamp string"""
-        # Format: "2026-02-24T04:37:44.0"
-        return datetime.fromisoformat(timestamp_str.replace('.0', ''))
+        # Format: "2026-02-24T04:37:44.0" (fractional seconds dropped)
+        return datetime.fromisoformat(timestamp_str[:19])
     
     def _extract_all_metrics(
         self, 
         all_metrics: List[Dict], 
         descriptors: Dict[int, str]
-    ) -> List[Dict]:
+    ) -> Dict[str, np.ndarray]:
         """
         Extract ALL time-series data from activity
         
-        Returns list of dicts with time_offset, depth, hr
+        Returns equal-length 'time_offset', 'depth' and 'hr' arrays
+        (hr is NaN where missing)
         """
-        # Find metric indices
-        depth_idx = next((k for k, v in descriptors.items() if 'depth' in v.lower() and 'direct' in v.lower()), None)
-        hr_idx = next((k for k, v in descriptors.items() if 'heart' in v.lower() and 'direct' in v.lower()), None)
+        # Find metric indices in one pass (first match wins, as before)
+        depth_idx = hr_idx = None
+        for idx, key in descriptors.items():
+            key = key.lower()
+            if 'direct' not in key:
+                continue
+            if depth_idx is None and 'depth' in key:
+                depth_idx = idx
+            if hr_idx is None and 'heart' in key:
+                hr_idx = idx
         
         if depth_idx is None:
             print(f"⚠️  No depth data. Available: {list(descriptors.values())[:5]}")
-            return []
+            return {key: np.empty(0, dtype=SERIES_DTYPE) for key in ('time_offset', 'depth', 'hr')}
         
-        parsed_metrics = []
-        time_offset = 0.0
+        # Samples with a valid depth; Garmin rows can differ in length, so
+        # the columns are pulled out per row rather than as a 2D array
+        rows = [
+            row for metric in all_metrics
+            if (row := metric.get('metrics')) and len(row) > depth_idx
+            and row[depth_idx] is not None
+        ]
+        n = len(rows)
         
-        for metric in all_metrics:
-            if 'metrics' in metric and len(metric['metrics']) > depth_idx:
-                depth = metric['metrics'][depth_idx]
-                hr = metric['metrics'][hr_idx] if hr_idx and hr_idx < len(metric['metrics']) else None
-                
-                # Garmin stores depth, we need to check if it's valid
-                if depth is not None:
-                    parsed_metrics.append({
-                        'time_offset': time_offset,
-                        'depth': depth,
-                        'hr': hr
-                    })
-                    time_offset += 1.0  # 1-second intervals
-        
-        return parsed_metrics
+        depth = np.fromiter((row[depth_idx] for row in rows), dtype=SERIES_DTYPE, count=n)
+        if hr_idx:
+            hr = np.fromiter(
+                (row[hr_idx] if hr_idx < len(row) and row[hr_idx] else np.nan for row in rows),
+                dtype=SERIES_DTYPE, count=n
+            )
+        else:
+            hr = np.full(n, np.nan, dtype=SERIES_DTYPE)
+        
+        return {
+            'time_offset': np.arange(n, dtype=SERIES_DTYPE),  # 1-second intervals
+            'depth': depth,
+            'hr': hr
+        }
     
-    def parse_session(self, activity_id: int, analyze: bool = True) -> Dict[str, Any]:
+    def parse_session(self, activity_id: int, analyze: bool = True,
+                      use_cache: bool = False, verbose: bool = False) -> Dict[str, Any]:
         """
         Parse entire dive session with optional analysis
         
         Args:
             activity_id: Garmin activity ID
             analyze: Run velocity & phase analysis
+            use_cache: Reuse an earlier parse stored in the database instead
+                of downloading and analyzing the activity again (and store
+                this one); it is reparsed when the activity or the parsing
+                code has changed since
+            verbose: Print per-dive extraction and analysis lines
             
         Returns:
             Dict with session info and dives
         """
-        dives = self.parse_activity(activity_id)
+        if use_cache:
+            session = _load_cached_session(self.db_path, activity_id, analyze)
+            if session is not None:
+                print(f"📦 Using cached parse of activity {activity_id} ({session['parsed_at']})")
+                return session
+        
+        dives = self.parse_activity(activity_id, verbose)
         
         if analyze:
-            from velocity_analyzer import VelocityAnalyzer
-            from phase_detector import PhaseDetector
+            velocity_analyzer, phase_detector = _analyzers()
             
-            velocity_analyzer = VelocityAnalyzer()
-            phase_detector = PhaseDetector()
-            
-            print("\n🔬 Analyzing dives...")
+            lines = ["\n🔬 Analyzing dives..."]
             for dive in dives:
                 # Calculate velocities
                 velocity_analyzer.analyze(dive)
@@ -227,18 +377,141 @@ class DiveParser:
                 # Detect phases
                 phase_detector.detect(dive)
                 
-                descent_str = f"{dive.descent_rate:.2f}" if dive.descent_rate else "N/A"
-                ascent_str = f"{dive.ascent_rate:.2f}" if dive.ascent_rate else "N/A"
-                print(f"  Dive {dive.dive_number}: "
-                      f"Descent {descent_str} m/s, "
-                      f"Ascent {ascent_str} m/s")
+                if verbose:
+                    descent_str = f"{dive.descent_rate:.2f}" if dive.descent_rate else "N/A"
+                    ascent_str = f"{dive.ascent_rate:.2f}" if dive.ascent_rate else "N/A"
+                    lines.append(f"  Dive {dive.dive_number}: "
+                                 f"Descent {descent_str} m/s, "
+                                 f"Ascent {ascent_str} m/s")
+            
+            # One write for the whole block
+            if verbose:
+                print("\n".join(lines))
         
-        return {
+        session = {
             'activity_id': activity_id,
             'dive_count': len(dives),
             'dives': dives,
             'parsed_at': datetime.now().isoformat()
         }
+        
+        if use_cache:
+            _store_cached_session(self.db_path, activity_id, analyze, session)
+        
+        return session
+    
+    def parse_activities(self, activity_ids: List[int], analyze: bool = True,
+                         use_cache: bool = False,
+                         max_workers: int = FETCH_WORKERS) -> Dict[int, Dict[str, Any]]:
+        """
+        Parse several sessions, downloading up to max_workers at a time
+        
+        Args:
+            activity_ids: Garmin activity IDs
+            analyze: Run velocity & phase analysis
+            use_cache: Reuse (and store) parses in the database
+            max_workers: Concurrent activity downloads
+            
+        Returns:
+            Dict of activity_id -> parse_session() result, in input order
+        """
+        sessions = {}
+        pending = []
+        for activity_id in activity_ids:
+            session = _load_cached_session(self.db_path, activity_id, analyze) if use_cache else None
+            if session is not None:
+                sessions[activity_id] = session
+            else:
+                pending.append(activity_id)
+        
+        if pending:
+            # Log in once up front rather than racing in the workers
+            self.login()
+            
+            # The cache is read and written here, on the calling thread, so the
+            # shared connection is never used from the pool
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(self.parse_session, activity_id, analyze, False): activity_id
+                    for activity_id in pending
+                }
+                for future in as_completed(futures):
+                    activity_id = futures[future]
+                    sessions[activity_id] = future.result()
+                    if use_cache:
+                        _store_cached_session(self.db_path, activity_id, analyze, sessions[activity_id])
+        
+        return {activity_id: sessions[activity_id] for activity_id in activity_ids}
+
+
+@lru_cache(maxsize=None)
+def _analyzers():
+    """Shared (VelocityAnalyzer, PhaseDetector) for every parsed session"""
+    from velocity_analyzer import VelocityAnalyzer
+    from phase_detector import PhaseDetector
+    return VelocityAnalyzer(), PhaseDetector()
+
+
+@lru_cache(maxsize=None)
+def _code_version() -> int:
+    """Checksum of PARSE_CACHE_SOURCES (read once per process)"""
+    checksum = 0
+    for name in PARSE_CACHE_SOURCES:
+        checksum = zlib.crc32((Path(__file__).parent / name).read_bytes(), checksum)
+    return checksum
+
+
+def _cache_key(conn: sqlite3.Connection, activity_id: int) -> int:
+    """
+    Version a cached parse must carry to be reused
+    
+    Checksum of the parsing code and of the activity's stored metadata, so
+    editing the parser/analyzers or re-syncing a changed activity both
+    invalidate the parse (stored in parsed_sessions.schema_version).
+    """
+    row = conn.execute(
+        "SELECT metadata FROM activities WHERE garmin_activity_id = ?", (activity_id,)
+    ).fetchone()
+    metadata = row['metadata'] if row and row['metadata'] else ''
+    return zlib.crc32(metadata.encode(), _code_version())
+
+
+def _load_cached_session(db_path: str, activity_id: int, analyzed: bool) -> Optional[Dict[str, Any]]:
+    """Cached parse_session() result, or None (the cache is best-effort)"""
+    try:
+        conn = get_conn(db_path)
+        row = conn.execute(
+            "SELECT session FROM parsed_sessions "
+            "WHERE activity_id = ? AND analyzed = ? AND schema_version = ?",
+            (activity_id, analyzed, _cache_key(conn, activity_id))
+        ).fetchone()
+        if not row:
+            return None
+        session = pickle.loads(zlib.decompress(row['session']))
+        session['dives'] = [Dive.from_state(state) for state in session['dives']]
+        return session
+    except (sqlite3.Error, pickle.UnpicklingError, zlib.error, AttributeError, EOFError,
+            ImportError) as e:
+        print(f"⚠️  Ignoring parse cache: {e}")
+        return None
+
+
+def _store_cached_session(db_path: str, activity_id: int, analyzed: bool, session: Dict[str, Any]):
+    """Store a parse_session() result for later runs"""
+    # Plain data only: a pickled Dive would be bound to the module path it
+    # was imported under (dive_parser vs src.analysis.dive_parser)
+    stored = dict(session, dives=[dive.to_state() for dive in session['dives']])
+    try:
+        conn = get_conn(db_path)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO parsed_sessions "
+                "(activity_id, analyzed, schema_version, parsed_at, session) VALUES (?, ?, ?, ?, ?)",
+                (activity_id, analyzed, _cache_key(conn, activity_id), session['parsed_at'],
+                 sqlite3.Binary(zlib.compress(pickle.dumps(stored, pickle.HIGHEST_PROTOCOL))))
+            )
+    except sqlite3.Error as e:
+        print(f"⚠️  Could not cache parsed session: {e}")
 
 
 if __name__ == '__main__':
@@ -256,7 +529,7 @@ if __name__ == '__main__':
     print(f"🤿 Testing DiveParser with activity {activity_id}\n")
     
     parser = DiveParser()
-    session = parser.parse_session(activity_id, analyze=True)
+    session = parser.parse_session(activity_id, analyze=True, use_cache=True, verbose=True)
     
     print(f"\n✅ Parsed {session['dive_count']} dives")
     
@@ -10,6 +10,9 @@ from typing import Dict, Any, Optional
 class PhaseDetector:
     """
     Detect and classify dive phases from time-series data
+    
+    Holds only its thresholds, so one instance can be reused across a batch
+    of dives (and threads)
     """
     
     def __init__(
@@ -32,14 +35,19 @@ class PhaseDetector:
         Args:
             dive: Dive object with time_series and velocity_profile
         """
-        if not dive.time_series or len(dive.time_series) < 3:
+        if dive.sample_count < 3:
             dive.phases = None
             return
         
-        times = np.array([m['time_offset'] for m in dive.time_series])
-        depths = np.array([m['depth'] for m in dive.time_series])
-        velocities = np.array(dive.velocity_profile) if dive.velocity_profile else np.zeros(len(depths))
-        hrs = np.array([m['hr'] if m['hr'] else np.nan for m in dive.time_series])
+        times = dive.time_series['time_offset']
+        depths = dive.time_series['depth']
+        velocities = np.asarray(dive.velocity_profile) if len(dive.velocity_profile) else np.zeros(len(depths))
+        hrs = dive.time_series['hr']
+        
+        # Phases only look at speed: take |v| once for the whole dive
+        speeds = np.abs(velocities)
+        # Likewise the HR gaps (NaN where the watch had no reading)
+        hr_valid = ~np.isnan(hrs)
         
         # Find phase boundaries
         max_depth_idx = np.argmax(depths)
@@ -54,9 +62,16 @@ class PhaseDetector:
         at_bottom = depths >= bottom_threshold
         bottom_start_idx = descent_end_idx
         
-        # Find where we leave the bottom (descending depth back to threshold)
-        leaving_bottom = np.where(~at_bottom & (np.arange(len(at_bottom)) > max_depth_idx))[0]
-        bottom_end_idx = leaving_bottom[0] if len(leaving_bottom) > 0 else len(depths) - 1
+        # Find where we leave the bottom (descending depth back to threshold):
+        # the first off-bottom sample after the deepest one. argmax on a bool
+        # array stops at the first True, and reading that element back tells
+        # "found at 0" apart from "never leaves" without a separate any() pass
+        bottom_end_idx = len(depths) - 1
+        off_bottom_after = ~at_bottom[max_depth_idx + 1:]
+        if off_bottom_after.size:
+            first_off = int(np.argmax(off_bottom_after))
+            if off_bottom_after[first_off]:
+                bottom_end_idx = max_depth_idx + 1 + first_off
         
         # Ascent: Bottom to surface
         ascent_start_idx = bottom_end_idx
@@ -70,8 +85,9 @@ class PhaseDetector:
                 'descent',
                 times[:descent_end_idx+1],
                 depths[:descent_end_idx+1],
-                velocities[:descent_end_idx+1],
-                hrs[:descent_end_idx+1]
+                speeds[:descent_end_idx+1],
+                hrs[:descent_end_idx+1],
+                hr_valid[:descent_end_idx+1]
             )
         
         # BOTTOM PHASE
@@ -80,8 +96,9 @@ class PhaseDetector:
                 'bottom',
                 times[bottom_start_idx:bottom_end_idx+1],
                 depths[bottom_start_idx:bottom_end_idx+1],
-                velocities[bottom_start_idx:bottom_end_idx+1],
-                hrs[bottom_start_idx:bottom_end_idx+1]
+                speeds[bottom_start_idx:bottom_end_idx+1],
+                hrs[bottom_start_idx:bottom_end_idx+1],
+                hr_valid[bottom_start_idx:bottom_end_idx+1]
             )
         
         # ASCENT PHASE
@@ -90,14 +107,15 @@ class PhaseDetector:
                 'ascent',
                 times[ascent_start_idx:],
                 depths[ascent_start_idx:],
-                velocities[ascent_start_idx:],
-                hrs[ascent_start_idx:]
+                speeds[ascent_start_idx:],
+                hrs[ascent_start_idx:],
+                hr_valid[ascent_start_idx:]
             )
         
         dive.phases = phases
         
         # Also calculate min HR (usually at bottom)
-        valid_hrs = hrs[~np.isnan(hrs)]
+        valid_hrs = hrs[hr_valid]
         if len(valid_hrs) > 0:
             dive.min_hr = float(np.min(valid_hrs))
     
@@ -106,10 +124,11 @@ class PhaseDetector:
         phase_name: str,
         times: np.ndarray,
         depths: np.ndarray,
-        velocities: np.ndarray,
-        hrs: np.ndarray
+        speeds: np.ndarray,
+        hrs: np.ndarray,
+        hr_valid: np.ndarray
     ) -> Dict[str, Any]:
-        """Analyze a single phase and return metrics"""
+        """Analyze a single phase and return metrics (speeds = |velocity|, hr_valid = HR not NaN)"""
         
         if len(times) < 2:
             return {}
@@ -123,13 +142,13 @@ class PhaseDetector:
         }
         
         # Velocity stats
-        valid_velocities = velocities[np.abs(velocities) > 0.01]
-        if len(valid_velocities) > 0:
-            phase_data['avg_velocity'] = float(np.mean(np.abs(valid_velocities)))
-            phase_data['max_velocity'] = float(np.max(np.abs(valid_velocities)))
+        valid_speeds = speeds[speeds > 0.01]
+        if len(valid_speeds) > 0:
+            phase_data['avg_velocity'] = float(np.mean(valid_speeds))
+            phase_data['max_velocity'] = float(np.max(valid_speeds))
         
         # HR stats
-        valid_hrs = hrs[~np.isnan(hrs)]
+        valid_hrs = hrs[hr_valid]
         if len(valid_hrs) > 0:
             phase_data['avg_hr'] = float(np.mean(valid_hrs))
             phase_data['min_hr'] = float(np.min(valid_hrs))
@@ -155,8 +174,6 @@ class PhaseDetector:
         
         # Discipline hints from descent pattern
         if 'descent' in dive.phases:
-            descent = dive.phases['descent']
-            
             # Check for velocity variation (FIM indicator)
             if hasattr(dive, 'velocity_cv'):
                 if dive.velocity_cv > 0.3:
@@ -167,11 +184,10 @@ class PhaseDetector:
                     hints['discipline_hint'] = 'CWT (high speed)'
             
             # Check for rhythmic pulls (FIM)
-            if hasattr(dive, 'velocity_peaks') and len(dive.velocity_peaks) >= 3:
-                intervals = np.diff(dive.velocity_peaks)
-                if len(intervals) > 0 and np.std(intervals) < 2.0:
-                    hints['fim_rhythm_detected'] = True
-                    hints['pull_interval'] = float(np.mean(intervals))
+            peak_stats = getattr(dive, 'peak_stats', None)
+            if peak_stats and peak_stats['std_interval'] < 2.0:
+                hints['fim_rhythm_detected'] = True
+                hints['pull_interval'] = peak_stats['avg_interval']
         
         # Lung volume hints from HR and buoyancy
         if dive.avg_hr and dive.min_hr:
@@ -4,12 +4,15 @@ Velocity Analyzer - Calculate dive velocities and movement patterns
 """
 
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 
 class VelocityAnalyzer:
     """
     Analyze velocity profiles from depth time-series data
+    
+    Holds only its settings, so one instance can be reused across a batch
+    of dives (and threads)
     """
     
     def __init__(self, smoothing_window: int = 3):
@@ -26,38 +29,41 @@ class VelocityAnalyzer:
         Args:
             dive: Dive object with time_series data
         """
-        if not dive.time_series or len(dive.time_series) < 2:
+        if dive.sample_count < 2:
             print(f"⚠️  Dive {dive.dive_number}: Insufficient data for velocity analysis")
             return
         
         # Extract depth and time arrays
-        times = np.array([m['time_offset'] for m in dive.time_series])
-        depths = np.array([m['depth'] for m in dive.time_series])
-        hrs = np.array([m['hr'] if m['hr'] else np.nan for m in dive.time_series])
+        times = dive.time_series['time_offset']
+        depths = dive.time_series['depth']
+        hrs = dive.time_series['hr']
         
         # Calculate instantaneous velocity (m/s)
         # velocity = change in depth / change in time
+        # Negative velocity = descending (increasing depth)
+        # Positive velocity = ascending (decreasing depth)
+        # Samples with no time step (dt <= 0) keep a velocity of 0
         velocities = np.zeros(len(depths))
-        
-        for i in range(1, len(depths)):
-            dt = times[i] - times[i-1]
-            if dt > 0:
-                # Negative velocity = descending (increasing depth)
-                # Positive velocity = ascending (decreasing depth)
-                velocities[i] = -(depths[i] - depths[i-1]) / dt
+        dt = np.diff(times)
+        np.divide(-np.diff(depths), dt, out=velocities[1:], where=dt > 0)
         
         # Smooth velocities to remove noise
         velocities_smooth = self._moving_average(velocities, self.smoothing_window)
         
-        # Store in dive object
-        dive.velocity_profile = velocities_smooth.tolist()
-        dive.hr_profile = hrs.tolist()
+        # Store in dive object (as arrays: the phase detector and buoyancy
+        # indicators consume them as such; Dive.to_dict() makes the lists)
+        dive.velocity_profile = velocities_smooth
+        dive.hr_profile = hrs
         
         # Calculate aggregate metrics
         self._calculate_rates(dive, times, depths, velocities_smooth)
         
-        # Calculate velocity statistics
-        self._calculate_velocity_stats(dive, velocities_smooth)
+        # Calculate velocity statistics (|v| once, shared by the CV and peaks)
+        speeds = np.abs(velocities_smooth)
+        self._calculate_velocity_stats(dive, velocities_smooth, speeds)
+        
+        # Computed once here so the lung volume detector can reuse it
+        dive.buoyancy = self.get_buoyancy_indicators(dive)
     
     def _moving_average(self, data: np.ndarray, window: int) -> np.ndarray:
         """Apply moving average smoothing"""
@@ -66,7 +72,11 @@ class VelocityAnalyzer:
         
         # Pad edges to avoid boundary effects
         padded = np.pad(data, window//2, mode='edge')
-        smoothed = np.convolve(padded, np.ones(window)/window, mode='valid')
+        
+        # Window sums from a running total: O(n) whatever the window size
+        csum = np.cumsum(padded)
+        csum = np.concatenate(([0.0], csum))
+        smoothed = (csum[window:] - csum[:-window]) / window
         
         return smoothed[:len(data)]
     
@@ -106,37 +116,52 @@ class VelocityAnalyzer:
                 dive.ascent_rate = 0
                 dive.max_ascent_rate = 0
     
-    def _calculate_velocity_stats(self, dive, velocities: np.ndarray) -> None:
-        """Calculate velocity variation statistics"""
+    def _calculate_velocity_stats(self, dive, velocities: np.ndarray, speeds: np.ndarray) -> None:
+        """Calculate velocity variation statistics (speeds = np.abs(velocities))"""
         
         # Coefficient of variation (for discipline detection)
-        non_zero_velocities = velocities[np.abs(velocities) > 0.05]  # Ignore near-zero
+        moving = speeds > 0.05  # Ignore near-zero
+        non_zero_velocities = velocities[moving]
         
         if len(non_zero_velocities) > 0:
-            velocity_cv = np.std(non_zero_velocities) / np.mean(np.abs(non_zero_velocities))
+            velocity_cv = np.std(non_zero_velocities) / np.mean(speeds[moving])
             dive.velocity_cv = velocity_cv
         else:
             dive.velocity_cv = 0
         
         # Detect rhythmic patterns (for FIM detection)
         # Look for peaks in velocity (pull moments)
-        dive.velocity_peaks = self._detect_peaks(velocities)
+        dive.velocity_peaks = self._detect_peaks(speeds)
+        
+        # Pull rhythm, computed once for the phase and discipline detectors
+        dive.peak_stats = self._peak_stats(dive.velocity_peaks)
     
-    def _detect_peaks(self, velocities: np.ndarray, threshold: float = 0.1) -> List[int]:
+    def _detect_peaks(self, speeds: np.ndarray, threshold: float = 0.1) -> List[int]:
         """
         Detect peaks in velocity profile (for FIM pull detection)
         
+        Args:
+            speeds: Absolute velocities (np.abs of the smoothed profile)
+        
         Returns indices of peaks
         """
-        peaks = []
+        # Interior samples whose speed clears the threshold and both neighbours
+        mid = speeds[1:-1]
+        is_peak = (mid > threshold) & (mid > speeds[:-2]) & (mid > speeds[2:])
         
-        for i in range(1, len(velocities) - 1):
-            if (abs(velocities[i]) > threshold and 
-                abs(velocities[i]) > abs(velocities[i-1]) and 
-                abs(velocities[i]) > abs(velocities[i+1])):
-                peaks.append(i)
-        
-        return peaks
+        return (np.flatnonzero(is_peak) + 1).tolist()
+    
+    def _peak_stats(self, peaks: List[int]) -> Optional[Dict[str, float]]:
+        """Pull count and peak interval mean/std (None with fewer than 3 peaks)"""
+        if len(peaks) < 3:
+            return None
+        
+        intervals = np.diff(peaks)
+        return {
+            'count': len(peaks),
+            'avg_interval': float(np.mean(intervals)),
+            'std_interval': float(np.std(intervals)),
+        }
     
     def get_buoyancy_indicators(self, dive) -> Dict[str, float]:
         """
@@ -145,11 +170,11 @@ class VelocityAnalyzer:
         Returns:
             Dict with buoyancy metrics
         """
-        if not dive.time_series or len(dive.time_series) < 10:
+        if dive.sample_count < 10:
             return {}
         
-        depths = np.array([m['depth'] for m in dive.time_series])
-        velocities = np.array(dive.velocity_profile)
+        depths = dive.time_series['depth']
+        velocities = np.asarray(dive.velocity_profile)
         
         # Analyze 0-2m zone (buoyancy transition)
         zone_0_2m = (depths >= 0) & (depths <= 2.0)
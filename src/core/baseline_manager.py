@@ -8,20 +8,84 @@ This module handles:
 4. Managing calibration state
 """
 
-import sqlite3
 import json
+import sqlite3
+import sys
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple
-import statistics
+
+# Add parent to path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.core.db import connect
+
+
+# Summary of one labeled-dive column per category, aggregated in SQL. Falsy
+# values (NULL/0) are skipped as before; the stdev is rebuilt from the sum
+# of squares (see _grouped_stats)
+GROUPED_STATS_SQL = """
+    SELECT {group} AS category, COUNT(*) AS n, AVG({column}) AS mean,
+           SUM({column} * {column}) AS sum_sq, MIN({column}) AS min, MAX({column}) AS max
+    FROM dive_sessions_enhanced
+    WHERE user_id = ?
+    AND (manual_discipline IS NOT NULL OR manual_lung_volume IS NOT NULL)
+    AND {group} IN ({placeholders})
+    AND {column} IS NOT NULL AND {column} != 0
+    GROUP BY {group}
+"""
+
+# user_profiles column for each baseline calculate_baselines() produces
+BASELINE_COLUMNS = {
+    'baseline_hr_resting': 'baseline_hr_resting',
+    'baseline_hr_full_lung': 'baseline_hr_full_lung',
+    'baseline_hr_frc_lung': 'baseline_hr_frc',
+    'baseline_hr_exhale_lung': 'baseline_hr_exhale',
+    'baseline_descent_fim': 'baseline_descent_fim',
+    'baseline_descent_cwt': 'baseline_descent_cwt',
+    'baseline_descent_cnf': 'baseline_descent_cnf',
+}
+
+# One fixed statement for every update, so sqlite3's statement cache reuses
+# the prepared plan. A baseline that could not be calculated binds NULL and
+# keeps its stored value (named after its BASELINE_COLUMNS column)
+UPDATE_BASELINES_SQL = """
+    UPDATE user_profiles
+    SET baseline_hr_resting = COALESCE(:baseline_hr_resting, baseline_hr_resting),
+        baseline_hr_full_lung = COALESCE(:baseline_hr_full_lung, baseline_hr_full_lung),
+        baseline_hr_frc = COALESCE(:baseline_hr_frc, baseline_hr_frc),
+        baseline_hr_exhale = COALESCE(:baseline_hr_exhale, baseline_hr_exhale),
+        baseline_descent_fim = COALESCE(:baseline_descent_fim, baseline_descent_fim),
+        baseline_descent_cwt = COALESCE(:baseline_descent_cwt, baseline_descent_cwt),
+        baseline_descent_cnf = COALESCE(:baseline_descent_cnf, baseline_descent_cnf),
+        calibration_dives = :calibration_dives,
+        calibration_complete = :calibration_complete,
+        last_calibration_date = :last_calibration_date,
+        updated_at = :updated_at
+    WHERE id = :id
+"""
 
 
 class BaselineManager:
-    """Manages user baselines for personalized dive classification"""
+    """
+    Manages user baselines for personalized dive classification
     
-    def __init__(self, db_path: str):
+    Not thread-safe: a manager runs its queries (and update_user_baselines
+    its write transaction) on a single connection. Use one manager, and one
+    connection, per thread.
+    """
+    
+    def __init__(self, db_path: str, conn: Optional[sqlite3.Connection] = None):
+        """
+        Args:
+            db_path: Database file
+            conn: Borrow an open connection (with row_factory = sqlite3.Row)
+                instead of opening one; close() then leaves it open. Lets
+                the dashboard read progress on its cached connection
+                without a new connection per rerun.
+        """
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
+        self._owns_conn = conn is None
+        self.conn = connect(db_path) if conn is None else conn
     
     def get_user_profile(self, username: str = "neko") -> Optional[Dict]:
         """Get user profile with current baselines"""
@@ -34,10 +98,15 @@ class BaselineManager:
     
     def get_labeled_dives(self, user_id: int, 
                          discipline: Optional[str] = None,
-                         lung_volume: Optional[str] = None) -> List[Dict]:
-        """Get all labeled dives for baseline calculation"""
-        query = """
-            SELECT * FROM dive_sessions_enhanced 
+                         lung_volume: Optional[str] = None,
+                         columns: str = "*") -> List[Dict]:
+        """Get all labeled dives for baseline calculation
+
+        columns narrows the SELECT list; baseline math only needs a few
+        summary columns, not the per-second profile JSON.
+        """
+        query = f"""
+            SELECT {columns} FROM dive_sessions_enhanced 
             WHERE user_id = ? 
             AND (manual_discipline IS NOT NULL OR manual_lung_volume IS NOT NULL)
         """
@@ -56,43 +125,61 @@ class BaselineManager:
         cursor = self.conn.execute(query, params)
         return [dict(row) for row in cursor.fetchall()]
     
+    def _grouped_stats(self, user_id: int, group: str, column: str,
+                       categories: List[str]) -> Dict[str, Dict]:
+        """
+        mean/stdev/count/min/max of a labeled-dive column per category
+        
+        One GROUP BY query instead of fetching the dives of each category;
+        categories without usable values are left out.
+        """
+        query = GROUPED_STATS_SQL.format(
+            group=group, column=column, placeholders=', '.join('?' * len(categories))
+        )
+        stats = {}
+        for row in self.conn.execute(query, [user_id, *categories]):
+            n, mean = row['n'], row['mean']
+            # Sample stdev (as statistics.stdev) from the first two moments
+            variance = (row['sum_sq'] - n * mean * mean) / (n - 1) if n > 1 else 0
+            stats[row['category']] = {
+                'mean': mean,
+                'stdev': max(0.0, variance) ** 0.5,
+                'count': n,
+                'min': row['min'],
+                'max': row['max']
+            }
+        return stats
+    
     def calculate_baselines(self, user_id: int) -> Dict:
         """Calculate all baselines from labeled dives"""
         baselines = {}
         
-        # Get all labeled dives
-        all_dives = self.get_labeled_dives(user_id)
+        # Count labeled dives
+        labeled_count = self.conn.execute(
+            """
+            SELECT COUNT(*) FROM dive_sessions_enhanced
+            WHERE user_id = ?
+            AND (manual_discipline IS NOT NULL OR manual_lung_volume IS NOT NULL)
+            """,
+            (user_id,)
+        ).fetchone()[0]
         
-        if not all_dives:
+        if not labeled_count:
             return {"error": "No labeled dives found", "calibration_dives": 0}
         
         # HR baselines by lung volume
+        hr_stats = self._grouped_stats(user_id, 'final_lung_volume', 'avg_hr',
+                                       ['full', 'frc', 'exhale'])
         for lung_type in ['full', 'frc', 'exhale']:
-            dives = self.get_labeled_dives(user_id, lung_volume=lung_type)
-            if dives:
-                hr_values = [d['avg_hr'] for d in dives if d['avg_hr']]
-                if hr_values:
-                    baselines[f'baseline_hr_{lung_type}_lung'] = {
-                        'mean': statistics.mean(hr_values),
-                        'stdev': statistics.stdev(hr_values) if len(hr_values) > 1 else 0,
-                        'count': len(hr_values),
-                        'min': min(hr_values),
-                        'max': max(hr_values)
-                    }
+            if lung_type in hr_stats:
+                baselines[f'baseline_hr_{lung_type}_lung'] = hr_stats[lung_type]
         
         # Descent rate baselines by discipline
+        descent_stats = self._grouped_stats(user_id, 'final_discipline', 'avg_descent_rate',
+                                            ['FIM', 'CWT', 'CNF'])
         for discipline in ['fim', 'cwt', 'cnf']:
-            dives = self.get_labeled_dives(user_id, discipline=discipline.upper())
-            if dives:
-                descent_rates = [d['avg_descent_rate'] for d in dives if d['avg_descent_rate']]
-                if descent_rates:
-                    baselines[f'baseline_descent_{discipline}'] = {
-                        'mean': statistics.mean(descent_rates),
-                        'stdev': statistics.stdev(descent_rates) if len(descent_rates) > 1 else 0,
-                        'count': len(descent_rates),
-                        'min': min(descent_rates),
-                        'max': max(descent_rates)
-                    }
+            if discipline.upper() in descent_stats:
+                baselines[f'baseline_descent_{discipline}'] = descent_stats[discipline.upper()]
         
         # Resting HR from health metrics (if available)
         cursor = self.conn.execute(
@@ -105,7 +192,7 @@ class BaselineManager:
                 'count': 1  # Using aggregate
             }
         
-        baselines['calibration_dives'] = len(all_dives)
+        baselines['calibration_dives'] = labeled_count
         baselines['last_update'] = datetime.now().isoformat()
         
         return baselines
@@ -117,72 +204,61 @@ class BaselineManager:
         Returns:
             (success: bool, message: str)
         """
-        # Get user
-        user = self.get_user_profile(username)
-        if not user:
-            return False, f"User '{username}' not found"
-        
-        user_id = user['id']
-        
-        # Calculate new baselines
-        baselines = self.calculate_baselines(user_id)
-        
-        if 'error' in baselines:
-            return False, baselines['error']
-        
-        calibration_dives = baselines.pop('calibration_dives')
-        last_update = baselines.pop('last_update')
-        
-        # Determine if calibration is complete (20+ labeled dives)
-        calibration_complete = calibration_dives >= 20
-        
-        # Update user_profiles table
-        update_fields = []
-        update_values = []
-        
-        for key, stats in baselines.items():
-            if key.startswith('baseline_'):
-                update_fields.append(f"{key} = ?")
-                update_values.append(stats['mean'])
-        
-        update_fields.append("calibration_dives = ?")
-        update_values.append(calibration_dives)
-        
-        update_fields.append("calibration_complete = ?")
-        update_values.append(calibration_complete)
-        
-        update_fields.append("last_calibration_date = ?")
-        update_values.append(last_update)
-        
-        update_fields.append("updated_at = ?")
-        update_values.append(datetime.now().isoformat())
-        
-        update_values.append(user_id)
-        
-        query = f"""
-            UPDATE user_profiles 
-            SET {', '.join(update_fields)}
-            WHERE id = ?
-        """
-        
-        self.conn.execute(query, update_values)
-        
-        # Store baseline history
-        self.conn.execute(
-            """
-            INSERT INTO baseline_updates (user_id, dives_analyzed, baseline_data, confidence_score, data_quality)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                user_id,
-                calibration_dives,
-                json.dumps(baselines, indent=2),
-                self._calculate_confidence(calibration_dives, baselines),
-                self._assess_data_quality(calibration_dives, baselines)
+        # The reads and writes share one write transaction: a single commit
+        # (one fsync) for the update, and no other writer can change the
+        # labels between calculating the baselines and storing them
+        with self.conn:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            
+            # Get user
+            user = self.get_user_profile(username)
+            if not user:
+                return False, f"User '{username}' not found"
+            
+            user_id = user['id']
+            
+            # Calculate new baselines
+            baselines = self.calculate_baselines(user_id)
+            
+            if 'error' in baselines:
+                return False, baselines['error']
+            
+            calibration_dives = baselines.pop('calibration_dives')
+            last_update = baselines.pop('last_update')
+            
+            # Determine if calibration is complete (20+ labeled dives)
+            calibration_complete = calibration_dives >= 20
+            
+            # Update user_profiles table
+            params = {
+                col: baselines[key]['mean'] if key in baselines else None
+                for key, col in BASELINE_COLUMNS.items()
+            }
+            params.update(
+                calibration_dives=calibration_dives,
+                calibration_complete=calibration_complete,
+                last_calibration_date=last_update,
+                updated_at=datetime.now().isoformat(),
+                id=user_id,
+            )
+            
+            self.conn.execute(UPDATE_BASELINES_SQL, params)
+            
+            # Store baseline history
+            self.conn.execute(
+                """
+                INSERT INTO baseline_updates (user_id, dives_analyzed, baseline_data, confidence_score, data_quality)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    user_id,
+                    calibration_dives,
+                    json.dumps(baselines, indent=2),
+                    self._calculate_confidence(calibration_dives, baselines),
+                    self._assess_data_quality(calibration_dives, baselines)
+                )
             )
-        )
-        
-        self.conn.commit()
         
         status = "complete" if calibration_complete else "in progress"
         return True, f"Baselines updated! {calibration_dives} dives analyzed. Calibration {status}."
@@ -210,12 +286,14 @@ class BaselineManager:
                 consistency_scores.append(consistency)
         
         if consistency_scores:
-            confidence += statistics.mean(consistency_scores) * 30
+            # Plain float mean: statistics.mean's exact Fraction arithmetic
+            # costs far more than this handful of values warrants
+            confidence += sum(consistency_scores) / len(consistency_scores) * 30
         
         # Coverage score (0-20 points)
         # More baselines = better coverage
         expected_baselines = 6  # 3 HR + 3 descent rates
-        actual = len([k for k in baselines.keys() if k.startswith('baseline_')])
+        actual = sum(1 for k in baselines if k.startswith('baseline_'))
         confidence += (actual / expected_baselines) * 20
         
         return round(confidence, 1)
@@ -260,8 +338,8 @@ class BaselineManager:
             return None
         
         if metric_type == 'hr' and category:
-            field = f'baseline_hr_{category}_lung' if category != 'resting' else 'baseline_hr_resting'
-            return user[field]
+            key = f'baseline_hr_{category}_lung' if category != 'resting' else 'baseline_hr_resting'
+            return user[BASELINE_COLUMNS[key]]
         
         elif metric_type == 'descent_rate' and category:
             field = f'baseline_descent_{category}'
@@ -330,8 +408,10 @@ class BaselineManager:
             return f"🔥 Almost there! Just {remaining} more dives to complete calibration."
     
     def close(self):
-        """Close database connection"""
-        self.conn.close()
+        """Close the manager's connection (a borrowed one is left open)"""
+        if self._owns_conn and self.conn is not None:
+            self.conn.close()
+        self.conn = None
 
 
 # CLI for testing
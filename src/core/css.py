@@ -0,0 +1,33 @@
+"""
+Minification for the dashboards' injected <style> blocks
+
+Streamlit drops any element that a rerun does not emit again, so the global
+stylesheet has to be sent on every rerun (every widget click). Sending it
+only once would unstyle the page after the first interaction. Instead, the
+pages minify the stylesheet once per server process and resend the compact
+copy.
+"""
+
+import re
+
+_STYLE_RE = re.compile(r'(<style[^>]*>)(.*?)(</style>)', re.S | re.I)
+_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_SPACE_RE = re.compile(r'\s+')
+# Whitespace around these is never significant in CSS (':' is left alone: it
+# matters in descendant selectors like "div :hover")
+_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css: str) -> str:
+    """Strip comments and redundant whitespace from a stylesheet"""
+    css = _COMMENT_RE.sub('', css)
+    css = _SPACE_RE.sub(' ', css)
+    css = _PUNCT_RE.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_styles(html: str) -> str:
+    """Minify every <style> block in an HTML snippet, leaving the rest as is"""
+    return _STYLE_RE.sub(
+        lambda m: m.group(1) + minify_css(m.group(2)) + m.group(3), html
+    )
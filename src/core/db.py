@@ -0,0 +1,74 @@
+"""
+SQLite connections for the scripts and the dashboards
+
+Every script used to open and close its own connection (sometimes several per
+run). Opening a connection re-reads the database header and schema and starts
+with a cold page cache, so the scripts share one cached connection per
+database file instead. It is closed automatically at
+interpreter exit.
+
+connect() opens a connection with the same PRAGMAs, so every connection in
+the project is configured in one place.
+"""
+
+import atexit
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+DEFAULT_DB_PATH = Path(__file__).parent.parent.parent / 'data' / 'freediving.db'
+
+
+def connect(db_path: Union[str, Path], autocommit: bool = False) -> sqlite3.Connection:
+    """
+    Open a new connection with the project's PRAGMAs
+
+    For callers that need a connection of their own (the dashboards' cached
+    connections, a BaselineManager writing from another thread); scripts use
+    get_conn() instead.
+
+    Args:
+        db_path: Database file
+        autocommit: Open with isolation_level=None (each statement commits
+            unless inside an explicit BEGIN)
+
+    Returns:
+        sqlite3.Connection with row_factory = sqlite3.Row, usable from any
+        thread (but not from two at once)
+    """
+    conn = sqlite3.connect(str(db_path), check_same_thread=False,
+                           **({'isolation_level': None} if autocommit else {}))
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+        PRAGMA journal_mode = WAL;
+        -- safe with WAL, one fsync less per commit
+        PRAGMA synchronous = NORMAL;
+        PRAGMA temp_store = MEMORY;
+        -- ~20 MB page cache
+        PRAGMA cache_size = -20000;
+        -- read through a 256 MB mapping
+        PRAGMA mmap_size = 268435456;
+    """)
+    return conn
+
+
+@lru_cache(maxsize=None)
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = connect(db_path)
+    atexit.register(conn.close)
+    return conn
+
+
+def get_conn(db_path: Union[str, Path, None] = None) -> sqlite3.Connection:
+    """
+    Get the shared connection for a database file
+
+    Args:
+        db_path: Database file (defaults to data/freediving.db)
+
+    Returns:
+        sqlite3.Connection with row_factory = sqlite3.Row
+    """
+    path = Path(db_path) if db_path else DEFAULT_DB_PATH
+    return _connect(str(path.resolve()))
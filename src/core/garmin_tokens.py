@@ -0,0 +1,72 @@
+"""
+Persist refreshed Garmin tokens back to the shared token cache
+
+Logging in from the token cache (.garth next to the database) refreshes an
+expired access token in memory only. Without writing it back, every later run
+pays the refresh round-trip again, and once the refresh token is rotated the
+cached copy stops working. The sync and the dive parser save the session
+after each login instead.
+
+Both also share one logged-in client between worker threads. The client
+refreshes an expiring token inside whichever request notices it first, so
+serialize_refresh() lets only one thread at a time do that.
+"""
+
+import threading
+
+# Session refresh methods: garminconnect >= 0.3 client, then garth
+_REFRESH_METHODS = ('_refresh_session', 'refresh_oauth2')
+
+
+def _session(client):
+    # garminconnect < 0.3 keeps the session on .garth, newer releases on .client
+    return getattr(client, 'garth', None) or getattr(client, 'client', None)
+
+
+def _current_token(session):
+    return (getattr(session, 'di_token', None) or getattr(session, 'jwt_web', None)
+            or getattr(session, 'oauth2_token', None))
+
+
+def save_tokens(client, tokenstore: str) -> None:
+    """
+    Write a logged-in Garmin client's session tokens to tokenstore
+
+    Best-effort: a failed write only costs a token refresh on the next run.
+
+    Args:
+        client: garminconnect.Garmin after login()
+        tokenstore: Token cache directory passed to login()
+    """
+    try:
+        _session(client).dump(tokenstore)
+    except Exception as e:
+        print(f"⚠️  Could not update token cache {tokenstore}: {e}")
+
+
+def serialize_refresh(client) -> None:
+    """
+    Make a logged-in client's token refresh safe to hit from several threads
+
+    Refreshes run one at a time. A thread that waited behind another thread's
+    refresh reuses the token it produced instead of refreshing (and rotating
+    the refresh token) a second time.
+
+    Args:
+        client: garminconnect.Garmin after login()
+    """
+    session = _session(client)
+    name = next((name for name in _REFRESH_METHODS if hasattr(session, name)), None)
+    if name is None:
+        return
+    refresh = getattr(session, name)
+    lock = threading.Lock()
+
+    def locked_refresh(*args, **kwargs):
+        token = _current_token(session)
+        with lock:
+            if _current_token(session) is not token:
+                return None  # refreshed while this thread waited
+            return refresh(*args, **kwargs)
+
+    setattr(session, name, locked_refresh)
@@ -0,0 +1,35 @@
+"""
+JSON helpers backed by orjson when it is installed
+
+orjson parses the large Garmin metadata/raw_data blobs several times faster
+than the stdlib parser. It is optional: without it these fall back to the
+json module with equivalent results.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def loads(data):
+    """Parse a JSON document from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _default(obj):
+    # NumPy scalars (e.g. values read out of a DataFrame row) and arrays
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> str:
+    """Serialize obj to a compact JSON string (NumPy scalars and arrays are accepted)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj, default=_default)
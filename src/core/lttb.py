@@ -0,0 +1,90 @@
+"""
+LTTB (Largest-Triangle-Three-Buckets) downsampling for chart traces
+
+Plotly ships every point of a trace to the browser. For long histories or
+per-second dive profiles that is far more points than the chart has pixels,
+so traces are reduced to a bounded number of points that keep the visual
+shape (peaks and troughs survive, flat stretches collapse).
+"""
+
+import numpy as np
+
+# Upper bound on points per trace sent to the browser
+MAX_CHART_POINTS = 1000
+
+
+def lttb_indices(x, y, n_out: int = MAX_CHART_POINTS) -> np.ndarray:
+    """
+    Select the indices of the points to keep
+
+    Args:
+        x: Numeric x values (monotonic; use positions or epoch values for dates)
+        y: y values; NaN points are dropped when downsampling is needed
+        n_out: Maximum number of points to keep
+
+    Returns:
+        Sorted integer indices into the original arrays
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    m = len(valid)
+    if m <= n_out:
+        return valid
+
+    xv = x[valid]
+    yv = y[valid]
+
+    # n_out - 2 buckets over the interior points; first/last are always kept
+    edges = np.linspace(1, m - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = m - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average of the next bucket (the last bucket looks at the final point)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = m - 1, m
+        avg_x = xv[next_start:next_end].mean()
+        avg_y = yv[next_start:next_end].mean()
+
+        # Keep the point forming the largest triangle with the previous pick
+        area = np.abs(
+            (xv[a] - avg_x) * (yv[start:end] - yv[a])
+            - (xv[a] - xv[start:end]) * (avg_y - yv[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return valid[selected]
+
+
+def lttb(x, y, n_out: int = MAX_CHART_POINTS):
+    """
+    Downsample a trace, returning (x, y) as NumPy arrays
+
+    x may be any array-like (dates included); the index positions are used
+    as the LTTB x axis when x is not numeric.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+
+    if np.issubdtype(x.dtype, np.number):
+        x_num = x
+    elif np.issubdtype(x.dtype, np.datetime64):
+        x_num = x.astype('datetime64[s]').astype(np.int64)
+    else:
+        x_num = np.arange(len(x))
+
+    idx = lttb_indices(x_num, y, n_out)
+    return x[idx], y[idx]
@@ -1,5 +1,8 @@
 -- Garmin Freediving Coach - Database Schema
 
+-- WAL lets the read-only report scripts run while a sync is writing
+PRAGMA journal_mode = WAL;
+
 CREATE TABLE IF NOT EXISTS activities (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     garmin_activity_id INTEGER UNIQUE,
@@ -83,7 +86,25 @@ CREATE TABLE IF NOT EXISTS training_plans (
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
+-- DiveParser.parse_session results (pickled plain data, zlib-compressed), so
+-- repeat analysis of an activity skips the Garmin download. schema_version
+-- holds the checksum from dive_parser._cache_key (parsing code + activity row)
+CREATE TABLE IF NOT EXISTS parsed_sessions (
+    activity_id INTEGER,
+    analyzed BOOLEAN,
+    schema_version INTEGER,
+    parsed_at DATETIME,
+    session BLOB,
+    PRIMARY KEY (activity_id, analyzed)
+);
+
 CREATE INDEX IF NOT EXISTS idx_activities_type ON activities(activity_type);
+CREATE INDEX IF NOT EXISTS idx_activities_type_id ON activities(activity_type, id DESC);
 CREATE INDEX IF NOT EXISTS idx_activities_start ON activities(start_time);
+CREATE INDEX IF NOT EXISTS idx_activities_type_start ON activities(activity_type, start_time DESC);
 CREATE INDEX IF NOT EXISTS idx_health_date ON health_metrics(date);
+-- GarminSync.sync_days recently-synced check (synced_at within the last hours)
+CREATE INDEX IF NOT EXISTS idx_health_synced ON health_metrics(synced_at);
+-- Resting HR baseline (AVG over the days that have one): index-only scan
+CREATE INDEX IF NOT EXISTS idx_health_resting ON health_metrics(resting_hr) WHERE resting_hr IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_readiness_date ON readiness_scores(date);
@@ -146,6 +146,26 @@ CREATE INDEX IF NOT EXISTS idx_dives_user ON dive_sessions_enhanced(user_id);
 CREATE INDEX IF NOT EXISTS idx_dives_activity ON dive_sessions_enhanced(activity_id);
 CREATE INDEX IF NOT EXISTS idx_dives_discipline ON dive_sessions_enhanced(final_discipline);
 CREATE INDEX IF NOT EXISTS idx_dives_lung ON dive_sessions_enhanced(final_lung_volume);
+-- Per-user baseline aggregation (BaselineManager). Partial: only labeled dives
+-- feed the baselines, so the indexes skip the (usual) unlabeled majority.
+-- idx_dives_labeled_user also covers the labeled-dive COUNT(*)
+DROP INDEX IF EXISTS idx_dives_user_lung;
+DROP INDEX IF EXISTS idx_dives_user_discipline;
+CREATE INDEX IF NOT EXISTS idx_dives_labeled_user ON dive_sessions_enhanced(
+    user_id, manual_discipline, manual_lung_volume
+) WHERE manual_discipline IS NOT NULL OR manual_lung_volume IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_dives_labeled_user_lung ON dive_sessions_enhanced(
+    user_id, final_lung_volume, avg_hr
+) WHERE manual_discipline IS NOT NULL OR manual_lung_volume IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_dives_labeled_user_discipline ON dive_sessions_enhanced(
+    user_id, final_discipline, avg_descent_rate
+) WHERE manual_discipline IS NOT NULL OR manual_lung_volume IS NOT NULL;
+-- Label Dives list order (unlabeled first, newest first): lets the LIMIT walk
+-- the index instead of sorting the whole table
+CREATE INDEX IF NOT EXISTS idx_dives_unlabeled_first ON dive_sessions_enhanced(
+    (CASE WHEN manual_discipline IS NULL AND manual_lung_volume IS NULL THEN 0 ELSE 1 END),
+    start_time DESC
+);
 CREATE INDEX IF NOT EXISTS idx_baselines_user ON baseline_updates(user_id);
 CREATE INDEX IF NOT EXISTS idx_sessions_user ON training_sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_sessions_date ON training_sessions(session_date);
@@ -3,20 +3,111 @@
 Garmin Data Sync - Extract data from Garmin Connect
 """
 
+import atexit
 import os
 import sys
-import json
 import sqlite3
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
-from garminconnect import Garmin
+from garminconnect import Garmin, GarminConnectTooManyRequestsError
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.core import jsonutil
+from src.core.garmin_tokens import save_tokens, serialize_refresh
+
+# Garmin requests in flight at once, across every day of a sync (kept low
+# for Garmin's rate limit); all of them go through one pool of this size
+SYNC_REQUESTS = 4
+
+# sync_days skips past days whose health metrics were synced this recently
+# (today is always fetched: its totals are still changing)
+SYNC_FRESH_HOURS = 12
+
+# Health-metric requests per day: row field -> Garmin client method
+HEALTH_REQUESTS = {
+    'stats': 'get_stats',
+    'hrv': 'get_hrv_data',
+    'sleep': 'get_sleep_data',
+    'stress': 'get_stress_data',
+    'body_battery': 'get_body_battery',
+}
+
+HEALTH_INSERT_SQL = '''
+    INSERT OR REPLACE INTO health_metrics (
+        date, resting_hr, hrv_avg, hrv_status,
+        stress_avg, stress_max,
+        body_battery_charged, body_battery_drained,
+        sleep_score, sleep_duration, sleep_deep, sleep_light, sleep_rem, sleep_awake,
+        spo2_avg, vo2_max,
+        calories_total, steps, intensity_minutes,
+        raw_data, synced_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+
+ACTIVITY_INSERT_SQL = '''
+    INSERT OR REPLACE INTO activities (
+        garmin_activity_id, activity_type,
+        start_time, duration, calories,
+        avg_hr, max_hr, distance,
+        metadata, synced_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+
+SCHEMA_PATH = Path(__file__).parent.parent / 'core' / 'schema.sql'
+
+# Database files whose schema this process has already applied
+_initialized_dbs = set()
+
+# Per-connection settings for the sync's connection. WAL itself is set by
+# schema.sql and persists in the database file; with WAL, synchronous=NORMAL
+# only syncs at checkpoints instead of on every commit
+CONNECTION_PRAGMAS = """
+    PRAGMA synchronous = NORMAL;
+    PRAGMA cache_size = -65536;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA temp_store = MEMORY;
+"""
+
+
+@lru_cache(maxsize=None)
+def _schema_sql():
+    """schema.sql, read once per process"""
+    return SCHEMA_PATH.read_text()
+
+
+def _optional(future):
+    """
+    A request's result, or None when it failed (not every watch has every metric)
+    
+    Rate limiting (429) is not a missing metric: it is raised so the sync
+    stops instead of carrying on into more rejected requests.
+    """
+    try:
+        return future.result()
+    except GarminConnectTooManyRequestsError:
+        raise
+    except Exception:
+        return None
+
+
+def _warnings(lines):
+    """The warning lines among a fetch's log lines"""
+    return [line for line in lines if line.lstrip().startswith("⚠️")]
+
 
 class GarminSync:
+    """
+    Sync Garmin Connect health metrics and activities into SQLite
+    
+    The database runs in WAL mode with synchronous=NORMAL (see
+    CONNECTION_PRAGMAS), so repeated syncs do not stall on an fsync per commit.
+    """
+    
     def __init__(self, email=None, password=None, db_path=None):
         """Initialize Garmin sync"""
         load_dotenv()
@@ -31,6 +122,11 @@ class GarminSync:
         # Ensure data directory exists
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
         
+        # One connection for the instance's lifetime (the dashboard builds the
+        # syncer on one thread and runs syncs on another)
+        self.conn = self._connect()
+        atexit.register(self.close)
+        
         # Initialize database
         self.init_database()
         
@@ -39,6 +135,9 @@ class GarminSync:
 
         # Garmin client (will login on first use)
         self.client = None
+        
+        # Request pool, created on first use (see _requests)
+        self._pool = None
 
     def login(self):
         """Login to Garmin Connect using cached OAuth tokens.
@@ -59,85 +158,208 @@ class GarminSync:
         print("🔐 Loading Garmin tokens from cache...")
         self.client = Garmin(self.email, self.password)
         self.client.login(tokenstore=self.tokenstore)
+        save_tokens(self.client, self.tokenstore)
+        # The request pool's threads share the client
+        serialize_refresh(self.client)
         print(f"✅ Logged in from token cache ({self.tokenstore})")
     
-    def init_database(self):
-        """Initialize SQLite database with schema"""
-        schema_path = Path(__file__).parent.parent / 'core' / 'schema.sql'
+    def _requests(self):
+        """
+        The instance's request pool
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Every Garmin request goes through it, so at most SYNC_REQUESTS are in
+        flight whatever is being synced. Only requests run on it: waiting
+        for results happens on the caller's thread, never inside the pool.
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=SYNC_REQUESTS)
+        return self._pool
+    
+    def _connect(self):
+        """Open a connection to the sync database with CONNECTION_PRAGMAS applied"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.executescript(CONNECTION_PRAGMAS)
+        return conn
+    
+    def close(self):
+        """Close the database connection (and drop any queued requests)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+    
+    def init_database(self):
+        """
+        Initialize SQLite database with schema
         
-        # Read and execute schema
-        with open(schema_path, 'r') as f:
-            schema = f.read()
-            cursor.executescript(schema)
+        Runs once per database file per process, so further instances on
+        the same file (scripts, tests) skip it. It is still applied once per
+        process (not skipped whenever the tables exist) so that indexes and
+        tables added to schema.sql reach existing databases; every statement
+        in it is IF NOT EXISTS.
+        """
+        db_key = str(Path(self.db_path).resolve())
+        if db_key in _initialized_dbs:
+            return
         
-        conn.commit()
-        conn.close()
+        # Execute schema (switches the file to WAL)
+        self.conn.executescript(_schema_sql())
+        self.conn.commit()
+        _initialized_dbs.add(db_key)
         print(f"✅ Database initialized: {self.db_path}")
     
     def sync_date(self, target_date):
         """Sync all data for a specific date"""
         self.login()
         
-        date_str = target_date.strftime('%Y-%m-%d')
-        print(f"\n📅 Syncing data for {date_str}...")
+        health_rows, activity_rows, lines = self._fetch_date(target_date)
+        print("\n".join(lines))
+        self._save(health_rows, activity_rows)
         
-        # Sync health metrics
-        self.sync_health_metrics(target_date)
+        print(f"✅ Sync complete for {target_date.isoformat()}")
+    
+    def _submit_health(self, target_date):
+        """Queue a date's health-metric requests: {HEALTH_REQUESTS field: future}"""
+        pool = self._requests()
+        date_str = target_date.isoformat()
+        return {
+            field: pool.submit(getattr(self.client, method), date_str)
+            for field, method in HEALTH_REQUESTS.items()
+        }
+    
+    def _submit_activities(self, start_date, end_date=None):
+        """Queue the activities request for a date (or, with end_date, a date range)"""
+        return self._requests().submit(
+            self.client.get_activities_by_date,
+            start_date.isoformat(), (end_date or start_date).isoformat())
+    
+    def _fetch_date(self, target_date, verbose=True, with_activities=True):
+        """Fetch a date's health metrics and activities (see _collect_date)"""
+        responses = self._submit_health(target_date)
+        if with_activities:
+            responses['activities'] = self._submit_activities(target_date)
+        return self._collect_date(target_date, responses, verbose)
+    
+    def _collect_date(self, target_date, responses, verbose=True):
+        """
+        Wait for a date's requests and turn them into INSERT rows
         
-        # Sync activities
-        self.sync_activities(target_date)
+        Args:
+            target_date: Date fetched
+            responses: _submit_health() futures, plus 'activities' when the
+                day's activities were requested too (sync_days fetches its
+                whole range in one request instead)
+            verbose: Log a line per fetched record (otherwise one summary
+                line for the day, plus any warnings)
+        
+        Returns:
+            (health rows, activity rows, log lines); the lines are returned
+            rather than printed so the caller decides how days are reported
+        """
+        date_str = target_date.isoformat()
+        health_lines, activity_lines, activity_rows = [], [], []
+        try:
+            health_row = self._health_row(target_date, responses, health_lines)
+            if 'activities' in responses:
+                activity_rows = self._activity_rows(responses['activities'], activity_lines)
+        finally:
+            # Only still queued when a request raised (rate limiting)
+            for response in responses.values():
+                response.cancel()
         
-        print(f"✅ Sync complete for {date_str}")
+        if verbose:
+            lines = [f"\n📅 Syncing data for {date_str}...", *health_lines, *activity_lines]
+        else:
+            health_status = "✅" if health_row else "⚠️"
+            lines = [f"📅 {date_str}: health {health_status}"
+                     + (f"  activities: {len(activity_rows)}" if 'activities' in responses else "")]
+            lines += _warnings(health_lines + activity_lines)
+        return ([health_row] if health_row else []), activity_rows, lines
+    
+    def _fetch_days(self, dates, delay=0, verbose=False, with_activities=True):
+        """
+        Yield _fetch_date() for each date in order
+        
+        Without a delay every day's requests are queued up front; the request
+        pool still runs only SYNC_REQUESTS of them at a time.
+        """
+        if delay > 0:
+            # Paced on purpose: one day at a time
+            for i, target_date in enumerate(dates):
+                if i:
+                    time.sleep(delay)
+                yield self._fetch_date(target_date, verbose, with_activities)
+            return
+        
+        submitted = []
+        for target_date in dates:
+            responses = self._submit_health(target_date)
+            if with_activities:
+                responses['activities'] = self._submit_activities(target_date)
+            submitted.append((target_date, responses))
+        try:
+            for target_date, responses in submitted:
+                yield self._collect_date(target_date, responses, verbose)
+        finally:
+            # Stopped early (rate limited, interrupted): drop the queued days
+            for _, responses in submitted:
+                for response in responses.values():
+                    response.cancel()
+    
+    def _save(self, health_rows, activity_rows):
+        """
+        Write fetched rows in one transaction
+        
+        Each metric and activity write used to commit (and fsync) on its own
+        connection; a whole batch of days now shares one BEGIN IMMEDIATE ...
+        COMMIT on the instance's connection.
+        """
+        if not health_rows and not activity_rows:
+            return
+        
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(HEALTH_INSERT_SQL, health_rows)
+            self.conn.executemany(ACTIVITY_INSERT_SQL, activity_rows)
     
     def sync_health_metrics(self, target_date):
         """Sync health metrics for a date"""
-        date_str = target_date.strftime('%Y-%m-%d')
+        lines = []
+        health_row = self._health_row(target_date, self._submit_health(target_date), lines)
+        print("\n".join(lines))
+        if health_row:
+            self._save([health_row], [])
+    
+    def _health_row(self, target_date, responses, lines):
+        """
+        A date's health metrics as a HEALTH_INSERT_SQL row (None on failure)
+        
+        responses are the _submit_health() futures: the five requests run
+        concurrently, so this waits for the slowest, not the sum.
+        """
+        date_str = target_date.isoformat()
         
         try:
             # Get various health metrics
-            stats = self.client.get_stats(date_str)
+            stats = responses['stats'].result()
             
-            # HRV data
+            # HRV data (not available for all watches)
             hrv_data = None
             hrv_avg = None
             hrv_status = None
-            try:
-                hrv_response = self.client.get_hrv_data(date_str)
-                if hrv_response and 'hrvSummary' in hrv_response:
-                    hrv_summary = hrv_response['hrvSummary']
-                    hrv_avg = hrv_summary.get('lastNightAvg')
-                    hrv_status = hrv_summary.get('status')
-                    hrv_data = hrv_response
-            except:
-                pass  # HRV not available for all watches
-            
-            # Sleep data
-            sleep_data = None
-            try:
-                sleep_data = self.client.get_sleep_data(date_str)
-            except:
-                pass
-            
-            # Stress data
-            stress_data = None
-            try:
-                stress_data = self.client.get_stress_data(date_str)
-            except:
-                pass
-            
-            # Body Battery
-            body_battery = None
-            try:
-                body_battery = self.client.get_body_battery(date_str)
-            except:
-                pass
+            hrv_response = _optional(responses['hrv'])
+            if hrv_response and 'hrvSummary' in hrv_response:
+                hrv_summary = hrv_response['hrvSummary']
+                hrv_avg = hrv_summary.get('lastNightAvg')
+                hrv_status = hrv_summary.get('status')
+                hrv_data = hrv_response
             
-            # Insert into database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # Sleep, stress and Body Battery data
+            sleep_data = _optional(responses['sleep'])
+            stress_data = _optional(responses['stress'])
+            body_battery = _optional(responses['body_battery'])
             
             # Extract sleep data from nested dailySleepDTO
             sleep_dto = sleep_data.get('dailySleepDTO') if sleep_data else None
@@ -156,17 +378,7 @@ class GarminSync:
                 sleep_rem = sleep_dto.get('remSleepSeconds', 0) // 60 if sleep_dto.get('remSleepSeconds') else None
                 sleep_awake = sleep_dto.get('awakeSleepSeconds', 0) // 60 if sleep_dto.get('awakeSleepSeconds') else None
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO health_metrics (
-                    date, resting_hr, hrv_avg, hrv_status,
-                    stress_avg, stress_max,
-                    body_battery_charged, body_battery_drained,
-                    sleep_score, sleep_duration, sleep_deep, sleep_light, sleep_rem, sleep_awake,
-                    spo2_avg, vo2_max,
-                    calories_total, steps, intensity_minutes,
-                    raw_data, synced_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
+            row = (
                 date_str,
                 stats.get('restingHeartRate'),
                 hrv_avg,
@@ -186,109 +398,172 @@ class GarminSync:
                 stats.get('totalKilocalories'),
                 stats.get('totalSteps'),
                 stats.get('intensityMinutesGoal'),
-                json.dumps({
+                jsonutil.dumps({
                     'stats': stats,
                     'hrv': hrv_data,
                     'sleep': sleep_data,
                     'stress': stress_data,
                     'body_battery': body_battery
                 }),
-            ))
-            
-            conn.commit()
-            conn.close()
+            )
             
-            print(f"  ✅ Health metrics saved")
+            lines.append(f"  ✅ Health metrics fetched")
+            return row
             
+        except GarminConnectTooManyRequestsError:
+            raise
         except Exception as e:
-            print(f"  ⚠️  Health metrics failed: {e}")
+            lines.append(f"  ⚠️  Health metrics failed: {e}")
+            return None
     
     def sync_activities(self, target_date):
         """Sync activities for a date"""
-        date_str = target_date.strftime('%Y-%m-%d')
+        lines = []
+        activity_rows = self._activity_rows(self._submit_activities(target_date), lines)
+        print("\n".join(lines))
+        self._save([], activity_rows)
+    
+    def sync_activities_range(self, start_date, end_date):
+        """Sync the activities of every day from start_date to end_date in one request"""
+        self.login()
+        lines = []
+        activity_rows = self._activity_rows(self._submit_activities(start_date, end_date), lines)
+        print("\n".join(lines))
+        self._save([], activity_rows)
+    
+    def _activity_rows(self, response, lines):
+        """A _submit_activities() request's activities as ACTIVITY_INSERT_SQL rows"""
+        rows = []
         
         try:
-            # Get activities for the date
-            activities = self.client.get_activities_by_date(date_str, date_str)
+            # Activities for the date(s); the endpoint pages through the
+            # whole range itself
+            activities = response.result()
             
             if not activities:
-                print(f"  ℹ️  No activities found")
-                return
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+                lines.append(f"  ℹ️  No activities found")
+                return rows
             
             for activity in activities:
-                # Insert activity
-                cursor.execute('''
-                    INSERT OR REPLACE INTO activities (
-                        garmin_activity_id, activity_type,
-                        start_time, duration, calories,
-                        avg_hr, max_hr, distance,
-                        metadata, synced_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (
+                activity_type = activity.get('activityType', {}).get('typeKey')
+                rows.append((
                     activity.get('activityId'),
-                    activity.get('activityType', {}).get('typeKey'),
+                    activity_type,
                     activity.get('startTimeLocal'),
                     activity.get('duration'),
                     activity.get('calories'),
                     activity.get('averageHR'),
                     activity.get('maxHR'),
                     activity.get('distance'),
-                    json.dumps(activity),
+                    jsonutil.dumps(activity),
                 ))
                 
                 activity_name = activity.get('activityName', 'Unknown')
-                activity_type = activity.get('activityType', {}).get('typeKey', 'unknown')
-                print(f"  ✅ Activity: {activity_name} ({activity_type})")
-            
-            conn.commit()
-            conn.close()
+                lines.append(f"  ✅ Activity: {activity_name} ({activity_type or 'unknown'})")
             
+        except GarminConnectTooManyRequestsError:
+            raise
         except Exception as e:
-            print(f"  ⚠️  Activities failed: {e}")
+            lines.append(f"  ⚠️  Activities failed: {e}")
+        
+        return rows
     
-    def sync_days(self, days=7, delay=0):
-        """Sync last N days of data"""
+    def sync_days(self, days=7, delay=0, force=False, verbose=False):
+        """
+        Sync last N days of data
+        
+        Past days synced within SYNC_FRESH_HOURS are skipped unless force.
+        Prints one line per day unless verbose (a line per fetched record).
+        """
         print(f"\n🔄 Syncing last {days} days...")
+        
+        dates = [date.today() - timedelta(days=i) for i in range(days)]
+        skipped = []
+        if not force:
+            fresh = self._fresh_dates()
+            skipped = [d for d in dates[1:] if d.isoformat() in fresh]
+            if skipped:
+                dates = [d for d in dates if d not in skipped]
+                print(f"⏭️  Skipping {len(skipped)} days synced in the last {SYNC_FRESH_HOURS}h (--force to refetch)")
+        
+        if dates:
+            self.login()
+        
+        health_rows, activity_rows = [], []
+        try:
+            if dates:
+                # Activities for the whole range come from one paged request
+                # (instead of one per day), queued ahead of the health days
+                activity_lines = []
+                activities = self._submit_activities(min(dates), max(dates))
+                try:
+                    for day_health, _, lines in self._fetch_days(dates, delay, verbose, with_activities=False):
+                        print("\n".join(lines))
+                        health_rows += day_health
+                    activity_rows = self._activity_rows(activities, activity_lines)
+                finally:
+                    # Stopped early: the range request was queued first, so it
+                    # has usually completed; keep its activities for the save
+                    if (not activity_lines and activities.done() and not activities.cancelled()
+                            and activities.exception() is None):
+                        activity_rows = self._activity_rows(activities, activity_lines)
+                    activities.cancel()
+                
+                if verbose:
+                    print("\n".join(["\n🏊 Activities:", *activity_lines]))
+                else:
+                    print("\n".join([f"🏊 {len(activity_rows)} activities", *_warnings(activity_lines)]))
+        except GarminConnectTooManyRequestsError as e:
+            # Every further request would be rejected too; what was fetched is
+            # saved below, and a rerun skips those (now fresh) days
+            print(f"\n⚠️  Rate limited by Garmin, stopping: {e}")
+            return
+        finally:
+            # One transaction for every fetched day, also when the fetch loop
+            # is interrupted part way
+            self._save(health_rows, activity_rows)
+            print(f"\n💾 Saved {len(health_rows)} health days, {len(activity_rows)} activities")
 
-        for i in range(days):
-            target_date = date.today() - timedelta(days=i)
-            self.sync_date(target_date)
-            if delay > 0 and i < days - 1:
-                time.sleep(delay)
-
-        print(f"\n✅ Sync complete! {days} days synced.")
+        print(f"\n✅ Sync complete! {len(dates)} days synced"
+              + (f", {len(skipped)} skipped as fresh." if skipped else "."))
         self.print_summary()
     
+    def _fresh_dates(self):
+        """
+        Dates (YYYY-MM-DD) whose health metrics were synced within
+        SYNC_FRESH_HOURS and after the day ended; a day synced while it was
+        still running is partial. synced_at is UTC, date is local.
+        """
+        rows = self.conn.execute(
+            "SELECT date FROM health_metrics"
+            " WHERE synced_at > datetime('now', ?)"
+            " AND synced_at >= datetime(date, '+1 day', 'utc')",
+            (f'-{SYNC_FRESH_HOURS} hours',)
+        )
+        return {row[0] for row in rows}
+    
     def print_summary(self):
         """Print database summary"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
-        # Count records
-        cursor.execute("SELECT COUNT(*) FROM health_metrics")
-        health_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM activities")
-        activity_count = cursor.fetchone()[0]
-        
-        # Get date range
-        cursor.execute("SELECT MIN(date), MAX(date) FROM health_metrics")
-        date_range = cursor.fetchone()
+        # Record counts and date range in one query
+        cursor.execute("""
+            WITH h AS (SELECT COUNT(*) AS c, MIN(date) AS mn, MAX(date) AS mx FROM health_metrics),
+                 a AS (SELECT COUNT(*) AS c FROM activities)
+            SELECT h.c, a.c, h.mn, h.mx FROM h, a
+        """)
+        health_count, activity_count, *date_range = cursor.fetchone()
         
-        # Get activity types
+        # Get the top activity types
         cursor.execute("""
             SELECT activity_type, COUNT(*) 
             FROM activities 
             GROUP BY activity_type 
             ORDER BY COUNT(*) DESC
+            LIMIT 5
         """)
         activity_types = cursor.fetchall()
         
-        conn.close()
-        
         print("\n" + "="*50)
         print("📊 DATABASE SUMMARY")
         print("="*50)
@@ -299,7 +574,7 @@ class GarminSync:
         
         if activity_types:
             print("\nActivity breakdown:")
-            for act_type, count in activity_types[:5]:
+            for act_type, count in activity_types:
                 print(f"  - {act_type}: {count}")
         
         print("="*50)
@@ -313,6 +588,8 @@ if __name__ == '__main__':
     parser.add_argument('--delay', type=float, default=0, help='Seconds to sleep between days (default: 0)')
     parser.add_argument('--today', action='store_true', help='Sync only today')
     parser.add_argument('--summary', action='store_true', help='Show database summary')
+    parser.add_argument('--force', action='store_true', help='Refetch days that were synced recently')
+    parser.add_argument('--verbose', action='store_true', help='Print every fetched record, not a line per day')
     
     args = parser.parse_args()
     
@@ -324,4 +601,4 @@ if __name__ == '__main__':
         syncer.sync_date(date.today())
         syncer.print_summary()
     else:
-        syncer.sync_days(args.days, delay=args.delay)
+        syncer.sync_days(args.days, delay=args.delay, force=args.force, verbose=args.verbose)
@@ -11,7 +11,7 @@ import numpy as np
 sys.path.insert(0, str(Path(__file__).parent / 'src' / 'analysis'))
 
 from dive_parser import DiveParser
-from discipline_detector import analyze_and_classify_dive
+from discipline_detector import analyze_and_classify_dives
 
 
 def main():
@@ -30,19 +30,20 @@ def main():
     session = parser.parse_session(activity_id, analyze=True)
     dives = session['dives']
     
-    # Calculate session average HR
-    avg_hrs = [d.avg_hr for d in dives if d.avg_hr]
-    session_avg_hr = np.mean(avg_hrs)
+    # Calculate session average HR, and each dive's offset from it
+    avg_hrs = np.fromiter((d.avg_hr for d in dives if d.avg_hr), dtype=np.float64)
+    session_avg_hr = avg_hrs.mean()
+    hr_deltas = np.fromiter((d.avg_hr or np.nan for d in dives), dtype=np.float64,
+                            count=len(dives)) - session_avg_hr
     
     print(f"Session Average HR: {session_avg_hr:.1f} bpm\n")
     print("="*80)
     
     # Classify each dive
-    for dive in dives:
-        result = analyze_and_classify_dive(dive, session_avg_hr)
+    for dive, hr_delta, result in zip(dives, hr_deltas, analyze_and_classify_dives(dives, session_avg_hr)):
         
         print(f"\n🤿 DIVE #{dive.dive_number} - {dive.max_depth:.1f}m")
-        print(f"   HR: {dive.avg_hr:.0f} bpm ({dive.avg_hr - session_avg_hr:+.0f})")
+        print(f"   HR: {dive.avg_hr:.0f} bpm ({hr_delta:+.0f})")
         
         # Discipline
         disc = result['discipline']